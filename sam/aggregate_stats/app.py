@@ -0,0 +1,162 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import hashlib
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+
+import simplejson as json
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from dl_suggestion_common import (client, core, geohash, geohash_precision,
+                                  log_event, metrics, stats_key, status_keys,
+                                  status_of, table, with_metrics)
+from dl_suggestion_common.stats import NONE
+
+# Keeps the counters behind GET /stats (see dl_suggestion_common.stats) up to
+# date from the table's stream, which only delivers submission records. A
+# change moves a submission from the counters of its old image to those of
+# its new one, and the changes of a whole batch are summed first, so each
+# counter is written once per batch.
+#
+# Only submissions marked stats_counted are counted. ProcessUpload marks them
+# as they are created, and BackfillStats marks those from before the counters
+# existed, which counts them as they were at that moment. So a submission
+# which was never counted isn't taken off the counters when it changes.
+#
+# The counters are written in transactions of up to TRANSACT_CHUNK_SIZE with
+# a ClientRequestToken derived from the batch. When a batch is retried, the
+# transactions which already succeeded are not applied again (for up to 10
+# minutes), so a failure doesn't double count.
+
+# TransactWriteItems accepts at most 100 actions per transaction
+TRANSACT_CHUNK_SIZE = 100
+
+
+@with_metrics('AggregateStats')
+def lambda_handler(event, context):
+    log_event(event)
+    deltas = Counter()
+    for record in event['Records']:
+        old_image = record['dynamodb'].get('OldImage')
+        new_image = record['dynamodb'].get('NewImage')
+        # Archiving replaces a resolved submission with a stub, it's still
+        # resolved
+        if new_image and 'archive_key' in new_image:
+            continue
+        for key in counters(old_image):
+            deltas[key] -= 1
+        for key in counters(new_image):
+            deltas[key] += 1
+    changes = sorted((k, v) for k, v in deltas.items() if v)
+    metrics().put_metric('CounterCount', len(changes), 'Count')
+    if not changes:
+        return
+    batch_id = ':'.join((event['Records'][0]['dynamodb']['SequenceNumber'],
+                         event['Records'][-1]['dynamodb']['SequenceNumber']))
+    with metrics().timer('TransactWrite'):
+        for i in range(0, len(changes), TRANSACT_CHUNK_SIZE):
+            write_counters(changes[i:i + TRANSACT_CHUNK_SIZE],
+                           hashlib.sha256(
+                               f"{batch_id}:{i}".encode()).hexdigest()[:36])
+    logger.debug(f"Updated Counters: {json.dumps(changes)}")
+
+
+def counters(image):
+    # The (status, day, report, cell) counters a submission image counts in
+    if not image or 'gsi1pk' not in image or 'stats_counted' not in image:
+        return []
+    status = status_of(image['gsi1pk']['S'])
+    # The day it entered the status, from the time-ordered sort key
+    gsi1sk = image.get('gsi1sk', {}).get('S', '')
+    day = gsi1sk[:10] if gsi1sk[:1].isdigit() else NONE
+    reports = [x['S'] for x in image.get('selected_reports', {}).get('L', [])]
+    cell = submission_cell(image)
+    return [(status, day, report, cell) for report in sorted(set(reports))
+            or [NONE]]
+
+
+def submission_cell(image):
+    # Where the citizen was when they submitted it, or else where the photo
+    # was taken. The browser sends 0, 0 when it doesn't know.
+    for name in ('coords_browser', 'coords_image'):
+        coords = image.get(name, {}).get('M', {})
+        if 'latitude' not in coords or 'longitude' not in coords:
+            continue
+        latitude = float(coords['latitude']['N'])
+        longitude = float(coords['longitude']['N'])
+        if latitude or longitude:
+            return geohash(latitude, longitude, geohash_precision())
+    return NONE
+
+
+def write_counters(changes, token):
+    client('dynamodb').transact_write_items(
+        TransactItems=[{
+            'Update': {
+                'TableName': environ['REPORT_TABLE'],
+                'Key': {k: {'S': v} for k, v in stats_key(*key).items()},
+                'UpdateExpression': 'ADD submission_count :delta',
+                'ExpressionAttributeValues': {':delta': {'N': str(delta)}}
+            }
+        } for key, delta in changes],
+        ClientRequestToken=token
+    )
+
+
+@with_metrics('BackfillStats')
+def backfill_handler(event, context):
+    # Marks the submissions from before the counters existed, so the stream
+    # counts them. Invoked by hand after deploying. Safe to run again, e.g. if
+    # it times out, as it only marks what isn't yet.
+    log_event(event)
+    keys = [x for status in core.SUBMISSION_STATUSES for x in
+            status_keys(status)]
+    with ThreadPoolExecutor(max_workers=int(
+            environ.get('BACKFILL_MAX_WORKERS', 16))) as executor:
+        results = list(executor.map(backfill_partition, keys))
+    summary = {
+        'partitions': len(keys),
+        'marked': sum(x[0] for x in results),
+        'skipped': sum(x[1] for x in results)
+    }
+    metrics().put_metric('MarkedCount', summary['marked'], 'Count')
+    logger.info(f"Backfilled: {json.dumps(summary)}")
+    return summary
+
+
+def backfill_partition(gsi1pk):
+    # Returns how many submissions were marked, and how many were archived or
+    # deleted (or marked elsewhere) in the meantime
+    marked = 0
+    skipped = 0
+    kwargs = {
+        'IndexName': 'GSI1',
+        'KeyConditionExpression': Key('gsi1pk').eq(gsi1pk),
+        'ProjectionExpression': 'pk, sk, stats_counted'
+    }
+    while True:
+        response = table().query(**kwargs)
+        for item in response['Items']:
+            if 'stats_counted' in item:
+                continue
+            try:
+                table().update_item(
+                    Key={'pk': item['pk'], 'sk': item['sk']},
+                    UpdateExpression='SET stats_counted = :stats_counted',
+                    ConditionExpression='attribute_exists(gsi1pk) AND attribute_not_exists(stats_counted)',
+                    ExpressionAttributeValues={':stats_counted': True}
+                )
+                marked += 1
+            except ClientError as e:
+                if e.response['Error']['Code'] != \
+                        'ConditionalCheckFailedException':
+                    raise
+                skipped += 1
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return marked, skipped
@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from os import environ
+
+import simplejson as json
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from dl_suggestion_common import (client, core, log_event, metrics,
+                                  status_keys, table, with_metrics)
+from dl_suggestion_common.archive import archive_key, write_parquet
+
+# Moves resolved submissions older than ARCHIVE_AFTER_DAYS out of the table
+# into Parquet files (see dl_suggestion_common.archive), on a schedule. GSI1
+# is sorted by when submissions were resolved, so each shard's old ones are a
+# key range. Files hold at most ARCHIVE_FILE_ROWS submissions, and each
+# submission is also written as a JSON object of its own for get_submission
+# and batch-get to read it back by id.
+
+
+@with_metrics('ArchiveSubmissions')
+def lambda_handler(event, context):
+    log_event(event)
+    cutoff = (datetime.utcnow() - timedelta(
+        days=float(environ.get('ARCHIVE_AFTER_DAYS', 90)))).isoformat()[
+             :-3] + 'Z'
+    keys = status_keys('resolved')
+    # In copies of the invocation's context, so the workers' metrics are too
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        results = list(executor.map(lambda key: context.copy().run(
+            archive_partition, key, cutoff), keys))
+    summary = {
+        'cutoff': cutoff,
+        'files': sum(x['files'] for x in results),
+        'archived': sum(x['archived'] for x in results),
+        'skipped': sum(x['skipped'] for x in results)
+    }
+    metrics().put_metric('ArchivedCount', summary['archived'], 'Count')
+    metrics().put_metric('FileCount', summary['files'], 'Count')
+    logger.info(f"Archived: {json.dumps(summary)}")
+    return summary
+
+
+def archive_partition(gsi1pk, cutoff):
+    # Submissions are grouped by the day they were resolved, and each group
+    # is written out as soon as it's a full file
+    file_rows = int(environ.get('ARCHIVE_FILE_ROWS', 5000))
+    result = {'files': 0, 'archived': 0, 'skipped': 0}
+    days = {}
+    kwargs = {
+        'IndexName': 'GSI1',
+        # Sort keys from before they were timestamps sort after the cutoff
+        'KeyConditionExpression': Key('gsi1pk').eq(gsi1pk) & Key('gsi1sk').lt(
+            cutoff)
+    }
+    while True:
+        response = table().query(**kwargs)
+        for item in response['Items']:
+            day = item['timestamp_resolved'][:10]
+            days.setdefault(day, []).append(item)
+            if len(days[day]) == file_rows:
+                archive_items(day, days.pop(day), result)
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    for day, items in days.items():
+        archive_items(day, items, result)
+    return result
+
+
+def archive_items(day, items, result):
+    # The file, and a submission's own object, are written before it's
+    # replaced by its stub, so a submission is never only in neither
+    key = archive_key(day)
+    with metrics().timer('WriteParquet'):
+        client('s3').put_object(Bucket=environ['SUBMISSION_ARCHIVE_BUCKET'],
+                                Key=key, Body=write_parquet(items))
+    result['files'] += 1
+    timestamp = datetime.utcnow().isoformat()[:-3] + 'Z'
+    # The low-level client is thread safe, unlike the Table resource
+    dynamodb = table().meta.client
+
+    def replace(item):
+        client('s3').put_object(
+            Bucket=environ['SUBMISSION_ARCHIVE_BUCKET'],
+            Key=core.archived_item_key(item['pk'][len('submission_'):]),
+            Body=json.dumps(item), ContentType='application/json')
+        # Unless it was reopened (or already archived) since it was read
+        try:
+            dynamodb.put_item(
+                TableName=table().name,
+                Item={
+                    'pk': item['pk'],
+                    'sk': item['sk'],
+                    'archive_key': key,
+                    'timestamp_archived': timestamp
+                },
+                ConditionExpression='gsi1pk = :gsi1pk AND gsi1sk = :gsi1sk',
+                ExpressionAttributeValues={
+                    ':gsi1pk': item['gsi1pk'],
+                    ':gsi1sk': item['gsi1sk']
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=int(
+            environ.get('ARCHIVE_MAX_WORKERS', 8))) as executor:
+        replaced = list(executor.map(replace, items))
+    result['archived'] += sum(replaced)
+    result['skipped'] += len(replaced) - sum(replaced)
+    logger.debug(f"Archived {sum(replaced)} Submissions to {key}")
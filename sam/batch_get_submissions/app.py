@@ -0,0 +1,10 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+from dl_suggestion_common import (apigw_response, core, log_event,
+                                  with_metrics)
+
+
+@with_metrics('BatchGetSubmissions')
+def lambda_handler(event, context):
+    log_event(event)
+    return apigw_response(*core.batch_get(event['body']))
@@ -0,0 +1,59 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+# Code shared by the handlers, deployed to them as the CommonLayer.
+from dl_suggestion_common.aws import client, reset, resource, table
+from dl_suggestion_common.ddb_json import dumps_item, dumps_items, dumps_value
+from dl_suggestion_common.emf import (Metrics, metrics, metrics_scope,
+                                      record_response, with_metrics)
+from dl_suggestion_common.idempotency import idempotency_key, idempotent
+from dl_suggestion_common.log import log_event
+from dl_suggestion_common.responses import apigw_response, submission_body
+from dl_suggestion_common.shards import (shard_count, sort_key, status_key,
+                                         status_keys, status_of)
+from dl_suggestion_common.stats import (geohash, geohash_precision,
+                                        stats_dimensions, stats_key)
+from dl_suggestion_common.validation import (
+    GEOHASH_REGEX,
+    TIMESTAMP_REGEX,
+    UPLOAD_KEY_REGEX,
+    UUID_REGEX,
+    match_submission_id,
+    match_timestamp,
+    match_upload_key,
+)
+
+__all__ = [
+    'GEOHASH_REGEX',
+    'Metrics',
+    'TIMESTAMP_REGEX',
+    'UPLOAD_KEY_REGEX',
+    'UUID_REGEX',
+    'apigw_response',
+    'client',
+    'dumps_item',
+    'dumps_items',
+    'dumps_value',
+    'geohash',
+    'geohash_precision',
+    'idempotency_key',
+    'idempotent',
+    'log_event',
+    'match_submission_id',
+    'match_timestamp',
+    'match_upload_key',
+    'metrics',
+    'metrics_scope',
+    'record_response',
+    'reset',
+    'resource',
+    'shard_count',
+    'sort_key',
+    'status_key',
+    'status_keys',
+    'stats_dimensions',
+    'stats_key',
+    'status_of',
+    'submission_body',
+    'table',
+    'with_metrics',
+]
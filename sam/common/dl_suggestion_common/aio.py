@@ -0,0 +1,238 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import asyncio
+import random
+from contextlib import AsyncExitStack
+from os import environ
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from boto3.dynamodb.conditions import ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+# The data access the handlers do with boto3, on asyncio with aiobotocore, so
+# one event loop can have hundreds of DynamoDB, S3 and Rekognition requests in
+# flight instead of needing a thread per request:
+#
+#   async with Session() as session:
+#       table = session.table()
+#       items = await asyncio.gather(*[table.get_item(key) for key in keys])
+#
+# Items, keys and values are plain Python like the Table resource (numbers are
+# Decimals), and conditions are built with boto3.dynamodb.conditions. Not
+# imported by the package, and aiobotocore is only installed with the aio
+# extra (not in the CommonLayer), so the synchronous handlers don't load or
+# ship aiohttp.
+
+AIO_CONFIG = AioConfig(
+    tcp_keepalive=True,
+    max_pool_connections=int(environ.get('BOTO_MAX_POOL_CONNECTIONS', 50)),
+    connect_timeout=5,
+    retries={
+        'mode': 'adaptive',
+        'max_attempts': int(environ.get('BOTO_MAX_ATTEMPTS', 5))
+    }
+)
+# BatchWriteItem accepts at most 25 and BatchGetItem at most 100 keys
+BATCH_WRITE_CHUNK_SIZE = 25
+BATCH_GET_CHUNK_SIZE = 100
+# Attempts per chunk before giving up on what DynamoDB keeps returning as
+# unprocessed, with exponential backoff (and jitter) between attempts.
+BATCH_MAX_ATTEMPTS = 5
+BATCH_BACKOFF_SECONDS = 0.05
+BATCH_BACKOFF_MAX_SECONDS = 1
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def serialize(item):
+    return {k: _serializer.serialize(v) for k, v in item.items()}
+
+
+def deserialize(item):
+    return {k: _deserializer.deserialize(v) for k, v in item.items()}
+
+
+class Session:
+    # Clients are created on first use and closed with the session. Requests
+    # beyond max_concurrency wait for a free slot rather than for a pooled
+    # connection, so a large gather() doesn't time out waiting in the pool.
+    def __init__(self, max_concurrency=None, config=AIO_CONFIG):
+        self.config = config
+        self.max_concurrency = max_concurrency or config.max_pool_connections
+        self._session = get_session()
+        self._clients = {}
+        self._stack = None
+        self._semaphore = None
+        self._lock = None
+
+    async def __aenter__(self):
+        self._stack = AsyncExitStack()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._clients = {}
+        await self._stack.aclose()
+
+    async def client(self, service_name):
+        if service_name not in self._clients:
+            async with self._lock:
+                if service_name not in self._clients:
+                    self._clients[service_name] = \
+                        await self._stack.enter_async_context(
+                            self._session.create_client(service_name,
+                                                        config=self.config))
+        return self._clients[service_name]
+
+    async def call(self, service_name, operation, **kwargs):
+        client = await self.client(service_name)
+        async with self._semaphore:
+            return await getattr(client, operation)(**kwargs)
+
+    def table(self, table_name=None):
+        # Defaults to the table every API handler works against
+        return Table(self, table_name or environ['REPORT_TABLE'])
+
+    async def get_object(self, bucket, key):
+        response = await self.call('s3', 'get_object', Bucket=bucket, Key=key)
+        async with response['Body'] as stream:
+            return await stream.read()
+
+    async def put_object(self, bucket, key, body, **kwargs):
+        return await self.call('s3', 'put_object', Bucket=bucket, Key=key,
+                               Body=body, **kwargs)
+
+    async def detect_labels(self, bucket, key, min_confidence):
+        response = await self.call(
+            'rekognition', 'detect_labels',
+            Image={'S3Object': {'Bucket': bucket, 'Name': key}},
+            MinConfidence=min_confidence)
+        return response['Labels']
+
+
+class Table:
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+
+    async def _call(self, operation, **kwargs):
+        return await self.session.call('dynamodb', operation, **kwargs)
+
+    async def get_item(self, key, **kwargs):
+        # The item, or None if there is no item with the key
+        response = await self._call('get_item', TableName=self.name,
+                                    Key=serialize(key), **kwargs)
+        return deserialize(response['Item']) if 'Item' in response else None
+
+    async def query(self, key_condition, index_name=None, filter=None,
+                    **kwargs):
+        # Every page of the query, in order
+        builder = ConditionExpressionBuilder()
+        names = {}
+        values = {}
+        expressions = {}
+        key_expression = builder.build_expression(key_condition,
+                                                  is_key_condition=True)
+        expressions['KeyConditionExpression'] = \
+            key_expression.condition_expression
+        names.update(key_expression.attribute_name_placeholders)
+        values.update(key_expression.attribute_value_placeholders)
+        if filter is not None:
+            filter_expression = builder.build_expression(filter)
+            expressions['FilterExpression'] = \
+                filter_expression.condition_expression
+            names.update(filter_expression.attribute_name_placeholders)
+            values.update(filter_expression.attribute_value_placeholders)
+        if index_name:
+            kwargs['IndexName'] = index_name
+        items = []
+        while True:
+            response = await self._call(
+                'query', TableName=self.name,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=serialize(values),
+                **expressions, **kwargs)
+            items += [deserialize(x) for x in response.get('Items', [])]
+            if 'LastEvaluatedKey' not in response:
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    async def update_item(self, key, update_expression, values=None,
+                          names=None, condition=None, return_values='NONE'):
+        # Raises ClientError (ConditionalCheckFailedException) when the
+        # condition isn't met. Returns the attributes asked for by
+        # return_values, if any.
+        names = dict(names or {})
+        values = dict(values or {})
+        kwargs = {}
+        if condition is not None:
+            expression = ConditionExpressionBuilder().build_expression(
+                condition)
+            kwargs['ConditionExpression'] = expression.condition_expression
+            names.update(expression.attribute_name_placeholders)
+            values.update(expression.attribute_value_placeholders)
+        if names:
+            kwargs['ExpressionAttributeNames'] = names
+        if values:
+            kwargs['ExpressionAttributeValues'] = serialize(values)
+        response = await self._call('update_item', TableName=self.name,
+                                    Key=serialize(key),
+                                    UpdateExpression=update_expression,
+                                    ReturnValues=return_values, **kwargs)
+        return deserialize(response.get('Attributes', {}))
+
+    async def batch_write(self, put_items=(), delete_keys=()):
+        # Writes every chunk concurrently. Returns the requests which were
+        # still unprocessed after retrying, as BatchWriteItem write requests.
+        requests = [{'PutRequest': {'Item': serialize(x)}} for x in put_items]
+        requests += [{'DeleteRequest': {'Key': serialize(x)}} for x in
+                     delete_keys]
+        chunks = [requests[i:i + BATCH_WRITE_CHUNK_SIZE] for i in
+                  range(0, len(requests), BATCH_WRITE_CHUNK_SIZE)]
+        unprocessed = await asyncio.gather(
+            *[self._batch_write_chunk(x) for x in chunks])
+        return [x for chunk in unprocessed for x in chunk]
+
+    async def _batch_write_chunk(self, requests):
+        for attempt in range(1, BATCH_MAX_ATTEMPTS + 1):
+            response = await self._call('batch_write_item',
+                                        RequestItems={self.name: requests})
+            requests = response.get('UnprocessedItems', {}).get(self.name)
+            if not requests or attempt == BATCH_MAX_ATTEMPTS:
+                break
+            await backoff(attempt)
+        return requests or []
+
+    async def batch_get(self, keys, **kwargs):
+        # Returns the items found and the keys which were still unprocessed
+        # after retrying, fetching every chunk concurrently.
+        chunks = [keys[i:i + BATCH_GET_CHUNK_SIZE] for i in
+                  range(0, len(keys), BATCH_GET_CHUNK_SIZE)]
+        results = await asyncio.gather(
+            *[self._batch_get_chunk(x, kwargs) for x in chunks])
+        items = [x for chunk_items, _ in results for x in chunk_items]
+        unprocessed = [x for _, chunk_keys in results for x in chunk_keys]
+        return items, unprocessed
+
+    async def _batch_get_chunk(self, keys, kwargs):
+        items = []
+        request = dict(kwargs, Keys=[serialize(x) for x in keys])
+        for attempt in range(1, BATCH_MAX_ATTEMPTS + 1):
+            response = await self._call('batch_get_item',
+                                        RequestItems={self.name: request})
+            items += [deserialize(x) for x in
+                      response['Responses'].get(self.name, [])]
+            request = response.get('UnprocessedKeys', {}).get(self.name)
+            if not request or attempt == BATCH_MAX_ATTEMPTS:
+                break
+            await backoff(attempt)
+        return items, [deserialize(x) for x in (request or {}).get('Keys', [])]
+
+
+async def backoff(attempt):
+    seconds = min(BATCH_BACKOFF_SECONDS * 2 ** attempt,
+                  BATCH_BACKOFF_MAX_SECONDS)
+    await asyncio.sleep(random.uniform(seconds / 2, seconds))
@@ -0,0 +1,65 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import io
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Resolved submissions older than ARCHIVE_AFTER_DAYS are moved out of the table
+# into Parquet files in SUBMISSION_ARCHIVE_BUCKET, partitioned by the day they
+# were resolved so Athena can prune by date:
+#
+#   submissions/resolved_date=2022-07-20/<uuid>.parquet
+#
+# Each archived item is replaced by a stub with just its keys and archive_key,
+# the file it's in, so it's no longer in GSI1 and barely takes any space in the
+# table or its backups. Lookups by id read the submission's own JSON object
+# (core.archived_item_key) instead of the file, so only the job writing the
+# files needs pyarrow, and like aio this isn't imported by the package.
+
+ARCHIVE_PREFIX = 'submissions/'
+COORDS_FIELDS = ('latitude', 'longitude')
+COORDS = pa.struct([(x, pa.float64()) for x in COORDS_FIELDS])
+SCHEMA = pa.schema([
+    ('submission_id', pa.string()),
+    ('ml_labels', pa.map_(pa.string(), pa.float64())),
+    ('relevant_reports', pa.map_(pa.string(), pa.float64())),
+    ('selected_reports', pa.list_(pa.string())),
+    ('coords_image', COORDS),
+    ('coords_browser', COORDS),
+    ('timestamp_uploaded', pa.string()),
+    ('timestamp_submitted', pa.string()),
+    ('timestamp_reopened', pa.string()),
+    ('timestamp_resolved', pa.string())
+])
+MAP_COLUMNS = ('ml_labels', 'relevant_reports')
+COORDS_COLUMNS = ('coords_image', 'coords_browser')
+
+
+def archive_key(resolved_date):
+    return f"{ARCHIVE_PREFIX}resolved_date={resolved_date}/{uuid.uuid4()}.parquet"
+
+
+def to_row(item):
+    # A submission item, as the Table resource returns it, as a Parquet row
+    row = {'submission_id': item['pk'][len('submission_'):]}
+    for name in SCHEMA.names[1:]:
+        value = item.get(name)
+        if value is None:
+            row[name] = None
+        elif name in MAP_COLUMNS:
+            row[name] = [(k, float(v)) for k, v in value.items()]
+        elif name in COORDS_COLUMNS:
+            row[name] = {k: float(value[k]) for k in COORDS_FIELDS}
+        else:
+            row[name] = value
+    return row
+
+
+def write_parquet(items):
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pylist([to_row(x) for x in items],
+                                        schema=SCHEMA),
+                   buffer, compression='zstd')
+    return buffer.getvalue()
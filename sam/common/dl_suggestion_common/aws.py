@@ -0,0 +1,74 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+from os import environ
+from threading import Lock, local
+
+import boto3
+from botocore.config import Config
+
+# Clients and resources are created once per execution environment and reused
+# by every warm invocation, keeping their connections (and TLS sessions) open
+# between requests. Clients are thread safe and shared by every thread, but
+# resources (and their Tables) are not, so each thread gets its own. That
+# matters in the long-running service, which serves requests from a pool of
+# worker threads.
+BOTO_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=int(environ.get('BOTO_MAX_POOL_CONNECTIONS', 50)),
+    connect_timeout=5,
+    retries={
+        'mode': 'adaptive',
+        'max_attempts': int(environ.get('BOTO_MAX_ATTEMPTS', 5))
+    }
+)
+
+_clients = {}
+_lock = Lock()
+_local = local()
+# Bumped by reset() so every thread drops its resources on next use
+_generation = 0
+
+
+def client(service_name, **kwargs):
+    key = (service_name, tuple(sorted(kwargs.items())))
+    if key not in _clients:
+        with _lock:
+            if key not in _clients:
+                _clients[key] = boto3.client(service_name, config=BOTO_CONFIG,
+                                             **kwargs)
+    return _clients[key]
+
+
+def _thread_cache():
+    if getattr(_local, 'generation', None) != _generation:
+        _local.generation = _generation
+        _local.resources = {}
+        _local.tables = {}
+    return _local
+
+
+def resource(service_name):
+    resources = _thread_cache().resources
+    if service_name not in resources:
+        # Creating a resource from the default session isn't thread safe
+        with _lock:
+            resources[service_name] = boto3.resource(service_name,
+                                                     config=BOTO_CONFIG)
+    return resources[service_name]
+
+
+def table(table_name=None):
+    # Defaults to the table every API handler works against
+    table_name = table_name or environ['REPORT_TABLE']
+    tables = _thread_cache().tables
+    if table_name not in tables:
+        tables[table_name] = resource('dynamodb').Table(table_name)
+    return tables[table_name]
+
+
+def reset():
+    # Drop every cached client, e.g. between tests with different mocks.
+    global _generation
+    with _lock:
+        _clients.clear()
+        _generation += 1
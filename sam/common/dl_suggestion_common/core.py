@@ -0,0 +1,706 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import heapq
+import itertools
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from os import environ
+from threading import Lock
+
+import simplejson as json
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from dl_suggestion_common.aws import client, resource, table
+from dl_suggestion_common.ddb_json import dumps_items, dumps_value
+from dl_suggestion_common.emf import metrics
+from dl_suggestion_common.responses import submission_body
+from dl_suggestion_common.shards import (SORT_KEY_MAX, sort_key, status_key,
+                                         status_keys, status_of)
+from dl_suggestion_common.stats import NONE, stats_dimensions, stats_key
+from dl_suggestion_common.validation import (GEOHASH_REGEX,
+                                             match_submission_id,
+                                             match_timestamp)
+
+# The business logic behind the HTTP API. The Lambda handlers and the ASGI
+# service are both thin adapters over these functions, which take the parts
+# of the request they need and return (status_code, body) for apigw_response.
+
+SUBMISSION_STATUSES = ('pending', 'submitted', 'resolved')
+# Submissions are listed by the time they entered their status
+SUBMISSION_ORDERS = ('asc', 'desc')
+# What submission counts can be grouped by
+STATS_GROUPS = ('day', 'week', 'report', 'cell')
+# Status transitions which can be applied to many submissions at once
+BULK_ACTIONS = ('resolve', 'reopen')
+# Where archived submissions are kept one object each, by id
+ARCHIVED_ITEM_PREFIX = 'archived/'
+# TransactWriteItems accepts at most 100 actions per transaction
+TRANSACT_CHUNK_SIZE = 100
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_CHUNK_SIZE = 100
+# Attempts per chunk before giving up on keys DynamoDB keeps returning as
+# unprocessed, with exponential backoff (and jitter) between attempts.
+BATCH_GET_MAX_ATTEMPTS = 5
+BATCH_GET_BACKOFF_SECONDS = 0.05
+BATCH_GET_BACKOFF_MAX_SECONDS = 1
+# What Rekognition can detect labels in
+UPLOAD_CONTENT_TYPES = ('image/jpeg', 'image/png')
+
+# The report catalog only changes when it is seeded, so it can be cached for
+# REPORTS_CACHE_SECONDS. Off by default, the long-running service turns it on.
+_reports_cache = {}
+_reports_cache_lock = Lock()
+
+
+def reset_caches():
+    with _reports_cache_lock:
+        _reports_cache.clear()
+
+
+def reports():
+    # The report items in DynamoDB JSON
+    cache_seconds = float(environ.get('REPORTS_CACHE_SECONDS', 0))
+    if cache_seconds > 0:
+        cached = _reports_cache.get(environ['REPORT_TABLE'])
+        if cached and cached[0] > time.monotonic():
+            metrics().add_count('ReportsCacheHit')
+            return cached[1]
+    with metrics().timer('ReportsQuery'):
+        response = client('dynamodb').query(
+            TableName=environ['REPORT_TABLE'],
+            KeyConditionExpression='pk = :pk',
+            ExpressionAttributeValues={':pk': {'S': 'reports'}}
+        )
+    # boto3 does not include 'Items' in the response if there are no items. The
+    # mock framework, moto3 DOES include Items, but as an empty array.
+    items = response.get('Items', [])
+    if cache_seconds > 0 and items:
+        with _reports_cache_lock:
+            _reports_cache[environ['REPORT_TABLE']] = (
+                time.monotonic() + cache_seconds, items)
+    return items
+
+
+def get_reports():
+    items = reports()
+    metrics().put_metric('ItemCount', len(items), 'Count')
+    # Return 404 if there are no reports in the database
+    if len(items) == 0:
+        return 404, None
+    # Reshaped while still in DynamoDB JSON so it can be transcoded directly
+    return_item = {'M': {x['sk']['S']: {'M': {'name': x['name'],
+                                              'labels': x['labels']}}
+                         for x in items}}
+    return 200, dumps_value(return_item)
+
+
+def list_submissions(query_string_parameters):
+    status_filter = 'submitted'
+    if 'status' in query_string_parameters:
+        status_filter = query_string_parameters['status']
+    if status_filter not in SUBMISSION_STATUSES:
+        return 400, ('Invalid submission filter. Submission filter must be one '
+                     'of pending, submitted, or resolved.')
+    # Submissions which entered the status from (inclusive) and to (exclusive)
+    # the timestamps, oldest first unless the order is desc
+    bounds, error = time_bounds(query_string_parameters)
+    if error:
+        return 400, error
+    order = query_string_parameters.get('order', 'asc')
+    if order not in SUBMISSION_ORDERS:
+        return 400, 'Invalid order. Order must be one of asc or desc.'
+    # The low-level client hands back the items in DynamoDB JSON, which is
+    # transcoded straight into the response body without deserializing every
+    # ml_labels score into a Decimal first.
+    metrics().set_property('Status', status_filter)
+    with metrics().timer('SubmissionsQuery'):
+        items = query_status(status_filter, bounds.get('from'),
+                             bounds.get('to'), order == 'desc')
+    metrics().put_metric('ItemCount', len(items), 'Count')
+    if not items:
+        return 200, None
+    with metrics().timer('Serialize'):
+        body = dumps_items(items)
+    return 200, body
+
+
+def time_bounds(query_string_parameters):
+    # The from and to timestamps of the query string, or the error message
+    bounds = {}
+    for bound in ('from', 'to'):
+        if bound in query_string_parameters:
+            bounds[bound] = match_timestamp(query_string_parameters[bound])
+            if not bounds[bound]:
+                return None, (f"Invalid {bound}. Must be an ISO 8601 UTC "
+                              'timestamp, such as 2022-07-20T17:47:41.012Z.')
+    # DynamoDB rejects a BETWEEN whose bounds are the wrong way round
+    if 'from' in bounds and 'to' in bounds and bounds['from'] >= bounds['to']:
+        return None, 'Invalid from. Must be before to.'
+    return bounds, None
+
+
+def sort_key_condition(start=None, end=None):
+    # KeyConditionExpression and values for gsi1sk between the timestamps
+    if start and end:
+        return ' AND gsi1sk BETWEEN :start AND :end', {
+            ':start': {'S': start}, ':end': {'S': end}}
+    if start:
+        # Bounded above too, so unmigrated sort keys aren't included
+        return ' AND gsi1sk BETWEEN :start AND :end', {
+            ':start': {'S': start}, ':end': {'S': SORT_KEY_MAX}}
+    if end:
+        return ' AND gsi1sk < :end', {':end': {'S': end}}
+    return '', {}
+
+
+def query_status(status, start=None, end=None, descending=False):
+    # Scatter-gather: every shard of the status is queried at once and the
+    # pages, each already in gsi1sk order, are merged. Like the single query
+    # before sharding, each shard contributes its first page.
+    keys = status_keys(status)
+    metrics().put_metric('ShardCount', len(keys), 'Count')
+    condition, values = sort_key_condition(start, end)
+
+    def query(key):
+        response = client('dynamodb').query(
+            TableName=environ['REPORT_TABLE'],
+            IndexName='GSI1',
+            KeyConditionExpression='gsi1pk = :status' + condition,
+            ExpressionAttributeValues=dict(values, **{':status': {'S': key}}),
+            ScanIndexForward=not descending
+        )
+        # The shard is an implementation detail, the API lists the status
+        items = response.get('Items', [])
+        for item in items:
+            item['gsi1pk'] = {'S': status_of(item['gsi1pk']['S'])}
+        return items, 'LastEvaluatedKey' in response
+
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        pages = list(executor.map(query, keys))
+    merged = heapq.merge(*(items for items, _ in pages),
+                         key=lambda x: x['gsi1sk']['S'], reverse=descending)
+    # A shard with more than its page may have items which sort before the
+    # ends of the others' pages, so the listing stops where the first of the
+    # truncated shards' pages does. It's then the start of the full listing,
+    # which carries on from its last item.
+    ends = [items[-1]['gsi1sk']['S'] for items, truncated in pages if
+            truncated and items]
+    metrics().put_metric('TruncatedShardCount', len(ends), 'Count')
+    if not ends:
+        return list(merged)
+    if descending:
+        end = max(ends)
+        return list(itertools.takewhile(lambda x: x['gsi1sk']['S'] >= end,
+                                        merged))
+    end = min(ends)
+    return list(itertools.takewhile(lambda x: x['gsi1sk']['S'] <= end,
+                                    merged))
+
+
+def get_stats(query_string_parameters):
+    # Counts of the submissions in a status which entered it from (inclusive)
+    # and to (exclusive) the days, grouped by any of STATS_GROUPS. Cells can
+    # be narrowed to an area (a geohash prefix) and coarsened to a precision.
+    status = query_string_parameters.get('status')
+    if status not in SUBMISSION_STATUSES:
+        return 400, ('Invalid status. Status must be one of pending, '
+                     'submitted, or resolved.')
+    bounds, error = time_bounds(query_string_parameters)
+    if error:
+        return 400, error
+    # Submissions are counted by day, so a bound within one can't be counted
+    days = {}
+    for bound, timestamp in bounds.items():
+        if timestamp[10:].strip('T:.0'):
+            return 400, f"Invalid {bound}. Must be a day, such as 2022-07-20."
+        days[bound] = timestamp[:10]
+    if 'from' in days and 'to' in days and days['from'] >= days['to']:
+        return 400, 'Invalid from. Must be a day before to.'
+    group_by = [x for x in query_string_parameters.get('group_by', '').split(
+        ',') if x]
+    if any(x not in STATS_GROUPS for x in group_by):
+        return 400, 'Invalid group_by. Must be a list of ' + ', '.join(
+            STATS_GROUPS) + '.'
+    cell_prefix = query_string_parameters.get('cell', '')
+    if not GEOHASH_REGEX.fullmatch(cell_prefix):
+        return 400, 'Invalid cell. Must be a geohash.'
+    precision = query_string_parameters.get('precision', '')
+    if precision and not (precision.isdigit() and int(precision) > 0):
+        return 400, 'Invalid precision. Must be a positive number.'
+    report = query_string_parameters.get('report')
+    condition = 'pk = :pk'
+    values = {':pk': {'S': stats_key(status, '', '', '')['pk']}}
+    # A day's counters sort after the day itself, so BETWEEN takes in from's
+    # and leaves out to's
+    if 'from' in days:
+        condition += ' AND sk BETWEEN :start AND :end'
+        values[':start'] = {'S': days['from']}
+        values[':end'] = {'S': days.get('to', SORT_KEY_MAX)}
+    elif 'to' in days:
+        condition += ' AND sk < :end'
+        values[':end'] = {'S': days['to']}
+    kwargs = {
+        'TableName': environ['REPORT_TABLE'],
+        'KeyConditionExpression': condition,
+        'ExpressionAttributeValues': values
+    }
+    counts = {}
+    counter_count = 0
+    with metrics().timer('StatsQuery'):
+        while True:
+            response = client('dynamodb').query(**kwargs)
+            for item in response.get('Items', []):
+                counter_count += 1
+                day, item_report, cell = stats_dimensions(item['sk']['S'])
+                count = int(item['submission_count']['N'])
+                if not count or (report and item_report != report) or \
+                        not cell.startswith(cell_prefix):
+                    continue
+                if precision and cell != NONE:
+                    cell = cell[:int(precision)]
+                dimensions = {
+                    'day': day,
+                    'week': iso_week(day),
+                    'report': item_report,
+                    'cell': cell
+                }
+                group = tuple(dimensions[x] for x in group_by)
+                counts[group] = counts.get(group, 0) + count
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    metrics().put_metric('CounterCount', counter_count, 'Count')
+    return 200, {
+        'status': status,
+        'total': sum(counts.values()),
+        'groups': [dict(zip(group_by, group), count=count) for group, count in
+                   sorted(counts.items())] if group_by else []
+    }
+
+
+def iso_week(day):
+    if day == NONE:
+        return NONE
+    year, week, _ = date.fromisoformat(day).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def archived_item_key(submission_id):
+    # Archived submissions are in Parquet files for analytics, and each one is
+    # also kept as a JSON object of its own, so reading one back by id is a
+    # single small GET without a Parquet reader (see archive_submissions)
+    return f"{ARCHIVED_ITEM_PREFIX}{submission_id}.json"
+
+
+def read_archived(stubs):
+    # The archived submissions for their stubs, keyed by submission id, all
+    # read at the same time. Ones which aren't in the archive are left out.
+    submission_ids = [x['pk'][len('submission_'):] for x in stubs]
+    if not submission_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(submission_ids), int(
+            environ.get('ARCHIVE_MAX_WORKERS', 8)))) as executor:
+        items = list(executor.map(read_archived_item, submission_ids))
+    return {k: v for k, v in zip(submission_ids, items) if v is not None}
+
+
+def read_archived_item(submission_id):
+    try:
+        body = client('s3').get_object(
+            Bucket=environ['SUBMISSION_ARCHIVE_BUCKET'],
+            Key=archived_item_key(submission_id))['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        return None
+    # Numbers as Decimals, as the Table resource returns them
+    return json.loads(body, use_decimal=True, parse_int=Decimal)
+
+
+def get_submission(requested_id):
+    # Make sure it's a UUIDv4 submission id
+    submission_id = match_submission_id(requested_id)
+    if not submission_id:
+        logger.error('Unrecognized Submission ID: ' + str(requested_id))
+        return 400, 'Invalid submissions_id. Submission ID must be UUIDv4 format.'
+    with metrics().timer('GetItem'):
+        response = table().get_item(
+            Key={
+                'pk': f"submission_{submission_id}",
+                'sk': f"submission_{submission_id}",
+            }
+        )
+    if 'Item' not in response or len(response['Item']) == 0:
+        return 404, None
+    item = response['Item']
+    if 'archive_key' in item:
+        with metrics().timer('ArchiveRead'):
+            item = read_archived([item]).get(submission_id)
+        if not item:
+            logger.error(f"Missing From Archive: {submission_id}")
+            return 404, None
+    return 200, submission_body(item)
+
+
+def patch_submission(requested_id, raw_body):
+    submission_id = match_submission_id(requested_id)
+    if not submission_id:
+        logger.error('Unrecognized Submission ID: ' + str(requested_id))
+        return 400, 'Invalid submissions_id. Submission ID must be UUIDv4 format.'
+    try:
+        body = json.loads(raw_body)
+    except (TypeError, ValueError):
+        logger.error('Unrecognized Patch Format: ' + str(raw_body))
+        return 400, 'Invalid patch format. Must have an JSON body.'
+    if not isinstance(body, dict) or 'action' not in body:
+        logger.error('Unrecognized Patch Format: ' + json.dumps(body))
+        return 400, 'Invalid patch format. Must have an action attribute.'
+    metrics().set_property('Action', body['action'])
+    if body['action'] == 'submit':
+        return submit_submission(submission_id, body)
+    if body['action'] in BULK_ACTIONS:
+        try:
+            with metrics().timer('UpdateItem'):
+                table().update_item(
+                    **status_update(body['action'], submission_id))
+        except ClientError as e:
+            # ConditionExpression of update_item ensures that we only update
+            # an existing resource, instead of creating a new one, like
+            # update_item will do by default.
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                logger.error('Submission ID Not Found: ' + submission_id)
+                return 404, 'Submission ID Not Found'
+            raise
+        return 204, None
+    logger.error('Unrecognized Patch Action: ' + json.dumps(body))
+    return 400, 'Invalid patch format. Action must be one of submit, ' + ', '.join(
+        BULK_ACTIONS) + '.'
+
+
+def submit_submission(submission_id, body):
+    selected_reports = []
+    for report in body.get('selected_reports', []):
+        if report.startswith('report-'):
+            selected_reports.append(report)
+    coords_browser = {
+        'latitude': 0,
+        'longitude': 0
+    }
+    if 'coords' in body:
+        if 'latitude' in body['coords'] and 'longitude' in body['coords']:
+            coords_browser = {
+                'latitude': Decimal(body['coords']['latitude']).quantize(
+                    Decimal("1.000000000000000")),
+                'longitude': Decimal(body['coords']['longitude']).quantize(
+                    Decimal("1.000000000000000"))
+            }
+    timestamp = datetime.utcnow().isoformat()[:-3] + 'Z'
+    try:
+        with metrics().timer('UpdateItem'):
+            updated_item = table().update_item(
+                Key={
+                    'pk': f"submission_{submission_id}",
+                    'sk': f"submission_{submission_id}"
+                },
+                UpdateExpression='SET selected_reports = :selected_reports, coords_browser = :coords_browser, gsi1pk = :gsi1pk, gsi1sk = :gsi1sk, timestamp_submitted = :timestamp_submitted',
+                ExpressionAttributeValues={
+                    ':selected_reports': selected_reports,
+                    ':coords_browser': coords_browser,
+                    ':gsi1pk': status_key('submitted', submission_id),
+                    ':gsi1sk': sort_key(timestamp, submission_id),
+                    ':timestamp_submitted': timestamp
+                },
+                ReturnValues='ALL_NEW',
+                ConditionExpression=Attr('pk').eq(
+                    f"submission_{submission_id}") & Attr(
+                    'archive_key').not_exists()
+            )
+    except ClientError as e:
+        # ConditionExpression of update_item ensures that we only update
+        # an existing resource, instead of creating a new one, like
+        # update_item will do by default.
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.error('Submission ID Not Found: ' + submission_id)
+            return 404, 'Submission ID Not Found'
+        raise
+    return 200, submission_body(updated_item['Attributes'])
+
+
+def bulk_patch_submissions(raw_body):
+    try:
+        body = json.loads(raw_body)
+    except (TypeError, ValueError):
+        logger.error('Unrecognized Bulk Format: ' + str(raw_body))
+        return 400, 'Invalid bulk format. Must have an JSON body.'
+    if not isinstance(body, dict) or body.get('action') not in BULK_ACTIONS:
+        logger.error('Unrecognized Bulk Format: ' + json.dumps(body))
+        return 400, 'Invalid bulk format. Action must be one of ' + ', '.join(
+            BULK_ACTIONS) + '.'
+    max_ids = int(environ.get('BULK_MAX_IDS', 500))
+    if not isinstance(body.get('submission_ids'), list) or len(
+            body['submission_ids']) == 0 or len(
+            body['submission_ids']) > max_ids:
+        logger.error('Unrecognized Bulk Format: ' + json.dumps(body))
+        return 400, f"Invalid bulk format. Must have a submission_ids list of between 1 and {max_ids} submissions."
+    submission_ids = []
+    for requested_id in body['submission_ids']:
+        submission_id = match_submission_id(requested_id)
+        if not submission_id:
+            logger.error('Unrecognized Submission ID: ' + str(requested_id))
+            return 400, 'Invalid submissions_id. Submission ID must be UUIDv4 format.'
+        # A transaction may not touch the same item twice
+        if submission_id not in submission_ids:
+            submission_ids.append(submission_id)
+    metrics().set_property('Action', body['action'])
+    metrics().put_metric('ItemCount', len(submission_ids), 'Count')
+    with metrics().timer('BulkUpdate'):
+        if body.get('atomic'):
+            status_codes = bulk_update_transactionally(table(), body['action'],
+                                                       submission_ids)
+        else:
+            status_codes = bulk_update_in_parallel(table(), body['action'],
+                                                   submission_ids)
+    metrics().put_metric('FailedCount', len(
+        [x for x in status_codes.values() if x != 204]), 'Count')
+    return 200, {
+        'results': [
+            {
+                'submission_id': submission_id,
+                'statusCode': status_codes[submission_id]
+            } for submission_id in submission_ids
+        ]
+    }
+
+
+def status_update(action, submission_id):
+    # update_item arguments to move a submission to the status for the action.
+    # The string ConditionExpression (rather than boto3's Attr) keeps these
+    # usable inside TransactWriteItems too.
+    timestamp = datetime.utcnow().isoformat()[:-3] + 'Z'
+    update = {
+        'Key': {
+            'pk': f"submission_{submission_id}",
+            'sk': f"submission_{submission_id}"
+        },
+        # Archived submissions can't change any more
+        'ConditionExpression': 'attribute_exists(pk) AND attribute_not_exists(archive_key)'
+    }
+    if action == 'resolve':
+        update['UpdateExpression'] = 'SET gsi1pk = :gsi1pk, gsi1sk = :gsi1sk, timestamp_resolved = :timestamp_resolved'
+        update['ExpressionAttributeValues'] = {
+            ':gsi1pk': status_key('resolved', submission_id),
+            ':gsi1sk': sort_key(timestamp, submission_id),
+            ':timestamp_resolved': timestamp
+        }
+    elif action == 'reopen':
+        # Back in the queue from when it was reopened
+        update['UpdateExpression'] = 'SET gsi1pk = :gsi1pk, gsi1sk = :gsi1sk, timestamp_reopened = :timestamp_reopened REMOVE timestamp_resolved'
+        update['ExpressionAttributeValues'] = {
+            ':gsi1pk': status_key('submitted', submission_id),
+            ':gsi1sk': sort_key(timestamp, submission_id),
+            ':timestamp_reopened': timestamp
+        }
+    return update
+
+
+def bulk_update_in_parallel(table, action, submission_ids):
+    # The low-level client is thread safe, unlike the Table resource
+    client = table.meta.client
+    max_workers = int(environ.get('BULK_MAX_WORKERS', 8))
+
+    def update(submission_id):
+        try:
+            client.update_item(TableName=table.name,
+                               **status_update(action, submission_id))
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                logger.error('Submission ID Not Found: ' + submission_id)
+                return 404
+            logger.error(f"Unable to {action} {submission_id}: {e}")
+            return 500
+        return 204
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(submission_ids, executor.map(update, submission_ids)))
+
+
+def bulk_update_transactionally(table, action, submission_ids):
+    # Each chunk is applied all-or-nothing. When a chunk is cancelled the
+    # submissions which don't exist are reported as 404, and the rest of the
+    # chunk as 409 since they were rolled back along with it.
+    status_codes = {}
+    for i in range(0, len(submission_ids), TRANSACT_CHUNK_SIZE):
+        chunk = submission_ids[i:i + TRANSACT_CHUNK_SIZE]
+        try:
+            table.meta.client.transact_write_items(
+                TransactItems=[
+                    {
+                        'Update': dict(TableName=table.name,
+                                       **status_update(action, submission_id))
+                    } for submission_id in chunk
+                ]
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                logger.error(f"Unable to {action} {chunk}: {e}")
+                status_codes.update({x: 500 for x in chunk})
+                continue
+            reasons = e.response.get('CancellationReasons', [])
+            for submission_id, reason in zip(chunk, reasons):
+                if reason['Code'] == 'ConditionalCheckFailed':
+                    logger.error('Submission ID Not Found: ' + submission_id)
+                    status_codes[submission_id] = 404
+            status_codes.update(
+                {x: 409 for x in chunk if x not in status_codes})
+            continue
+        status_codes.update({x: 204 for x in chunk})
+    return status_codes
+
+
+def batch_get(raw_body):
+    max_ids = int(environ.get('BATCH_GET_MAX_IDS', 100))
+    try:
+        body = json.loads(raw_body)
+    except (TypeError, ValueError):
+        logger.error('Unrecognized Batch Get Format: ' + str(raw_body))
+        return 400, 'Invalid batch get format. Must have an JSON body.'
+    if not isinstance(body, dict) or not isinstance(
+            body.get('submission_ids'), list):
+        logger.error('Unrecognized Batch Get Format: ' + json.dumps(body))
+        return 400, 'Invalid batch get format. Must have a submission_ids list.'
+    if len(body['submission_ids']) == 0 or len(
+            body['submission_ids']) > max_ids:
+        return 400, f"Invalid batch get format. Must request between 1 and {max_ids} submissions."
+    # Make sure they're all UUIDv4 submission ids
+    submission_ids = []
+    for requested_id in body['submission_ids']:
+        submission_id = match_submission_id(requested_id)
+        if not submission_id:
+            logger.error('Unrecognized Submission ID: ' + str(requested_id))
+            return 400, 'Invalid submissions_id. Submission ID must be UUIDv4 format.'
+        # Duplicates would be rejected by BatchGetItem
+        if submission_id not in submission_ids:
+            submission_ids.append(submission_id)
+    metrics().put_metric('RequestedCount', len(submission_ids), 'Count')
+    with metrics().timer('BatchGet'):
+        items, unprocessed_ids = batch_get_submissions(
+            resource('dynamodb'), environ['REPORT_TABLE'], submission_ids)
+    stubs = [x for x in items.values() if 'archive_key' in x]
+    if stubs:
+        with metrics().timer('ArchiveRead'):
+            archived = read_archived(stubs)
+        metrics().put_metric('ArchivedCount', len(stubs), 'Count')
+        for stub in stubs:
+            submission_id = stub['pk'][len('submission_'):]
+            if submission_id in archived:
+                items[submission_id] = archived[submission_id]
+            else:
+                logger.error(f"Missing From Archive: {submission_id}")
+                del items[submission_id]
+    submissions = []
+    not_found = []
+    for submission_id in submission_ids:
+        if submission_id in unprocessed_ids:
+            continue
+        if submission_id not in items:
+            not_found.append(submission_id)
+            continue
+        submissions.append(submission_body(items[submission_id]))
+    return_body = {
+        'submissions': submissions,
+        'not_found': not_found
+    }
+    if unprocessed_ids:
+        return_body['unprocessed'] = unprocessed_ids
+    metrics().put_metric('NotFoundCount', len(not_found), 'Count')
+    metrics().put_metric('UnprocessedCount', len(unprocessed_ids), 'Count')
+    return 200, return_body
+
+
+def batch_get_submissions(dynamodb, table_name, submission_ids):
+    # Returns the submissions found keyed by submission id, and the ids which
+    # were still unprocessed after retrying (e.g. under heavy throttling).
+    items = {}
+    unprocessed_ids = []
+    for i in range(0, len(submission_ids), BATCH_GET_CHUNK_SIZE):
+        request_items = {
+            table_name: {
+                'Keys': [
+                    {
+                        'pk': f"submission_{submission_id}",
+                        'sk': f"submission_{submission_id}"
+                    } for submission_id in
+                    submission_ids[i:i + BATCH_GET_CHUNK_SIZE]
+                ]
+            }
+        }
+        attempt = 0
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response['Responses'].get(table_name, []):
+                items[item['pk'][len('submission_'):]] = item
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+            attempt += 1
+            metrics().add_count('BatchGetRetries')
+            if attempt >= BATCH_GET_MAX_ATTEMPTS:
+                unprocessed_ids += [key['pk'][len('submission_'):] for key in
+                                    request_items[table_name]['Keys']]
+                logger.error(
+                    f"Giving Up on Unprocessed Keys: {unprocessed_ids}")
+                break
+            backoff = min(BATCH_GET_BACKOFF_SECONDS * 2 ** attempt,
+                          BATCH_GET_BACKOFF_MAX_SECONDS)
+            logger.debug(
+                f"Retrying {len(request_items[table_name]['Keys'])} Unprocessed Keys in {backoff}s")
+            time.sleep(random.uniform(backoff / 2, backoff))
+    return items, unprocessed_ids
+
+
+def create_upload(raw_body):
+    # A presigned POST for uploading a photo straight to S3, under a
+    # submission id chosen here. S3 refuses anything empty, larger than
+    # UPLOAD_MAX_BYTES (Rekognition reads at most 15MB from S3) or of another
+    # content type than the one asked for, so bad uploads never reach
+    # ProcessUpload.
+    try:
+        body = json.loads(raw_body) if raw_body else {}
+    except ValueError:
+        logger.error('Unrecognized Upload Format: ' + str(raw_body))
+        return 400, 'Invalid upload format. Must have an JSON body.'
+    if not isinstance(body, dict):
+        logger.error('Unrecognized Upload Format: ' + json.dumps(body))
+        return 400, 'Invalid upload format. Must have an JSON body.'
+    content_type = body.get('content_type', UPLOAD_CONTENT_TYPES[0])
+    if content_type not in UPLOAD_CONTENT_TYPES:
+        logger.error('Unrecognized Content Type: ' + str(content_type))
+        return 400, 'Invalid content_type. Must be one of ' + ', '.join(
+            UPLOAD_CONTENT_TYPES) + '.'
+    submission_id = str(uuid.uuid4())
+    max_bytes = int(environ.get('UPLOAD_MAX_BYTES', 15728640))
+    expires_in = int(environ.get('UPLOAD_EXPIRES_SECONDS', 300))
+    post = client('s3').generate_presigned_post(
+        Bucket=environ['UPLOADED_IMAGES_BUCKET'],
+        Key=f"maint-img/{submission_id}",
+        Fields={'Content-Type': content_type},
+        Conditions=[
+            {'Content-Type': content_type},
+            ['content-length-range', 1, max_bytes]
+        ],
+        ExpiresIn=expires_in
+    )
+    metrics().set_property('ContentType', content_type)
+    return 201, {
+        'submission_id': submission_id,
+        'url': post['url'],
+        'fields': post['fields'],
+        'max_bytes': max_bytes,
+        'expires_in': expires_in
+    }
@@ -0,0 +1,103 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import base64
+import re
+from decimal import Decimal
+from json.encoder import encode_basestring_ascii
+
+# Transcodes items in DynamoDB's wire format, as returned by the low-level
+# client (e.g. {'ml_labels': {'M': {'Road': {'N': '76.261'}}}}), straight to a
+# JSON string. The resource API would first deserialize every number into a
+# Decimal and then simplejson would walk the tree a second time to serialize
+# them again. Here numbers are copied through as the strings DynamoDB sent.
+# The output matches simplejson.dumps() of the deserialized item.
+
+# DynamoDB returns numbers normalized, which is nearly always already valid
+# JSON. Anything else goes through Decimal to be safe.
+JSON_NUMBER_REGEX = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?\Z")
+
+
+def dumps_item(item):
+    parts = []
+    _write_map(item, parts)
+    return ''.join(parts)
+
+
+def dumps_items(items):
+    parts = ['[']
+    for i, item in enumerate(items):
+        if i:
+            parts.append(', ')
+        _write_map(item, parts)
+    parts.append(']')
+    return ''.join(parts)
+
+
+def dumps_value(value):
+    parts = []
+    _write_value(value, parts)
+    return ''.join(parts)
+
+
+def _number(value):
+    if JSON_NUMBER_REGEX.match(value):
+        return value
+    return str(Decimal(value))
+
+
+def _write_map(attributes, parts):
+    parts.append('{')
+    first = True
+    for name, value in attributes.items():
+        if first:
+            first = False
+        else:
+            parts.append(', ')
+        parts.append(encode_basestring_ascii(name))
+        parts.append(': ')
+        _write_value(value, parts)
+    parts.append('}')
+
+
+def _write_list(values, parts):
+    parts.append('[')
+    first = True
+    for value in values:
+        if first:
+            first = False
+        else:
+            parts.append(', ')
+        _write_value(value, parts)
+    parts.append(']')
+
+
+def _write_value(value, parts):
+    # Every attribute value has exactly one type descriptor. Checked roughly
+    # in order of how common they are in this table.
+    for type_name, data in value.items():
+        if type_name == 'S':
+            parts.append(encode_basestring_ascii(data))
+        elif type_name == 'N':
+            parts.append(_number(data))
+        elif type_name == 'M':
+            _write_map(data, parts)
+        elif type_name == 'L':
+            _write_list(data, parts)
+        elif type_name == 'BOOL':
+            parts.append('true' if data else 'false')
+        elif type_name == 'NULL':
+            parts.append('null')
+        elif type_name == 'SS':
+            parts.append(
+                '[' + ', '.join(encode_basestring_ascii(x) for x in data) + ']')
+        elif type_name == 'NS':
+            parts.append('[' + ', '.join(_number(x) for x in data) + ']')
+        elif type_name == 'B':
+            parts.append(
+                encode_basestring_ascii(base64.b64encode(data).decode('ascii')))
+        elif type_name == 'BS':
+            parts.append('[' + ', '.join(
+                encode_basestring_ascii(base64.b64encode(x).decode('ascii'))
+                for x in data) + ']')
+        else:
+            raise TypeError(f"Unsupported DynamoDB type: {type_name}")
@@ -0,0 +1,152 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import functools
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import environ
+from threading import Lock
+
+import simplejson as json
+
+# Metrics are written as CloudWatch Embedded Metric Format (EMF) lines on
+# stdout, which CloudWatch Logs turns into metrics without any PutMetricData
+# calls. Set METRICS_FILE to write the lines to a file instead, e.g. locally
+# so tests and benchmarks can read them back.
+# https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+DEFAULT_NAMESPACE = 'DLSuggestions'
+# EMF allows at most 100 metrics per log line
+MAX_METRICS_PER_LINE = 100
+
+
+class Metrics:
+    def __init__(self, service=None):
+        self.namespace = environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE)
+        self.dimensions = {}
+        if service:
+            self.dimensions['Service'] = service
+        self.metrics = {}
+        self.properties = {}
+        self._lock = Lock()
+
+    def put_dimension(self, name, value):
+        self.dimensions[name] = str(value)
+
+    def put_metric(self, name, value, unit='None'):
+        # Recording the same metric again keeps every value, EMF accepts an
+        # array of values for a metric.
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = {'unit': unit, 'values': []}
+            self.metrics[name]['values'].append(value)
+
+    def add_count(self, name, value=1):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = {'unit': 'Count', 'values': [0]}
+            self.metrics[name]['values'][0] += value
+
+    def set_property(self, name, value):
+        # Searchable in CloudWatch Logs Insights, but not a metric
+        self.properties[name] = value
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put_metric(name, round((time.perf_counter() - start) * 1000, 3),
+                            'Milliseconds')
+
+    def serialize(self):
+        names = list(self.metrics)
+        lines = []
+        for i in range(0, max(len(names), 1), MAX_METRICS_PER_LINE):
+            chunk = names[i:i + MAX_METRICS_PER_LINE]
+            line = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [list(self.dimensions)],
+                        'Metrics': [{'Name': name,
+                                     'Unit': self.metrics[name]['unit']} for
+                                    name in chunk]
+                    }]
+                }
+            }
+            line.update(self.properties)
+            line.update(self.dimensions)
+            for name in chunk:
+                values = self.metrics[name]['values']
+                line[name] = values[0] if len(values) == 1 else values
+            lines.append(json.dumps(line))
+        return lines
+
+    def flush(self):
+        if not self.metrics:
+            return
+        lines = self.serialize()
+        self.metrics = {}
+        if environ.get('METRICS_FILE'):
+            with open(environ['METRICS_FILE'], 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+        else:
+            sys.stdout.write('\n'.join(lines) + '\n')
+            sys.stdout.flush()
+
+
+# A ContextVar rather than a global, so requests served concurrently by the
+# long-running service each record into their own Metrics. The default is
+# never written out, so anything recorded outside a metrics_scope is lost:
+# code which runs outside a handler opens its own, and worker threads run in
+# a copy of the handler's context (threads don't inherit it).
+_metrics = ContextVar('metrics', default=Metrics())
+
+
+def metrics():
+    # The metrics of the invocation in progress
+    return _metrics.get()
+
+
+@contextmanager
+def metrics_scope(service, request_id=None):
+    # A new Metrics with the Service dimension for the duration of one request,
+    # which records its total duration and is written out at the end.
+    scope = Metrics(service)
+    if request_id:
+        scope.set_property('RequestId', request_id)
+    token = _metrics.set(scope)
+    try:
+        with scope.timer('Duration'):
+            yield scope
+    finally:
+        _metrics.reset(token)
+        scope.flush()
+
+
+def record_response(scope, response):
+    if isinstance(response, dict):
+        if 'statusCode' in response:
+            scope.set_property('StatusCode', response['statusCode'])
+        scope.put_metric('ResponseBytes', len(response.get('body') or ''),
+                         'Bytes')
+
+
+def with_metrics(service):
+    # Wraps a Lambda handler so every invocation gets its own Metrics, which
+    # also records the response status and size.
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            with metrics_scope(service,
+                               getattr(context, 'aws_request_id', None)) as scope:
+                response = handler(event, context)
+                record_response(scope, response)
+                return response
+
+        return wrapper
+
+    return decorator
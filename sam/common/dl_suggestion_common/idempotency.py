@@ -0,0 +1,124 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import time
+import uuid
+from contextlib import contextmanager
+from os import environ
+
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from dl_suggestion_common.aws import table
+from dl_suggestion_common.emf import metrics
+
+# Events are delivered at least once (and redriven from DLQs), so work which
+# shouldn't be done twice claims the event first, with a conditional put of
+# a record in IDEMPOTENCY_TABLE (the report table):
+#
+#   pk: idempotency#s3://bucket/maint-img/<uuid>  sk: <version id>
+#
+# The claim is an in-progress lease of IDEMPOTENCY_LEASE_SECONDS. Only one
+# caller can take it, so concurrent duplicates don't race, and a duplicate of
+# an event which is in progress or done is skipped after a single write. A
+# caller which fails releases the claim so the retry can take it again, one
+# which dies without releasing it leaves a lease which others may take once
+# it expires. Done records are kept for IDEMPOTENCY_TTL_SECONDS, then removed
+# by the table's TTL (expires_at). Without a table configured (e.g. local
+# testing) every event is processed.
+
+IDEMPOTENCY_PK_PREFIX = 'idempotency#'
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+
+
+def idempotency_key(key, version):
+    return {
+        'pk': f"{IDEMPOTENCY_PK_PREFIX}{key}",
+        'sk': version
+    }
+
+
+@contextmanager
+def idempotent(key, version):
+    # Yields whether this caller claimed the event and should process it
+    if not environ.get('IDEMPOTENCY_TABLE'):
+        yield True
+        return
+    token = claim(key, version)
+    if token is None:
+        logger.info(f"Skipping Duplicate: {key} {version}")
+        metrics().add_count('DuplicateCount')
+        yield False
+        return
+    try:
+        yield True
+    except BaseException:
+        release(key, version, token)
+        raise
+    complete(key, version, token)
+
+
+def claim(key, version):
+    # The lease token, or None if the event is in progress or done elsewhere
+    now = int(time.time())
+    token = str(uuid.uuid4())
+    try:
+        with metrics().timer('IdempotencyClaim'):
+            idempotency_table().put_item(
+                Item=dict(idempotency_key(key, version), **{
+                    'idempotency_status': IN_PROGRESS,
+                    'lease_token': token,
+                    'lease_expires_at': now + int(
+                        environ.get('IDEMPOTENCY_LEASE_SECONDS', 60)),
+                    'expires_at': now + ttl_seconds()
+                }),
+                ConditionExpression='attribute_not_exists(pk) OR (idempotency_status = :in_progress AND lease_expires_at < :now)',
+                ExpressionAttributeValues={':in_progress': IN_PROGRESS,
+                                           ':now': now}
+            )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return None
+    return token
+
+
+def complete(key, version, token):
+    try:
+        idempotency_table().update_item(
+            Key=idempotency_key(key, version),
+            UpdateExpression='SET idempotency_status = :completed, expires_at = :expires_at REMOVE lease_token, lease_expires_at',
+            ConditionExpression='lease_token = :token',
+            ExpressionAttributeValues={
+                ':completed': COMPLETED,
+                ':expires_at': int(time.time()) + ttl_seconds(),
+                ':token': token
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # Took longer than the lease and someone else took over
+        logger.warning(f"Idempotency Lease Lost: {key} {version}")
+        metrics().add_count('LeaseLostCount')
+
+
+def release(key, version, token):
+    try:
+        idempotency_table().delete_item(
+            Key=idempotency_key(key, version),
+            ConditionExpression='lease_token = :token',
+            ExpressionAttributeValues={':token': token}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def idempotency_table():
+    return table(environ['IDEMPOTENCY_TABLE'])
+
+
+def ttl_seconds():
+    # Long enough for a redrive from a DLQ, which keeps messages 4 days
+    return int(environ.get('IDEMPOTENCY_TTL_SECONDS', 7 * 24 * 3600))
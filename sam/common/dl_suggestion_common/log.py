@@ -0,0 +1,50 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import random
+from os import environ
+
+import simplejson as json
+from loguru import logger
+
+# Logging the whole event on every invocation is expensive at volume, both to
+# serialize and to ingest into CloudWatch Logs. log_event() only serializes
+# the event when DEBUG is enabled (loguru calls the lambda lazily), with long
+# strings such as request bodies truncated to LOG_FIELD_MAX_LENGTH characters.
+# Independently of the log level, LOG_EVENT_SAMPLE_RATE (0 to 1) of events
+# are logged in full at INFO, so some real payloads are always available.
+DEFAULT_FIELD_MAX_LENGTH = 1024
+
+
+def truncate(value, max_length):
+    if isinstance(value, str):
+        if len(value) > max_length:
+            return value[:max_length] + f"...({len(value)} chars)"
+        return value
+    if isinstance(value, dict):
+        return {k: truncate(v, max_length) for k, v in value.items()}
+    if isinstance(value, list):
+        return [truncate(x, max_length) for x in value]
+    return value
+
+
+def dumps_event(event, max_length=None):
+    if max_length is None:
+        max_length = int(
+            environ.get('LOG_FIELD_MAX_LENGTH', DEFAULT_FIELD_MAX_LENGTH))
+    if max_length > 0:
+        event = truncate(event, max_length)
+    return json.dumps(event)
+
+
+def sampled():
+    sample_rate = float(environ.get('LOG_EVENT_SAMPLE_RATE', 0))
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def log_event(event, label='Event'):
+    # depth=1 so the log line points at the handler, not this function
+    if sampled():
+        logger.opt(depth=1).info(label + ' (Sampled): {}', json.dumps(event))
+        return
+    logger.opt(depth=1, lazy=True).debug(label + ': {}',
+                                         lambda: dumps_event(event))
@@ -0,0 +1,32 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+from os import environ
+
+import simplejson as json
+
+from dl_suggestion_common.shards import status_of
+
+ALLOW_HEADERS = 'Content-Type,Authorization,X-Amz-Date,X-Api-Key,X-Amz-Security-Token'
+ALLOW_METHODS = 'DELETE,GET,HEAD,OPTIONS,PATCH,POST,PUT'
+
+
+def apigw_response(status_code, body=None):
+    response = {
+        'statusCode': status_code,
+        'headers': {
+            'Access-Control-Allow-Headers': ALLOW_HEADERS,
+            'Access-Control-Allow-Origin': environ['ALLOW_ORIGIN_HEADER_VALUE'],
+            'Access-Control-Allow-Methods': ALLOW_METHODS
+        }
+    }
+    if body:
+        response['body'] = body if isinstance(body, str) else json.dumps(body)
+    return response
+
+
+def submission_body(item):
+    # Submissions are returned with their status instead of the GSI1 keys
+    item['status'] = status_of(item['gsi1pk'])
+    del item['gsi1pk']
+    del item['gsi1sk']
+    return item
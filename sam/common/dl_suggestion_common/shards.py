@@ -0,0 +1,50 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import zlib
+from os import environ
+
+# Submissions are indexed on GSI1 by status, and every open submission used to
+# share one gsi1pk ('pending' or 'submitted'), so all of their writes and
+# every listing landed on a single index partition. The status is now written
+# with one of SUBMISSION_SHARDS suffixes ('submitted#3'), picked by hashing the
+# submission id so a submission stays on its shard through every status
+# change, and listings query every shard.
+#
+# Items written before sharding (or before SUBMISSION_SHARDS changed) keep
+# their old gsi1pk until MigrateSubmissionShards moves them. Until then the
+# unsharded partition is still read, and listings stay complete as long as
+# SUBMISSION_SHARDS only grows.
+#
+# The GSI1 sort key is the time the submission entered its status followed by
+# its id ('2022-07-20T17:47:41.012Z#97cc0239-...'), so each shard is in time
+# order and date ranges are key conditions. Keys from before that
+# ('submission_97cc0239-...') sort after every timestamp.
+
+SHARD_SEPARATOR = '#'
+# Sorts after every timestamp, and before the old 'submission_' sort keys
+SORT_KEY_MAX = ':'
+
+
+def shard_count():
+    return int(environ.get('SUBMISSION_SHARDS', 8))
+
+
+def status_key(status, submission_id):
+    # The gsi1pk for a submission with the status
+    shard = zlib.crc32(submission_id.encode('utf-8')) % shard_count()
+    return f"{status}{SHARD_SEPARATOR}{shard}"
+
+
+def status_keys(status, shards=None):
+    # Every gsi1pk a submission with the status may have, unsharded first
+    return [status] + [f"{status}{SHARD_SEPARATOR}{shard}" for shard in
+                       range(shards or shard_count())]
+
+
+def sort_key(timestamp, submission_id):
+    # The gsi1sk for a submission which entered its status at the timestamp
+    return f"{timestamp}{SHARD_SEPARATOR}{submission_id}"
+
+
+def status_of(gsi1pk):
+    return gsi1pk.split(SHARD_SEPARATOR, 1)[0]
@@ -0,0 +1,63 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+from os import environ
+
+# Submissions are counted by AggregateStats, from the table's stream, so
+# GET /stats reads a handful of counter items instead of every submission.
+# Each counter is the number of submissions currently in a status, which
+# entered it on a day, for a report type in a geohash cell:
+#
+#   pk: stats#resolved  sk: 2022-07-20#report-3#9tbq8
+#
+# so the counters of a status over a range of days are one query. A
+# submission counts once for each report selected for it ('none' before it
+# is submitted), in the cell of where it was reported from ('none' without
+# coordinates). Geohash cells nest, so an area is every cell with its prefix.
+
+STATS_PK_PREFIX = 'stats#'
+STATS_SEPARATOR = '#'
+NONE = 'none'
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_precision():
+    # 5 characters are cells of about 5 x 5 km
+    return int(environ.get('STATS_GEOHASH_PRECISION', 5))
+
+
+def geohash(latitude, longitude, precision):
+    # Interleaves longitude and latitude bisections, 5 bits per character
+    bounds = [[-180.0, 180.0], [-90.0, 90.0]]
+    values = (longitude, latitude)
+    characters = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(characters) < precision:
+        axis = 0 if even else 1
+        middle = (bounds[axis][0] + bounds[axis][1]) / 2
+        bits <<= 1
+        if values[axis] >= middle:
+            bits |= 1
+            bounds[axis][0] = middle
+        else:
+            bounds[axis][1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            characters.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(characters)
+
+
+def stats_key(status, day, report, cell):
+    return {
+        'pk': f"{STATS_PK_PREFIX}{status}",
+        'sk': STATS_SEPARATOR.join((day, report, cell))
+    }
+
+
+def stats_dimensions(sk):
+    # (day, report, cell) of a counter's sort key
+    return tuple(sk.split(STATS_SEPARATOR, 2))
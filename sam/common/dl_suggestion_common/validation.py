@@ -0,0 +1,39 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import re
+
+# Compiled once at import instead of on every invocation
+UUID_REGEX = re.compile(
+    r"(?P<submission_id>[0-9a-fA-F]{8}\b-[0-9a-fA-F]{4}\b-[0-9a-fA-F]{4}\b-[0-9a-fA-F]{4}\b-[0-9a-fA-F]{12})")
+UPLOAD_KEY_REGEX = re.compile(r"maint-img\/" + UUID_REGEX.pattern)
+# Empty, or a geohash cell (or any coarser cell containing it)
+GEOHASH_REGEX = re.compile(r"[0-9b-hjkmnp-z]{0,12}")
+# A UTC timestamp, as precise as wanted: 2022-07-20, 2022-07-20T17 or
+# 2022-07-20T17:47:41.012Z
+TIMESTAMP_REGEX = re.compile(
+    r"(?P<timestamp>\d{4}-\d{2}-\d{2}(T\d{2}(:\d{2}(:\d{2}(\.\d{1,3})?)?)?)?)Z?")
+
+
+def match_submission_id(value):
+    # Make sure it's a UUIDv4 submission id, None if it isn't
+    path_matches = UUID_REGEX.match(str(value))
+    if path_matches:
+        return path_matches.group('submission_id')
+    return None
+
+
+def match_upload_key(object_key):
+    # Make sure it's a UUIDv4 submission id filename at the path we expect
+    path_matches = UPLOAD_KEY_REGEX.match(str(object_key))
+    if path_matches:
+        return path_matches.group('submission_id')
+    return None
+
+
+def match_timestamp(value):
+    # The timestamp without its trailing Z, so it compares as a prefix of the
+    # stored ones, None if it isn't one
+    path_matches = TIMESTAMP_REGEX.fullmatch(str(value))
+    if path_matches:
+        return path_matches.group('timestamp')
+    return None
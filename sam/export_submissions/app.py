@@ -0,0 +1,255 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import os
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from os import environ
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import simplejson as json
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from dl_suggestion_common import (client, core, log_event, metrics,
+                                  status_keys, status_of, table, with_metrics)
+
+# Exports submissions as Parquet to SUBMISSION_ARCHIVE_BUCKET for analytics,
+# so analysts stop scanning the table:
+#
+#   exports/submissions/export_date=2022-07-20/<run>-<worker>-<n>.parquet
+#
+# The first export (or {"full": true}) is a parallel segmented scan. After
+# that, each run only exports what entered its status since the previous one
+# (the high-water mark), with key range queries on every GSI1 shard. A
+# submission is exported again each time its status changes, the latest
+# timestamp_status is its current state. Runs stop EXPORT_LAG_SECONDS short of
+# now, so writes still on their way to GSI1 are left for the next run rather
+# than missed. A run which fails leaves the mark where it was, so the next
+# one exports the range again: readers keep the row with the latest
+# timestamp_status per submission anyway.
+#
+# Every worker streams what it reads into Arrow record batches of
+# EXPORT_BATCH_ROWS and rolls over to a new file every EXPORT_FILE_ROWS, so
+# memory (and /tmp) stay bounded however large the table is.
+
+EXPORT_PREFIX = 'exports/submissions/'
+EXPORT_HIGH_WATER_KEY = {'pk': 'export', 'sk': 'submissions'}
+TIMESTAMP = pa.timestamp('ms', tz='UTC')
+SCHEMA = pa.schema([
+    ('submission_id', pa.string()),
+    ('status', pa.string()),
+    ('timestamp_status', TIMESTAMP),
+    ('ml_labels', pa.map_(pa.string(), pa.float64())),
+    ('relevant_reports', pa.map_(pa.string(), pa.float64())),
+    ('selected_reports', pa.list_(pa.string())),
+    ('coords_image_latitude', pa.float64()),
+    ('coords_image_longitude', pa.float64()),
+    ('coords_browser_latitude', pa.float64()),
+    ('coords_browser_longitude', pa.float64()),
+    ('timestamp_uploaded', TIMESTAMP),
+    ('timestamp_submitted', TIMESTAMP),
+    ('timestamp_reopened', TIMESTAMP),
+    ('timestamp_resolved', TIMESTAMP)
+])
+MAP_COLUMNS = ('ml_labels', 'relevant_reports')
+COORDS_COLUMNS = ('coords_image', 'coords_browser')
+TIMESTAMP_COLUMNS = ('timestamp_uploaded', 'timestamp_submitted',
+                     'timestamp_reopened', 'timestamp_resolved')
+
+
+@with_metrics('ExportSubmissions')
+def lambda_handler(event, context):
+    log_event(event)
+    exported_from = None
+    if not (event or {}).get('full'):
+        exported_from = table().get_item(Key=EXPORT_HIGH_WATER_KEY).get(
+            'Item', {}).get('exported_to')
+    exported_to = (datetime.utcnow() - timedelta(
+        seconds=int(environ.get('EXPORT_LAG_SECONDS', 60)))).isoformat()[
+                  :-3] + 'Z'
+    prefix = f"{EXPORT_PREFIX}export_date={exported_to[:10]}/{uuid.uuid4()}"
+    # Each task is given the prefix of its own files
+    if exported_from:
+        tasks = [partial(query_shard, gsi1pk=key, exported_from=exported_from,
+                         exported_to=exported_to) for status in
+                 core.SUBMISSION_STATUSES for key in status_keys(status)]
+    else:
+        segments = int(environ.get('EXPORT_SEGMENTS', 8))
+        tasks = [partial(scan_segment, segment=segment, segments=segments,
+                         exported_to=exported_to) for segment in
+                 range(segments)]
+    with ThreadPoolExecutor(max_workers=int(
+            environ.get('EXPORT_MAX_WORKERS', 8))) as executor:
+        results = list(executor.map(lambda x: x[1](f"{prefix}-{x[0]}"),
+                                    enumerate(tasks)))
+    summary = {
+        'mode': 'incremental' if exported_from else 'full',
+        'from': exported_from,
+        'to': exported_to,
+        'files': sum(x[0] for x in results),
+        'rows': sum(x[1] for x in results)
+    }
+    save_high_water_mark(exported_from, exported_to)
+    metrics().put_metric('RowCount', summary['rows'], 'Count')
+    metrics().put_metric('FileCount', summary['files'], 'Count')
+    logger.info(f"Exported: {json.dumps(summary)}")
+    return summary
+
+
+def save_high_water_mark(exported_from, exported_to):
+    # Only moves on from where this run started, so overlapping runs can't
+    # skip a range
+    condition = 'exported_to = :exported_from' if exported_from else \
+        'attribute_not_exists(exported_to) OR exported_to < :exported_to'
+    values = {':exported_to': exported_to,
+              ':timestamp_exported': datetime.utcnow().isoformat()[:-3] + 'Z'}
+    if exported_from:
+        values[':exported_from'] = exported_from
+    try:
+        table().update_item(
+            Key=EXPORT_HIGH_WATER_KEY,
+            UpdateExpression='SET exported_to = :exported_to, timestamp_exported = :timestamp_exported',
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.warning('High-Water Mark Moved by Another Export')
+
+
+def scan_segment(prefix, segment, segments, exported_to):
+    # Submissions (not archived ones, which are in the archive) which entered
+    # their status before exported_to
+    writer = ExportWriter(prefix)
+    kwargs = {
+        'TableName': environ['REPORT_TABLE'],
+        'Segment': segment,
+        'TotalSegments': segments,
+        'FilterExpression': 'begins_with(pk, :submission) AND attribute_exists(gsi1pk)',
+        'ExpressionAttributeValues': {':submission': {'S': 'submission_'}}
+    }
+    while True:
+        response = client('dynamodb').scan(**kwargs)
+        for item in response.get('Items', []):
+            timestamp = status_timestamp(item)
+            if timestamp is None or timestamp < exported_to:
+                writer.add(item)
+        if 'LastEvaluatedKey' not in response:
+            return writer.close()
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def query_shard(prefix, gsi1pk, exported_from, exported_to):
+    # Submissions on the shard which entered the status in the range
+    writer = ExportWriter(prefix)
+    condition, values = core.sort_key_condition(exported_from, exported_to)
+    kwargs = {
+        'TableName': environ['REPORT_TABLE'],
+        'IndexName': 'GSI1',
+        'KeyConditionExpression': 'gsi1pk = :status' + condition,
+        'ExpressionAttributeValues': dict(values, **{':status': {'S': gsi1pk}})
+    }
+    while True:
+        response = client('dynamodb').query(**kwargs)
+        for item in response.get('Items', []):
+            writer.add(item)
+        if 'LastEvaluatedKey' not in response:
+            return writer.close()
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def status_timestamp(item):
+    # When the submission entered its status, None for sort keys from before
+    # they were timestamps
+    gsi1sk = item.get('gsi1sk', {}).get('S', '')
+    if gsi1sk[:1].isdigit():
+        return gsi1sk.split('#', 1)[0]
+    return None
+
+
+def parse_timestamp(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def to_row(item):
+    # A submission in DynamoDB JSON as a row, straight from the wire format
+    # without deserializing every number into a Decimal first
+    row = {
+        'submission_id': item['pk']['S'][len('submission_'):],
+        'status': status_of(item['gsi1pk']['S']),
+        'timestamp_status': parse_timestamp(status_timestamp(item))
+    }
+    for name in MAP_COLUMNS:
+        row[name] = [(k, float(v['N'])) for k, v in item[name]['M'].items()] \
+            if name in item else None
+    row['selected_reports'] = [x['S'] for x in item['selected_reports'][
+        'L']] if 'selected_reports' in item else None
+    for name in COORDS_COLUMNS:
+        coords = item.get(name, {}).get('M', {})
+        for field in ('latitude', 'longitude'):
+            row[f"{name}_{field}"] = float(coords[field]['N']) \
+                if field in coords else None
+    for name in TIMESTAMP_COLUMNS:
+        row[name] = parse_timestamp(item.get(name, {}).get('S'))
+    return row
+
+
+class ExportWriter:
+    # Streams rows into record batches, and record batches into Parquet files
+    # uploaded under the prefix. Returns (files, rows) when closed.
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.batch_rows = int(environ.get('EXPORT_BATCH_ROWS', 10000))
+        self.file_rows = int(environ.get('EXPORT_FILE_ROWS', 500000))
+        self.rows = []
+        self.writer = None
+        self.path = None
+        self.rows_in_file = 0
+        self.files = 0
+        self.total_rows = 0
+
+    def add(self, item):
+        self.rows.append(to_row(item))
+        if len(self.rows) >= self.batch_rows:
+            self.write_batch()
+
+    def write_batch(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            fd, self.path = tempfile.mkstemp(suffix='.parquet')
+            os.close(fd)
+            self.writer = pq.ParquetWriter(self.path, SCHEMA,
+                                           compression='zstd')
+        self.writer.write_batch(
+            pa.RecordBatch.from_pylist(self.rows, schema=SCHEMA))
+        self.rows_in_file += len(self.rows)
+        self.total_rows += len(self.rows)
+        self.rows = []
+        if self.rows_in_file >= self.file_rows:
+            self.upload_file()
+
+    def upload_file(self):
+        self.writer.close()
+        try:
+            # Multipart, for files too large for one PutObject
+            client('s3').upload_file(self.path,
+                                     environ['SUBMISSION_ARCHIVE_BUCKET'],
+                                     f"{self.prefix}-{self.files}.parquet")
+        finally:
+            os.remove(self.path)
+        self.files += 1
+        self.writer = None
+        self.rows_in_file = 0
+
+    def close(self):
+        self.write_batch()
+        if self.writer is not None:
+            self.upload_file()
+        return self.files, self.total_rows
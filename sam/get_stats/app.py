@@ -0,0 +1,11 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+from dl_suggestion_common import (apigw_response, core, log_event,
+                                  with_metrics)
+
+
+@with_metrics('GetStats')
+def lambda_handler(event, context):
+    log_event(event)
+    return apigw_response(
+        *core.get_stats(event.get('queryStringParameters') or {}))
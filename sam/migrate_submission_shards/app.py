@@ -0,0 +1,103 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+
+import simplejson as json
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from loguru import logger
+
+from dl_suggestion_common import (core, log_event, metrics, shard_count,
+                                  sort_key, status_key, status_keys, status_of,
+                                  table, with_metrics)
+
+# Moves submissions onto the GSI1 shard they belong on with the current
+# SUBMISSION_SHARDS: those written before sharding, and after the shard count
+# changed, those written with the previous count (pass it as
+# {"from_shards": N} when shrinking). Submissions still sorted by id get the
+# time they entered their status as their sort key too. Invoked by hand after
+# deploying. Safe to run again, e.g. if it times out, as it only moves what's
+# still on the wrong keys.
+
+# The timestamps a submission may have entered each status at, it entered it
+# at the latest one it has: one which was reopened and then submitted again
+# keeps both. Submissions without any keep their sort key.
+STATUS_TIMESTAMPS = {
+    'pending': ('timestamp_uploaded',),
+    'submitted': ('timestamp_submitted', 'timestamp_reopened'),
+    'resolved': ('timestamp_resolved',)
+}
+
+
+@with_metrics('MigrateSubmissionShards')
+def lambda_handler(event, context):
+    log_event(event)
+    shards = max(int(event.get('from_shards') or 0), shard_count())
+    keys = [x for status in core.SUBMISSION_STATUSES for x in
+            status_keys(status, shards)]
+    with ThreadPoolExecutor(max_workers=int(
+            environ.get('MIGRATE_MAX_WORKERS', 16))) as executor:
+        results = list(executor.map(migrate_partition, keys))
+    summary = {
+        'partitions': len(keys),
+        'migrated': sum(x[0] for x in results),
+        'skipped': sum(x[1] for x in results)
+    }
+    metrics().put_metric('MigratedCount', summary['migrated'], 'Count')
+    logger.info(f"Migrated: {json.dumps(summary)}")
+    return summary
+
+
+def migrate_partition(gsi1pk):
+    # Returns how many submissions were moved, and how many changed status
+    # while being moved (their writer already put them on the right shard)
+    migrated = 0
+    skipped = 0
+    kwargs = {
+        'IndexName': 'GSI1',
+        'KeyConditionExpression': Key('gsi1pk').eq(gsi1pk),
+        'ProjectionExpression': 'pk, sk, gsi1pk, gsi1sk, ' + ', '.join(
+            STATUS_TIMESTAMPS[status_of(gsi1pk)])
+    }
+    while True:
+        response = table().query(**kwargs)
+        for item in response['Items']:
+            new_gsi1pk, new_gsi1sk = migrated_keys(item)
+            if new_gsi1pk == gsi1pk and new_gsi1sk == item['gsi1sk']:
+                continue
+            try:
+                table().update_item(
+                    Key={'pk': item['pk'], 'sk': item['sk']},
+                    UpdateExpression='SET gsi1pk = :new_gsi1pk, gsi1sk = :new_gsi1sk',
+                    ConditionExpression='gsi1pk = :gsi1pk AND gsi1sk = :gsi1sk',
+                    ExpressionAttributeValues={
+                        ':new_gsi1pk': new_gsi1pk,
+                        ':new_gsi1sk': new_gsi1sk,
+                        ':gsi1pk': gsi1pk,
+                        ':gsi1sk': item['gsi1sk']
+                    }
+                )
+                migrated += 1
+            except ClientError as e:
+                if e.response['Error']['Code'] != \
+                        'ConditionalCheckFailedException':
+                    raise
+                skipped += 1
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    if migrated:
+        logger.debug(f"Moved {migrated} Submissions off {gsi1pk}")
+    return migrated, skipped
+
+
+def migrated_keys(item):
+    # The gsi1pk and gsi1sk the submission should have
+    submission_id = item['pk'][len('submission_'):]
+    status = status_of(item['gsi1pk'])
+    timestamps = [item[x] for x in STATUS_TIMESTAMPS[status] if x in item]
+    gsi1sk = sort_key(max(timestamps), submission_id) if timestamps else \
+        item['gsi1sk']
+    return status_key(status, submission_id), gsi1sk
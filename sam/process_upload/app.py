@@ -1,12 +1,14 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
+import gzip
 import json
 import math
-import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 from os import environ
 
-import boto3
+import numpy as np
 import simplejson as json
 from PIL import Image, UnidentifiedImageError
 from PIL.ExifTags import TAGS, GPSTAGS
@@ -14,9 +16,25 @@ from boto3.dynamodb.conditions import Key
 from loguru import logger
 from botocore.exceptions import ClientError
 
+from dl_suggestion_common import (apigw_response, client, idempotent,
+                                  log_event, match_upload_key, metrics,
+                                  metrics_scope, sort_key, status_key,
+                                  submission_body, table, with_metrics)
 
+# Bumped by SeedDDBData whenever the reports change
+CATALOG_VERSION_KEY = {'pk': 'catalog', 'sk': 'version'}
+# The compiled catalog, kept across invocations until the catalog version moves
+_ranker = None
+# Labels below this confidence are archived but not stored with the
+# submission or ranked with
+LABEL_MIN_CONFIDENCE = 50
+# Where the inference archive's delivery stream writes, one prefix per day
+INFERENCE_ARCHIVE_PREFIX = 'inference/'
+
+
+@with_metrics('ProcessUpload')
 def lambda_handler(event, context):
-    logger.debug('Event: ' + json.dumps(event))
+    log_event(event)
     for record in event['Records']:
         # Make sure we're only responding to new uploads
         if record['eventSource'] != 'aws:s3' or record['eventName'] not in \
@@ -25,51 +43,60 @@ def lambda_handler(event, context):
             logger.error('Unrecognized Event: ' + json.dumps(record))
             continue
         # Make sure it's a UUIDv4 submission id filename at the path we expect
-        path_regex = r"maint-img\/(?P<submission_id>[0-9a-fA-F]{8}\b-[0-9a-fA-F]{4}\b-[0-9a-fA-F]{4}\b-[0-9a-fA-F]{4}\b-[0-9a-fA-F]{12})"
-        path_matches = re.match(path_regex, record['s3']['object']['key'])
-        if path_matches:
-            submission_id = path_matches.group('submission_id')
-        else:
-            submission_id = None
+        submission_id = match_upload_key(record['s3']['object']['key'])
+        if not submission_id:
             logger.error('Unrecognized Path: ' + json.dumps(record))
             continue
-        # Rekognition supports a max image size of 15MB via S3
-        if record['s3']['object']['size'] > 15728640:
-            discard_object(submission_id, record, 'too large')
-            continue
-        process_image(submission_id, record)
+        # S3 notifies at least once and failures are redriven from the DLQ,
+        # each version of an upload is only processed once
+        with idempotent(f"s3://{record['s3']['bucket']['name']}/{record['s3']['object']['key']}",
+                        upload_version(record)) as claimed:
+            if not claimed:
+                continue
+            metrics().put_metric('ImageBytes', record['s3']['object']['size'],
+                                 'Bytes')
+            # Rekognition supports a max image size of 15MB via S3
+            if record['s3']['object']['size'] > 15728640:
+                discard_object(submission_id, record, 'too large')
+                continue
+            process_image(submission_id, record)
+
+
+def upload_version(record):
+    # The bucket is versioned, the sequencer orders events on a key otherwise
+    s3_object = record['s3']['object']
+    return s3_object.get('versionId') or s3_object.get('sequencer') or 'null'
 
 
 def process_image(submission_id, record):
-    rekognition = boto3.client('rekognition')
+    rekognition = client('rekognition')
     logger.debug(
         f"Submitting Rekognition Request for s3://{record['s3']['bucket']['name']}/{record['s3']['object']['key']}")
     try:
-        response = rekognition.detect_labels(
-            Image={
-                'S3Object': {
-                    'Bucket': record['s3']['bucket']['name'],
-                    'Name': record['s3']['object']['key'],
+        with metrics().timer('Rekognition'):
+            response = rekognition.detect_labels(
+                Image={
+                    'S3Object': {
+                        'Bucket': record['s3']['bucket']['name'],
+                        'Name': record['s3']['object']['key'],
+                    },
                 },
-            },
-            MinConfidence=50
-        )
+                # Everything, however unlikely, goes to the archive
+                MinConfidence=int(
+                    environ.get('INFERENCE_MIN_CONFIDENCE', 0))
+            )
     except ClientError as e:
         if e.response['Error']['Code'] == 'InvalidImageFormatException':
             discard_object(submission_id, record, 'not an image')
             return
-    labels = {
-        label['Name']: Decimal(label['Confidence']).quantize(Decimal("1.000"))
-        for label in response['Labels']}
+    archive_inference(submission_id, record, response)
+    labels, parents = image_labels(response)
     logger.info(f"Found Labels: {labels}")
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(environ['REPORT_TABLE'])
-    logger.debug(f"Retrieving Reportable Options...")
-    response = table.query(
-        KeyConditionExpression=Key('pk').eq('reports')
-    )
-    reports = response['Items']
-    relevant_reports = determine_relevant_reports(reports, labels)
+    metrics().put_metric('LabelCount', len(labels), 'Count')
+    ranker = report_ranker()
+    with metrics().timer('RankReports'):
+        relevant_reports = ranker.rank(labels, parents)
+    metrics().put_metric('RelevantReportCount', len(relevant_reports), 'Count')
     coord_lat, coord_lon = image_coordinates(record['s3']['bucket']['name'],
                                              record['s3']['object']['key'],
                                              submission_id)
@@ -78,36 +105,165 @@ def process_image(submission_id, record):
     # Shouldn't be any harm in updating ml_labels ever (as opposed to PUT), since it should
     # always be the latest/best output from Rekognition. This could even be re-run periodically
     # to improve accuracy as Rekognition improves their algorithm.
-    table.update_item(
-        Key={
-            'pk': f"submission_{submission_id}",
-            'sk': f"submission_{submission_id}"
-        },
-        UpdateExpression='SET ml_labels = :ml_labels, relevant_reports = :relevant_reports, coords_image = :coords_image, gsi1pk = :gsi1pk, gsi1sk = :gsi1sk',
-        ExpressionAttributeValues={
-            ':ml_labels': labels,
-            ':relevant_reports': relevant_reports,
-            ':coords_image': {
-                'latitude': coord_lat,
-                'longitude': coord_lon
+    # Pending since the image was uploaded, S3 has the time in the same format
+    timestamp_uploaded = record.get('eventTime') or \
+                         datetime.utcnow().isoformat()[:-3] + 'Z'
+    with metrics().timer('DynamoDBWrite'):
+        updated_item = table().update_item(
+            Key={
+                'pk': f"submission_{submission_id}",
+                'sk': f"submission_{submission_id}"
             },
-            ':gsi1pk': 'pending',
-            ':gsi1sk': f"submission_{submission_id}"
-        }
-    )
+            UpdateExpression='SET ml_labels = :ml_labels, relevant_reports = :relevant_reports, coords_image = :coords_image, gsi1pk = :gsi1pk, gsi1sk = :gsi1sk, timestamp_uploaded = :timestamp_uploaded, stats_counted = :stats_counted',
+            ExpressionAttributeValues={
+                ':ml_labels': labels,
+                ':relevant_reports': relevant_reports,
+                ':coords_image': {
+                    'latitude': coord_lat,
+                    'longitude': coord_lon
+                },
+                ':gsi1pk': status_key('pending', submission_id),
+                ':gsi1sk': sort_key(timestamp_uploaded, submission_id),
+                ':timestamp_uploaded': timestamp_uploaded,
+                # Counted by AggregateStats from now on
+                ':stats_counted': True
+            },
+            ReturnValues='ALL_NEW'
+        )
+    notify_subscribers(submission_id, {
+        'type': 'submission',
+        'submission': submission_body(updated_item['Attributes'])
+    })
+
+
+def image_labels(response):
+    # {Name: Confidence} and {Name: [Parent Name]} of a DetectLabels response
+    labels = {
+        label['Name']: Decimal(label['Confidence']).quantize(Decimal("1.000"))
+        for label in response['Labels'] if
+        label['Confidence'] >= LABEL_MIN_CONFIDENCE}
+    parents = {label['Name']: [x['Name'] for x in label.get('Parents', [])]
+               for label in response['Labels'] if label['Name'] in labels}
+    return labels, parents
+
+
+def archive_inference(submission_id, record, response):
+    # The whole DetectLabels response, bounding boxes and all, as a JSON line
+    # for the delivery stream to batch and compress into the archive, so
+    # submissions can be scored again without another call to Rekognition.
+    # Best effort, the submission is processed either way. Without a stream
+    # configured (e.g. local testing) nothing is archived.
+    if not environ.get('INFERENCE_ARCHIVE_STREAM'):
+        return
+    line = json.dumps({
+        'submission_id': submission_id,
+        'bucket': record['s3']['bucket']['name'],
+        'key': record['s3']['object']['key'],
+        'timestamp': datetime.utcnow().isoformat()[:-3] + 'Z',
+        'response': {k: v for k, v in response.items() if
+                     k != 'ResponseMetadata'}
+    })
+    try:
+        with metrics().timer('ArchiveInference'):
+            client('firehose').put_record(
+                DeliveryStreamName=environ['INFERENCE_ARCHIVE_STREAM'],
+                Record={'Data': (line + '\n').encode('utf-8')})
+    except ClientError as e:
+        logger.error(f"Unable to Archive Inference for {submission_id}: {e}")
+        metrics().add_count('ArchiveErrorCount')
+
+
+@with_metrics('ReplayInference')
+def replay_handler(event, context):
+    # Scores the archived submissions from event['from'] to event['to']
+    # (YYYY-MM-DD, both inclusive, defaulting to today) again with the
+    # current catalog and weights, and updates their relevant_reports. The
+    # archive's files are read and scored REPLAY_MAX_WORKERS at a time. With
+    # 'dry_run' nothing is written.
+    log_event(event)
+    first = date.fromisoformat(event.get('from') or date.today().isoformat())
+    last = date.fromisoformat(event.get('to') or first.isoformat())
+    bucket = environ['INFERENCE_ARCHIVE_BUCKET']
+    ranker = report_ranker()
+    s3 = client('s3')
+    keys = []
+    with metrics().timer('ListArchive'):
+        paginator = s3.get_paginator('list_objects_v2')
+        for day in range((last - first).days + 1):
+            prefix = INFERENCE_ARCHIVE_PREFIX + (
+                    first + timedelta(days=day)).strftime('%Y/%m/%d/')
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                keys += [x['Key'] for x in page.get('Contents', [])]
+
+    def replay(key):
+        return replay_archive(s3, bucket, key, ranker, event.get('dry_run'))
+
+    with metrics().timer('Replay'):
+        with ThreadPoolExecutor(max_workers=int(
+                environ.get('REPLAY_MAX_WORKERS', 32))) as executor:
+            results = list(executor.map(replay, keys))
+    summary = {
+        'files': len(keys),
+        'submissions': sum(x[0] for x in results),
+        'updated': sum(x[1] for x in results),
+        'skipped': sum(x[2] for x in results)
+    }
+    metrics().put_metric('ReplayedCount', summary['submissions'], 'Count')
+    logger.info(f"Replayed: {json.dumps(summary)}")
+    return summary
+
+
+def replay_archive(s3, bucket, key, ranker, dry_run=False):
+    # Returns how many submissions the file had, how many were updated and
+    # how many were skipped. Submissions which no longer exist aren't
+    # recreated, and archived ones are only a stub, their data is in Parquet.
+    response = s3.get_object(Bucket=bucket, Key=key)
+    data = gzip.decompress(response['Body'].read()).decode('utf-8')
+    submissions = 0
+    updated = 0
+    skipped = 0
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        archived = json.loads(line, use_decimal=True)
+        labels, parents = image_labels(archived['response'])
+        relevant_reports = ranker.rank(labels, parents)
+        submissions += 1
+        if dry_run:
+            continue
+        submission_key = f"submission_{archived['submission_id']}"
+        try:
+            table().update_item(
+                Key={'pk': submission_key, 'sk': submission_key},
+                UpdateExpression='SET relevant_reports = :relevant_reports',
+                ConditionExpression='attribute_exists(pk) AND attribute_not_exists(archive_key)',
+                ExpressionAttributeValues={
+                    ':relevant_reports': relevant_reports
+                }
+            )
+            updated += 1
+        except ClientError as e:
+            if e.response['Error']['Code'] != \
+                    'ConditionalCheckFailedException':
+                raise
+            skipped += 1
+    logger.debug(f"Replayed {submissions} Submissions from s3://{bucket}/{key}")
+    return submissions, updated, skipped
 
 
 def image_coordinates(bucket_name, object_key, submission_id):
     # Attempt to extract image coordinates from the EXIF data embedded in the image
-    s3 = boto3.client('s3')
+    s3 = client('s3')
     logger.debug(f"Retrieving s3://{bucket_name}/{object_key}")
-    s3.download_file(bucket_name, object_key, f"/tmp/{submission_id}")
-    try:
-        img = Image.open(f"/tmp/{submission_id}")
-    except UnidentifiedImageError:
-        return False, False
-    exif_data = get_exif_data(img)
-    return get_lat_lon(exif_data)
+    with metrics().timer('S3Download'):
+        s3.download_file(bucket_name, object_key, f"/tmp/{submission_id}")
+    with metrics().timer('ExifParse'):
+        try:
+            img = Image.open(f"/tmp/{submission_id}")
+        except UnidentifiedImageError:
+            return False, False
+        exif_data = get_exif_data(img)
+        return get_lat_lon(exif_data)
 
 
 def get_exif_data(image):
@@ -159,24 +315,137 @@ def get_lat_lon(exif_data):
     return 0, 0
 
 
-def determine_relevant_reports(options, labels):
-    # This simply identified relevant reports by matching the manually-created
-    # report labels with the labels for the image, then adds up the confidence.
-    # There is probably a more accurate and sophisticated way to rank the most
-    # likely reports, but this does pretty good.
-    identified_reports = {}
-    for image_label, image_confidence in labels.items():
-        for report in options:
-            if image_label in report['labels']:
-                if report['sk'] not in identified_reports:
-                    identified_reports[report['sk']] = 0
-                identified_reports[report['sk']] += image_confidence
-    return identified_reports
+def report_ranker():
+    # Compiling the catalog costs far more than ranking with it, so the
+    # compiled catalog is reused for as long as the catalog version stays the
+    # same. Without a version (the catalog was never seeded) it is compiled
+    # every time.
+    global _ranker
+    item = table().get_item(Key=CATALOG_VERSION_KEY).get('Item')
+    version = item['catalog_version'] if item else None
+    if _ranker is not None and version is not None and \
+            _ranker.version == version:
+        metrics().add_count('RankerCacheHit')
+        return _ranker
+    logger.debug(f"Retrieving Reportable Options...")
+    with metrics().timer('ReportsQuery'):
+        reports = query_all(Key('pk').eq('reports'))
+        # Published by TrainReportWeights along with a new catalog version
+        learned_weights = {}
+        if item and item.get('weights_pk'):
+            learned_weights = {
+                x['sk']: x['label_weights'] for x in
+                query_all(Key('pk').eq(item['weights_pk']))}
+    with metrics().timer('CompileReports'):
+        _ranker = ReportRanker(reports, version, learned_weights)
+    return _ranker
+
+
+def query_all(key_condition):
+    items = []
+    kwargs = {'KeyConditionExpression': key_condition}
+    while True:
+        response = table().query(**kwargs)
+        items += response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class ReportRanker:
+    # The catalog compiled into a sparse label x report weight matrix. A
+    # report's weight for one of its labels is the report's label_weights
+    # entry for it (1 by default) times the label's inverse document
+    # frequency, 1 + ln(reports / reports with the label), so a label most
+    # reports share, like "Street", pulls less than one only a few have, like
+    # "Fire Hydrant". Weights learned from citizens' selections, by report id
+    # and label, add to the curated ones and can bring in labels of their
+    # own. The matrix is kept label by label (each label's reports and
+    # weights are a contiguous slice of two arrays), so an image is scored
+    # against every report at once by summing the slices of its labels,
+    # times their confidences, into the reports with np.bincount.
+    def __init__(self, reports, version=None, learned_weights=None):
+        self.version = version
+        self.report_ids = [report['sk'] for report in reports]
+        self.label_index = {}
+        rows = []
+        columns = []
+        weights = []
+        for column, report in enumerate(reports):
+            curated = set(report.get('labels', []))
+            label_weights = report.get('label_weights', {})
+            learned = (learned_weights or {}).get(report['sk'], {})
+            for label in curated | set(learned):
+                rows.append(self.label_index.setdefault(label,
+                                                        len(self.label_index)))
+                columns.append(column)
+                weights.append(
+                    (float(label_weights.get(label, 1)) if label in curated
+                     else 0) + float(learned.get(label, 0)))
+        rows = np.array(rows, dtype=np.int64)
+        document_frequency = np.bincount(rows, minlength=len(self.label_index))
+        idf = 1 + np.log(len(reports) / np.maximum(document_frequency, 1))
+        order = np.argsort(rows, kind='stable')
+        self.columns = np.array(columns, dtype=np.int64)[order]
+        self.weights = (np.array(weights) * idf[rows])[order]
+        # Label i's entries are offsets[i]:offsets[i + 1]
+        self.offsets = np.concatenate(([0], np.cumsum(document_frequency)))
+
+    def rank(self, labels, parents=None, top_k=None):
+        # The top_k highest scoring reports with any of the labels, as report
+        # id: score
+        if top_k is None:
+            top_k = int(environ.get('RANKING_TOP_K', 10))
+        rows = []
+        confidences = []
+        for label, confidence in with_parents(labels, parents).items():
+            row = self.label_index.get(label)
+            if row is not None:
+                rows.append(row)
+                confidences.append(confidence)
+        rows = np.array(rows, dtype=np.int64)
+        starts = self.offsets[rows]
+        counts = self.offsets[rows + 1] - starts
+        # The entries of every matched label, concatenated: the position in
+        # the gathered run minus where its label's run begins, plus its start
+        runs = np.cumsum(counts) - counts
+        entries = np.arange(counts.sum()) + np.repeat(starts - runs, counts)
+        scores = np.bincount(
+            self.columns[entries],
+            weights=self.weights[entries] * np.repeat(
+                np.array(confidences, dtype=float), counts),
+            minlength=len(self.report_ids))
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_k:
+            matched = matched[
+                np.argpartition(scores[matched], -top_k)[-top_k:]]
+        return {self.report_ids[i]: Decimal(scores[i]).quantize(
+            Decimal("1.000")) for i in matched}
+
+
+def with_parents(labels, parents=None):
+    # Rekognition's label hierarchy, so an image of a "Fire Hydrant" also
+    # counts towards reports labelled with its parents. A parent which wasn't
+    # detected itself gets RANKING_PARENT_DECAY of its child's confidence.
+    decay = float(environ.get('RANKING_PARENT_DECAY', 0.5))
+    confidences = {label: float(x) for label, x in labels.items()}
+    for label, label_parents in (parents or {}).items():
+        for parent in label_parents:
+            confidence = confidences[label] * decay
+            if confidence > confidences.get(parent, 0):
+                confidences[parent] = confidence
+    return confidences
+
+
+def determine_relevant_reports(options, labels, parents=None):
+    # Compiles and ranks in one go, for when the catalog is only used once
+    return ReportRanker(options).rank(labels, parents)
 
 
 def discard_object(submission_id, record, reason):
     logger.error('Object is ' + reason + ': ' + submission_id)
-    s3 = boto3.client('s3')
+    metrics().add_count('DiscardedCount')
+    s3 = client('s3')
     bucket_name = record['s3']['bucket']['name']
     object_key = record['s3']['object']['key']
     logger.debug(f"Deleting s3://{bucket_name}/{object_key}")
@@ -184,17 +453,55 @@ def discard_object(submission_id, record, reason):
         Bucket=bucket_name,
         Key=object_key
     )
+    notify_subscribers(submission_id, {
+        'type': 'discarded',
+        'reason': reason
+    })
 
 
-def apigw_response(status_code, body=None):
-    response = {
-        'statusCode': status_code,
-        'headers': {
-            'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-Amz-Date,X-Api-Key,X-Amz-Security-Token',
-            'Access-Control-Allow-Origin': environ['ALLOW_ORIGIN_HEADER_VALUE'],
-            'Access-Control-Allow-Methods': 'DELETE,GET,HEAD,OPTIONS,PATCH,POST,PUT'
-        }
-    }
-    if body:
-        response['body'] = body if isinstance(body, str) else json.dumps(body)
-    return response
+def notify_subscribers(submission_id, message):
+    # Push the message to every browser subscribed to this submission over the
+    # WebSocket API. This is best effort, the browser falls back to polling if
+    # nothing arrives. Without an endpoint configured (e.g. local testing)
+    # there is nobody to notify.
+    if not environ.get('WEBSOCKET_ENDPOINT'):
+        return
+    response = table().query(
+        KeyConditionExpression=Key('pk').eq(f"submission_{submission_id}") &
+                               Key('sk').begins_with('connection_')
+    )
+    if 'Items' not in response or len(response['Items']) == 0:
+        return
+    metrics().put_metric('SubscriberCount', len(response['Items']), 'Count')
+    apigw = client('apigatewaymanagementapi',
+                   endpoint_url=environ['WEBSOCKET_ENDPOINT'])
+    data = json.dumps(message).encode('utf-8')
+    for subscription in response['Items']:
+        connection_id = subscription['connection_id']
+        logger.debug(f"Notifying Connection {connection_id} of {submission_id}")
+        try:
+            with metrics().timer('Notify'):
+                apigw.post_to_connection(ConnectionId=connection_id, Data=data)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'GoneException':
+                logger.error(f"Unable to Notify Connection {connection_id}: {e}")
+                continue
+        # Either delivered or the browser already went away, the subscription
+        # is done with in both cases.
+        table().delete_item(
+            Key={
+                'pk': subscription['pk'],
+                'sk': subscription['sk']
+            }
+        )
+
+
+if 'AWS_LAMBDA_FUNCTION_NAME' in environ:
+    # Compile the catalog while the execution environment initializes, so
+    # the first image doesn't wait for it. Its metrics are written out on
+    # their own, apart from the invocations' durations.
+    try:
+        with metrics_scope('ProcessUploadInit'):
+            report_ranker()
+    except Exception as e:
+        logger.warning(f"Unable to Compile Reports at Init: {e}")
@@ -1,9 +1,17 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
+import hashlib
 import json
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from threading import BoundedSemaphore
 
 import boto3
+import ijson
 import simplejson as json
 from boto3.dynamodb.conditions import Key
 from crhelper import CfnResource
@@ -11,35 +19,153 @@ from loguru import logger
 
 helper = CfnResource()
 
+# The catalog is streamed from initial_data.json and compared with the reports
+# already in the table, so only added or changed reports are written, on
+# create and on every update of the custom resource. Reports which are no
+# longer in the file are left alone, submissions may still refer to them.
+
+# BatchWriteItem accepts at most 25 items per request
+WRITE_CHUNK_SIZE = 25
+# Attempts per chunk before giving up on items DynamoDB keeps returning as
+# unprocessed, with exponential backoff (and jitter) between attempts.
+WRITE_MAX_ATTEMPTS = 8
+WRITE_BACKOFF_SECONDS = 0.05
+WRITE_BACKOFF_MAX_SECONDS = 2
+# Bumped whenever the reports change, so readers can tell the catalog moved on
+CATALOG_VERSION_KEY = {'pk': 'catalog', 'sk': 'version'}
+
 
 @helper.create
+@helper.update
 def seed_data(event, _):
     logger.debug('Event: ' + json.dumps(event))
     dynamodb = boto3.resource('dynamodb')
     table = dynamodb.Table(event['ResourceProperties']['TableName'])
     logger.debug(f"Retrieving Reportable Options...")
-    response = table.query(
-        KeyConditionExpression=Key('pk').eq('reports')
-    )
-    if response['Count'] > 0:
-        logger.debug(f"Reports already exist in the table. Exiting.")
-        return
-    with table.batch_writer() as batch:
-        file_path = os.path.join(os.path.dirname(__file__), 'initial_data.json')
-        with open(file_path) as f:
-            initial_data = json.load(f)
-            for item in initial_data:
-                logger.debug(
-                    f"Writing Item to Table... PK: {item['pk']} | SK: {item['sk']}")
-                batch.put_item(Item=item)
+    fingerprints = existing_fingerprints(table)
+    logger.debug(f"Found {len(fingerprints)} Existing Reports")
+    file_path = os.path.join(os.path.dirname(__file__), 'initial_data.json')
+    with open(file_path, 'rb') as f:
+        written, unchanged = write_items(
+            table, changed_items(ijson.items(f, 'item'), fingerprints))
+    logger.debug(f"Wrote {written} Reports, {unchanged} Unchanged")
+    if written:
+        bump_catalog_version(table, written + unchanged)
 
 
-@helper.update
 @helper.delete
 def no_op(_, __):
     # No Operation
     pass
 
 
+def fingerprint(item):
+    # Numbers compare equal whether they came from the file or the table
+    return hashlib.sha256(json.dumps(normalized(item),
+                                     sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def normalized(value):
+    # DynamoDB doesn't keep how a number was written, 1.0 in the file comes
+    # back from the table as 1
+    if isinstance(value, dict):
+        return {k: normalized(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [normalized(x) for x in value]
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value,
+                                                                   bool):
+        return Decimal(str(value)).normalize()
+    return value
+
+
+def existing_fingerprints(table):
+    # Only a hash of each report is held, not the reports themselves
+    fingerprints = {}
+    kwargs = {'KeyConditionExpression': Key('pk').eq('reports')}
+    while True:
+        response = table.query(**kwargs)
+        for item in response['Items']:
+            fingerprints[(item['pk'], item['sk'])] = fingerprint(item)
+        if 'LastEvaluatedKey' not in response:
+            return fingerprints
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def changed_items(items, fingerprints):
+    # Yields (item, changed) for every item in the file
+    for item in items:
+        yield item, fingerprints.get(
+            (item['pk'], item['sk'])) != fingerprint(item)
+
+
+def write_items(table, items):
+    # Batches of changed items are written by a pool of writers while the file
+    # is still being read. At most two batches per writer are queued, so memory
+    # stays flat however large the catalog is.
+    client = table.meta.client
+    max_workers = int(os.environ.get('SEED_MAX_WORKERS', 8))
+    slots = BoundedSemaphore(max_workers * 2)
+    written = 0
+    unchanged = 0
+    futures = []
+
+    def write(chunk):
+        try:
+            write_chunk(client, table.name, chunk)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        chunk = []
+        for item, changed in items:
+            if not changed:
+                unchanged += 1
+                continue
+            logger.debug(
+                f"Writing Item to Table... PK: {item['pk']} | SK: {item['sk']}")
+            chunk.append(item)
+            written += 1
+            if len(chunk) == WRITE_CHUNK_SIZE:
+                slots.acquire()
+                futures.append(executor.submit(write, chunk))
+                chunk = []
+        if chunk:
+            slots.acquire()
+            futures.append(executor.submit(write, chunk))
+    # Raise the first failure, if any, so CloudFormation sees it
+    for future in futures:
+        future.result()
+    return written, unchanged
+
+
+def write_chunk(client, table_name, items):
+    # The resource's client, which serializes the items itself
+    requests = [{'PutRequest': {'Item': item}} for item in items]
+    for attempt in range(WRITE_MAX_ATTEMPTS):
+        response = client.batch_write_item(RequestItems={table_name: requests})
+        requests = response.get('UnprocessedItems', {}).get(table_name)
+        if not requests:
+            return
+        backoff = min(WRITE_BACKOFF_SECONDS * 2 ** attempt,
+                      WRITE_BACKOFF_MAX_SECONDS)
+        time.sleep(random.uniform(backoff / 2, backoff))
+    raise RuntimeError(
+        f"Unable to write {len(requests)} items after {WRITE_MAX_ATTEMPTS} attempts")
+
+
+def bump_catalog_version(table, report_count):
+    response = table.update_item(
+        Key=CATALOG_VERSION_KEY,
+        UpdateExpression='ADD catalog_version :one SET report_count = :report_count, timestamp_updated = :timestamp_updated',
+        ExpressionAttributeValues={
+            ':one': 1,
+            ':report_count': report_count,
+            ':timestamp_updated': datetime.utcnow().isoformat()[:-3] + 'Z'
+        },
+        ReturnValues='UPDATED_NEW'
+    )
+    logger.debug(f"Catalog Version: {response['Attributes']['catalog_version']}")
+
+
 def handler(event, context):
     helper(event, context)
@@ -1,105 +1,415 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
+import gzip
+import hashlib
 import json
 import mimetypes
 import os
+import re
+import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
 
 import boto3
+import brotli
+import rcssmin
+import rjsmin
 import simplejson as json
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from crhelper import CfnResource
 from loguru import logger
 
 helper = CfnResource()
 
+# The site is built straight from website.zip, on create and on every update
+# of the custom resource. Scripts and stylesheets are minified and every asset
+# is renamed after a hash of its content, with the references to it in the
+# pages (and other assets) rewritten, so assets can be cached for good and
+# only the pages are revalidated. Each object records the SHA-256 of its
+# content in its metadata, and files whose content hasn't changed are
+# skipped, so redeploying an unchanged site costs a HEAD per file. Assets the
+# site no longer names are deleted once they've been superseded for
+# STALE_ASSET_GRACE_SECONDS, as pages loaded before the update may still ask
+# for them.
+WEBSITE_PREFIX = 'website/'
+CONFIG_KEY = 'js/config.js'
+HASH_METADATA_KEY = 'sha256'
+PAGE_EXTENSION = '.html'
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PAGE_CACHE_CONTROL = 'public, max-age=60, must-revalidate'
+# Characters of the content hash in fingerprinted names
+FINGERPRINT_LENGTH = 10
+# Types stored with a brotli and a gzip variant alongside, which the
+# CloudFront function picks from by the viewer's Accept-Encoding
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/javascript',
+                      'application/javascript', 'application/json',
+                      'image/svg+xml')
+ENCODINGS = (('.br', 'br', brotli.compress),
+             ('.gz', 'gzip', lambda data: gzip.compress(data, mtime=0)))
+# Seconds left for in-flight deletes (and re-invoking) when purging the
+# buckets stops listing because the invocation is about to time out
+PURGE_TIME_RESERVE_SECONDS = 8
+# Versions listed, and deleted with one DeleteObjects request, per page
+PURGE_PAGE_SIZE = 1000
+# Superseded assets by when they were first seen superseded, while they wait
+# out the grace period
+SUPERSEDED_KEY = 'superseded-assets.json'
+FINGERPRINTED_REGEX = re.compile(
+    r'.+\.[0-9a-f]{%d}\.[^./]+(%s)?' % (FINGERPRINT_LENGTH, '|'.join(
+        re.escape(suffix) for suffix, _, _ in ENCODINGS)))
+
 
 @helper.create
+@helper.update
 def seed_data(event, _):
     logger.debug('Event: ' + json.dumps(event))
     logger.debug(f"Retrieving S3 Static Website Contents...")
-    s3 = boto3.client('s3')
+    max_workers = int(os.environ.get('SEED_MAX_WORKERS', 16))
+    s3 = boto3.client('s3', config=Config(max_pool_connections=max_workers))
     apigw = boto3.client('apigateway')
     response = apigw.get_api_key(
         apiKey=event['ResourceProperties']['APIKeyId'],
         includeValue=True
     )
     api_key = response['value']
-    response = s3.list_objects_v2(
-        Bucket=event['ResourceProperties']['StaticWebsiteBucket'],
-        MaxKeys=1
-    )
-    if response['KeyCount'] > 0:
-        logger.debug(f"Static Website Bucket already has contents, skipping...")
-        return
-    with zipfile.ZipFile('website.zip', 'r') as zip_ref:
-        zip_ref.extractall('/tmp/website/')
-    path = '/tmp/website/website'
-    # Replace placeholder config values with Lambda inputs
-    config_path = os.path.join(path, 'js/config.js')
-    logger.debug(f"Modifying Website Config {config_path}...")
-    with open(config_path, 'r') as file:
-        config_data = file.read()
+    bucket = event['ResourceProperties']['StaticWebsiteBucket']
+    zip_path = os.path.join(os.path.dirname(__file__), 'website.zip')
+    files = {}
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            if not info.is_dir():
+                files[info.filename[len(WEBSITE_PREFIX):]] = zip_ref.read(info)
+    # Replace placeholder config values with Lambda inputs, before the config
+    # is fingerprinted
+    logger.debug(f"Modifying Website Config {CONFIG_KEY}...")
+    files[CONFIG_KEY] = website_config(files[CONFIG_KEY].decode('utf-8'),
+                                       event['ResourceProperties'],
+                                       api_key).encode('utf-8')
+    assets, pages = build_site(files)
+
+    def upload(item):
+        object_key, data, headers = item
+        return upload_file(s3, bucket, object_key, data, **headers)
+
+    # Upload the website data. The assets go first, so a page is never
+    # served before the assets it names.
+    logger.debug(f"Uploading Website Data...")
+    uploaded = 0
+    total = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for objects in (assets, pages):
+            uploaded += sum(executor.map(upload, objects))
+            total += len(objects)
+    logger.debug(f"Uploaded {uploaded} Files, {total - uploaded} Unchanged")
+    deleted = remove_superseded(s3, bucket, {x[0] for x in assets})
+    logger.debug(f"Deleted {deleted} Superseded Files")
+
+
+def build_site(files):
+    # Returns the asset and the page objects, as (key, data, headers). Every
+    # asset is fingerprinted after the ones it refers to, as it needs their
+    # new names before it's hashed itself.
+    minified = {key: minify(key, data) for key, data in files.items() if
+                not key.endswith(PAGE_EXTENSION)}
+    renamed = {}
+    assets = []
+    pages = []
+    for key in dependency_order(minified):
+        data = minified[key]
+        if is_text(key):
+            data = rewrite_references(data, renamed)
+        renamed[key] = fingerprinted(key, data)
+        assets += encoded(renamed[key], data, ASSET_CACHE_CONTROL)
+    for key in sorted(files):
+        if key.endswith(PAGE_EXTENSION):
+            pages += encoded(key, rewrite_references(files[key], renamed),
+                             PAGE_CACHE_CONTROL)
+    return assets, pages
+
+
+def dependency_order(assets):
+    # The asset keys, each after those the asset refers to: images before
+    # the scripts and stylesheets naming them, a stylesheet after the ones it
+    # @imports. Of assets which refer to each other, one is left with the
+    # unhashed name of the other.
+    order = []
+    done = {}
+
+    def visit(key):
+        if key in done:
+            if not done[key]:
+                logger.warning(f"Circular Reference: {key}")
+            return
+        done[key] = False
+        if is_text(key):
+            text = assets[key].decode('utf-8')
+            for other in sorted(assets):
+                if other != key and reference_regex(other).search(text):
+                    visit(other)
+        done[key] = True
+        order.append(key)
+
+    for key in sorted(assets):
+        visit(key)
+    return order
+
+
+def content_type(object_key):
+    return mimetypes.guess_type(object_key)[0] or 'application/octet-stream'
+
+
+def is_text(object_key):
+    return content_type(object_key) in COMPRESSIBLE_TYPES
+
+
+def minify(object_key, data):
+    # Anything already minified is left as it is
+    if '.min.' in object_key:
+        return data
+    if object_key.endswith('.js'):
+        return rjsmin.jsmin(data.decode('utf-8')).encode('utf-8')
+    if object_key.endswith('.css'):
+        return rcssmin.cssmin(data.decode('utf-8')).encode('utf-8')
+    return data
+
+
+def fingerprinted(object_key, data):
+    # js/map.js becomes js/map.0123456789.js
+    root, extension = os.path.splitext(object_key)
+    digest = hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]
+    return f"{root}.{digest}{extension}"
+
+
+def reference_regex(object_key):
+    # References are the key on its own, with or without a leading slash, so
+    # /js/map.js and 'js/map.js' are references but not /vendor/js/map.js or
+    # a CDN's https://example.com/js/map.js
+    return re.compile(r'(?<![\w./-])(/?)' + re.escape(object_key) +
+                      r'(?![\w.-])')
+
+
+def rewrite_references(data, renamed):
+    text = data.decode('utf-8')
+    for object_key, new_key in renamed.items():
+        text = reference_regex(object_key).sub(
+            lambda m: m.group(1) + new_key, text)
+    return text.encode('utf-8')
+
+
+def encoded(object_key, data, cache_control):
+    # The object, followed by its precompressed variants if it compresses
+    headers = {'ContentType': content_type(object_key),
+               'CacheControl': cache_control}
+    objects = [(object_key, data, headers)]
+    if headers['ContentType'] in COMPRESSIBLE_TYPES:
+        for suffix, encoding, compress in ENCODINGS:
+            objects.append((object_key + suffix, compress(data),
+                            dict(headers, ContentEncoding=encoding)))
+    return objects
+
+
+def website_config(config_data, properties, api_key):
     config_data = config_data.replace('REPLACE_ME_IDENTITY_POOL_ID',
-                                      event['ResourceProperties'][
-                                          'IdentityPoolId'])
+                                      properties['IdentityPoolId'])
     config_data = config_data.replace('REPLACE_ME_UNIQUE_SUFFIX',
-                                      event['ResourceProperties'][
-                                          'UniqueSuffix'])
+                                      properties['UniqueSuffix'])
     config_data = config_data.replace('REPLACE_ME_API_BASE_URL',
-                                      event['ResourceProperties']['ApiBaseURL'])
+                                      properties['ApiBaseURL'])
+    config_data = config_data.replace('REPLACE_ME_WEBSOCKET_URL',
+                                      properties['WebSocketURL'])
     config_data = config_data.replace('REPLACE_ME_API_KEY', api_key)
-    with open(config_path, 'w') as file:
-        file.write(config_data)
-    # Upload the website data
-    logger.debug(f"Uploading Website Data...")
-    for subdir, dirs, files in os.walk(path):
-        for file in files:
-            full_path = os.path.join(subdir, file)
-            with open(full_path, 'rb') as data:
-                object_key = full_path[len(path) + 1:]
-                logger.debug(
-                    f"Uploading: {full_path} -> s3://{event['ResourceProperties']['StaticWebsiteBucket']}/{object_key}")
-                s3.put_object(
-                    Bucket=event['ResourceProperties']['StaticWebsiteBucket'],
-                    Key=object_key,
-                    Body=data,
-                    ContentType=mimetypes.guess_type(full_path)[0]
-                )
+    return config_data
+
+
+def upload_file(s3, bucket, object_key, data, **headers):
+    # Returns whether the file was uploaded, rather than already up to date
+    digest = hashlib.sha256(data).hexdigest()
+    headers.setdefault('ContentType', content_type(object_key))
+    try:
+        response = s3.head_object(Bucket=bucket, Key=object_key)
+        if response['Metadata'].get(HASH_METADATA_KEY) == digest and all(
+                response.get(k) == v for k, v in headers.items()):
+            logger.debug(f"Unchanged: s3://{bucket}/{object_key}")
+            return False
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            raise
+    logger.debug(f"Uploading: s3://{bucket}/{object_key}")
+    s3.put_object(
+        Bucket=bucket,
+        Key=object_key,
+        Body=data,
+        Metadata={HASH_METADATA_KEY: digest},
+        **headers
+    )
+    return True
+
+
+def remove_superseded(s3, bucket, current):
+    # Deletes the fingerprinted objects which aren't current and have been
+    # superseded for the grace period, and returns how many. When each was
+    # first seen superseded is kept in SUPERSEDED_KEY until it's deleted.
+    now = int(time.time())
+    grace = int(os.environ.get('STALE_ASSET_GRACE_SECONDS', 7 * 24 * 3600))
+    try:
+        seen = json.loads(s3.get_object(Bucket=bucket, Key=SUPERSEDED_KEY)[
+                              'Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+        seen = {}
+    superseded = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket):
+        for item in page.get('Contents', []):
+            key = item['Key']
+            if FINGERPRINTED_REGEX.fullmatch(key) and key not in current:
+                superseded[key] = seen.get(key, now)
+    expired = sorted(k for k, v in superseded.items() if now - v >= grace)
+    for i in range(0, len(expired), PURGE_PAGE_SIZE):
+        response = s3.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': x} for x in expired[i:i + PURGE_PAGE_SIZE]],
+            'Quiet': True})
+        if response.get('Errors'):
+            error = response['Errors'][0]
+            raise RuntimeError(
+                f"Unable to delete {len(response['Errors'])} objects from {bucket}: {error['Key']} {error['Message']}")
+    waiting = {k: v for k, v in superseded.items() if now - v < grace}
+    if waiting:
+        if waiting != seen:
+            s3.put_object(Bucket=bucket, Key=SUPERSEDED_KEY,
+                          Body=json.dumps(waiting, sort_keys=True),
+                          ContentType='application/json',
+                          CacheControl='no-store')
+    elif seen:
+        s3.delete_object(Bucket=bucket, Key=SUPERSEDED_KEY)
+    return len(expired)
 
 
 @helper.delete
-def delete_data(event, _):
+def delete_data(event, context):
     logger.debug('Event: ' + json.dumps(event))
-    s3 = boto3.client('s3')
+    if not purge_buckets(event, context):
+        raise RuntimeError('Ran out of time purging the buckets')
+
+
+def purge_buckets(event, context):
+    # Deletes every version and delete marker in the buckets. Returns False if
+    # it stopped because the invocation was about to time out.
+    max_workers = int(os.environ.get('PURGE_MAX_WORKERS', 8))
+    s3 = boto3.client('s3', config=Config(max_pool_connections=max_workers))
+    deadline = None
+    if context is not None:
+        deadline = time.monotonic() + (
+                context.get_remaining_time_in_millis() / 1000 -
+                PURGE_TIME_RESERVE_SECONDS)
+    checkpoint = event.setdefault('PurgeCheckpoint',
+                                  {'deleted': 0, 'invocations': 0})
     bucket_list = [
         event['ResourceProperties']['StaticWebsiteBucket'],
         event['ResourceProperties']['UploadedImagesBucket']
     ]
+    # Stacks from before the archives don't have them
+    if event['ResourceProperties'].get('InferenceArchiveBucket'):
+        bucket_list.append(event['ResourceProperties']['InferenceArchiveBucket'])
+    if event['ResourceProperties'].get('SubmissionArchiveBucket'):
+        bucket_list.append(event['ResourceProperties']['SubmissionArchiveBucket'])
     for bucket in bucket_list:
         logger.debug(f"Deleting S3 Bucket Contents: {bucket}")
-        key_count = 1
-        while key_count > 0:
-            response = s3.list_objects_v2(
+        deleted, done = purge_bucket(s3, bucket, deadline, max_workers)
+        checkpoint['deleted'] += deleted
+        logger.debug(
+            f"Deleted {deleted} Objects from {bucket}, {checkpoint['deleted']} in Total")
+        if not done:
+            return False
+    return True
+
+
+def purge_bucket(s3, bucket, deadline, max_workers):
+    # Returns the number deleted and whether the bucket is now empty. Passes
+    # over the bucket until one finds nothing left, which also catches
+    # objects uploaded while the purge was running.
+    deleted = 0
+    while True:
+        count, done = purge_pass(s3, bucket, deadline, max_workers)
+        deleted += count
+        if not done or count == 0:
+            return deleted, done
+        if deadline and time.monotonic() > deadline:
+            return deleted, False
+
+
+def purge_pass(s3, bucket, deadline, max_workers):
+    # Pages are listed one after another, as each needs the previous page's
+    # markers, while up to max_workers pages are deleted at once.
+    slots = BoundedSemaphore(max_workers * 2)
+    futures = []
+    done = True
+
+    def delete(objects):
+        try:
+            response = s3.delete_objects(
                 Bucket=bucket,
-                MaxKeys=1000
+                Delete={'Objects': objects, 'Quiet': True}
             )
-            key_count = response['KeyCount']
-            if key_count > 0:
-                delete_dict = [{'Key': x['Key']} for x in response['Contents']]
-                for key_obj in delete_dict:
-                    logger.debug(
-                        f"Queueing S3 Object Deletion: {key_obj['Key']}")
-                s3.delete_objects(
-                    Bucket=bucket,
-                    Delete={'Objects': delete_dict}
-                )
+            return len(objects), response.get('Errors', [])
+        finally:
+            slots.release()
 
+    paginator = s3.get_paginator('list_object_versions')
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for page in paginator.paginate(
+                Bucket=bucket, PaginationConfig={'PageSize': PURGE_PAGE_SIZE}):
+            objects = [{'Key': x['Key'], 'VersionId': x['VersionId']} for x in
+                       page.get('Versions', []) + page.get('DeleteMarkers', [])]
+            if objects:
+                slots.acquire()
+                futures.append(executor.submit(delete, objects))
+            if page.get('IsTruncated') and deadline and \
+                    time.monotonic() > deadline:
+                done = False
+                break
+    deleted = 0
+    errors = []
+    for future in futures:
+        count, page_errors = future.result()
+        deleted += count - len(page_errors)
+        errors += page_errors
+    if errors:
+        raise RuntimeError(
+            f"Unable to delete {len(errors)} objects from {bucket}: {errors[0]['Key']} {errors[0]['Message']}")
+    return deleted, done
 
-@helper.update
-def no_op(_, __):
-    # No Operation
-    pass
+
+def continue_async(event, context):
+    # Picks the purge up in a new invocation, which responds to CloudFormation
+    # once the buckets are empty. Everything deleted so far stays deleted, so
+    # the checkpoint in the event is only the progress made.
+    event['PurgeCheckpoint']['invocations'] += 1
+    logger.debug(
+        f"Continuing Purge in Invocation {event['PurgeCheckpoint']['invocations'] + 1}")
+    boto3.client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(event)
+    )
 
 
 def handler(event, context):
+    # Purging large buckets can take longer than one invocation, so it's done
+    # before handing over to crhelper, which responds to CloudFormation.
+    if event['RequestType'] == 'Delete' and event.get(
+            'PurgeCheckpoint', {}).get('invocations', 0) < int(
+            os.environ.get('PURGE_MAX_INVOCATIONS', 50)):
+        try:
+            done = purge_buckets(event, context)
+        except Exception as e:
+            # delete_data runs into it again and reports the failure
+            logger.error(f"Unable to Purge Buckets: {e}")
+            done = True
+        if not done:
+            continue_async(event, context)
+            return
     helper(event, context)
@@ -0,0 +1,162 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from urllib.parse import parse_qsl
+
+from loguru import logger
+
+from dl_suggestion_common import (apigw_response, client, core,
+                                  metrics_scope, record_response)
+
+# The HTTP API as one long-running ASGI service, an alternative to deploying
+# a Lambda function per route behind API Gateway. Both run the same code in
+# dl_suggestion_common.core, but here the pooled clients and the report cache
+# live for the life of the process and are shared by every request.
+#
+# From the sam/ directory, with service/requirements.txt installed and the
+# shared code on the path (the CommonLayer, for the Lambda functions):
+#   PYTHONPATH=common REPORT_TABLE=... ALLOW_ORIGIN_HEADER_VALUE=... \
+#       uvicorn service.app:app --host 0.0.0.0 --port 8080
+#
+# boto3 is blocking, so requests are handled on a pool of SERVICE_MAX_WORKERS
+# threads while the event loop keeps accepting connections.
+DEFAULT_MAX_WORKERS = 16
+# The report catalog only changes when it is seeded
+DEFAULT_REPORTS_CACHE_SECONDS = 60
+SUBMISSION_PATH = r'/submission/(?P<submission_id>[^/]+)\Z'
+# Returned by read_body() when the client went away mid-request
+DISCONNECTED = object()
+
+# The routes of the Api in template.yaml: (method, path, Service dimension of
+# the metrics, function of the path match, query and body)
+ROUTES = [
+    ('GET', re.compile(r'/submissions\Z'), 'GetSubmissions',
+     lambda match, query, body: core.list_submissions(query)),
+    ('GET', re.compile(SUBMISSION_PATH), 'GetSubmission',
+     lambda match, query, body: core.get_submission(
+         match.group('submission_id'))),
+    ('POST', re.compile(r'/submissions/batch-get\Z'), 'BatchGetSubmissions',
+     lambda match, query, body: core.batch_get(body)),
+    ('PATCH', re.compile(SUBMISSION_PATH), 'PatchSubmission',
+     lambda match, query, body: core.patch_submission(
+         match.group('submission_id'), body)),
+    ('POST', re.compile(r'/submissions/bulk\Z'), 'PatchSubmission',
+     lambda match, query, body: core.bulk_patch_submissions(body)),
+    ('GET', re.compile(r'/reports\Z'), 'GetReports',
+     lambda match, query, body: core.get_reports()),
+    ('GET', re.compile(r'/stats\Z'), 'GetStats',
+     lambda match, query, body: core.get_stats(query)),
+    ('POST', re.compile(r'/uploads\Z'), 'CreateUpload',
+     lambda match, query, body: core.create_upload(body)),
+]
+
+
+def route(method, path):
+    # Returns the route and path match, or the status code if there is none
+    status_code = 404
+    for route_method, pattern, service, handler in ROUTES:
+        match = pattern.match(path)
+        if not match:
+            continue
+        if route_method == method:
+            return (service, handler), match
+        status_code = 405
+    return status_code, None
+
+
+def invoke(service, handler, match, query, body):
+    # Runs on a worker thread, with the same metrics as the Lambda handler
+    with metrics_scope(service) as scope:
+        try:
+            response = apigw_response(*handler(match, query, body))
+        except Exception:
+            logger.exception(f"Unhandled error in {service}")
+            response = apigw_response(500, 'Internal Server Error')
+        record_response(scope, response)
+        return response
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return DISCONNECTED
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body = b''.join(chunks)
+    # API Gateway passes an empty body as null
+    return body.decode('utf-8', 'replace') if body else None
+
+
+async def send_response(send, response):
+    body = response.get('body', '').encode('utf-8')
+    headers = [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for
+               k, v in response['headers'].items()]
+    headers.append((b'content-type', b'application/json'))
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({'type': 'http.response.start',
+                'status': response['statusCode'],
+                'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def http(scope, receive, send):
+    body = await read_body(receive)
+    if body is DISCONNECTED:
+        return
+    if scope['method'] == 'OPTIONS':
+        # CORS preflight, which API Gateway answers for the Lambda functions
+        await send_response(send, apigw_response(204))
+        return
+    found, match = route(scope['method'], scope['path'])
+    if match is None:
+        await send_response(send, apigw_response(found))
+        return
+    service, handler = found
+    # Duplicate parameters keep the last value, like queryStringParameters
+    query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+    # to_thread copies the context, so the request's metrics scope is only
+    # seen by its own thread.
+    response = await asyncio.to_thread(invoke, service, handler, match, query,
+                                       body)
+    await send_response(send, response)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                startup()
+            except Exception as e:
+                logger.exception('Startup failed')
+                await send({'type': 'lifespan.startup.failed',
+                            'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def startup():
+    environ.setdefault('REPORTS_CACHE_SECONDS',
+                       str(DEFAULT_REPORTS_CACHE_SECONDS))
+    max_workers = int(environ.get('SERVICE_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=max_workers,
+                           thread_name_prefix='service'))
+    # Create the shared client before the first request rather than during it
+    client('dynamodb')
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http':
+        await http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await lifespan(receive, send)
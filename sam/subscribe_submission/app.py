@@ -0,0 +1,61 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import time
+
+import simplejson as json
+from loguru import logger
+
+from dl_suggestion_common import (log_event, match_submission_id, metrics,
+                                  table, with_metrics)
+
+# Subscriptions only need to live long enough for the upload to be processed.
+# DynamoDB TTL removes any the image processing never got around to.
+SUBSCRIPTION_TTL_SECONDS = 900
+
+
+@with_metrics('SubscribeSubmission')
+def lambda_handler(event, context):
+    log_event(event)
+    connection_id = event['requestContext']['connectionId']
+    try:
+        body = json.loads(event['body'])
+    except (TypeError, ValueError):
+        logger.error('Unrecognized Subscribe Format: ' + str(event['body']))
+        return websocket_response(400, {
+            'type': 'error',
+            'reason': 'Invalid subscribe format. Must have an JSON body.'
+        })
+    # Make sure it's a UUIDv4 submission id
+    submission_id = match_submission_id(body.get('submission_id', ''))
+    if not submission_id:
+        logger.error('Unrecognized Submission ID: ' + json.dumps(body))
+        return websocket_response(400, {
+            'type': 'error',
+            'reason': 'Invalid submission_id. Submission ID must be UUIDv4 format.'
+        })
+    logger.debug(f"Subscribing Connection {connection_id} to {submission_id}")
+    with metrics().timer('PutSubscription'):
+        table().put_item(
+            Item={
+                'pk': f"submission_{submission_id}",
+                'sk': f"connection_{connection_id}",
+                'connection_id': connection_id,
+                'expires_at': int(time.time()) + SUBSCRIPTION_TTL_SECONDS
+            }
+        )
+    return websocket_response(200, {
+        'type': 'subscribed',
+        'submission_id': submission_id
+    })
+
+
+def websocket_response(status_code, body=None):
+    # The body of the integration response is relayed back over the socket as
+    # the route response.
+    response = {
+        'statusCode': status_code
+    }
+    if body:
+        response['body'] = body if isinstance(body, str) else json.dumps(body)
+    return response
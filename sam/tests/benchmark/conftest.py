@@ -0,0 +1,20 @@
+# Benchmarks only run once each, as smoke tests, in a normal test run (see
+# --benchmark-disable in tests/pyproject.toml), such as:
+#
+#   cd sam && PYTHONPATH=.. AWS_DEFAULT_REGION=us-west-2 python -m pytest tests
+#
+# To measure, with the same environment:
+#
+#   python -m pytest tests/benchmark --benchmark-enable --benchmark-only
+#
+# Save a new baseline (into tests/benchmark/baselines, wherever pytest is run
+# from) after an intended change in performance, or when moving to a different
+# machine:
+#
+#   python -m pytest tests/benchmark --benchmark-enable --benchmark-only \
+#       --benchmark-save=baseline
+#
+# And fail if anything got more than 25% slower than the latest baseline:
+#
+#   python -m pytest tests/benchmark --benchmark-enable --benchmark-only \
+#       --benchmark-compare --benchmark-compare-fail=mean:25%
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+import simplejson
+from boto3.dynamodb.types import TypeDeserializer
+
+from dl_suggestion_common import ddb_json
+
+# Run with: python -m pytest tests/benchmark --benchmark-enable --benchmark-only
+# Compares the resource API path (TypeDeserializer into Decimals, then
+# simplejson) with transcoding the low-level client's DynamoDB JSON directly,
+# on the kind of items GET /submissions returns.
+
+LABELS = ['Road', 'Tar', 'Asphalt', 'Pothole', 'Fire Hydrant', 'Hydrant',
+          'Graffiti', 'Wall', 'Art', 'Tree', 'Plant', 'Vegetation', 'Car',
+          'Vehicle', 'Transportation', 'Sidewalk', 'Path', 'Street Sign',
+          'Sign', 'Symbol', 'Manhole', 'Sewer', 'Puddle', 'Water', 'Urban',
+          'City', 'Building', 'Outdoors', 'Nature', 'Grass', 'Litter', 'Trash',
+          'Light', 'Lamp Post', 'Utility Pole', 'Neighborhood', 'Housing',
+          'Intersection', 'Zebra Crossing', 'Crosswalk']
+
+
+def submission(rng, i):
+    submission_id = f"97cc0239-34fc-49d1-b87a-{i:012d}"
+    return {
+        'pk': {'S': f"submission_{submission_id}"},
+        'sk': {'S': f"submission_{submission_id}"},
+        'gsi1pk': {'S': 'pending'},
+        'gsi1sk': {'S': f"submission_{submission_id}"},
+        'timestamp_submitted': {'S': '2023-11-13T19:13:22.123Z'},
+        'ml_labels': {
+            'M': {label: {'N': str(round(rng.uniform(50, 100), 3))} for label
+                  in rng.sample(LABELS, 30)}
+        },
+        'relevant_reports': {
+            'M': {f"report-{n}": {'N': str(round(rng.uniform(0, 400), 2))} for
+                  n in range(1, 6)}
+        },
+        'coords_image': {
+            'M': {
+                'latitude': {'N': str(round(rng.uniform(-90, 90), 6))},
+                'longitude': {'N': str(round(rng.uniform(-180, 180), 6))}
+            }
+        }
+    }
+
+
+@pytest.fixture(scope='module')
+def items():
+    rng = random.Random(0)
+    return [submission(rng, i) for i in range(200)]
+
+
+def resource_path(items):
+    deserializer = TypeDeserializer()
+    return simplejson.dumps(
+        [{k: deserializer.deserialize(v) for k, v in item.items()} for item in
+         items])
+
+
+def test_resource_path(benchmark, items):
+    benchmark.group = 'ddb_json'
+    benchmark(resource_path, items)
+
+
+def test_transcoder(benchmark, items):
+    benchmark.group = 'ddb_json'
+    result = benchmark(ddb_json.dumps_items, items)
+    assert simplejson.loads(result) == simplejson.loads(resource_path(items))
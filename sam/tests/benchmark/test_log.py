@@ -0,0 +1,51 @@
+import sys
+
+import pytest
+import simplejson
+from loguru import logger
+
+from dl_suggestion_common import log
+
+# Run with: python -m pytest tests/benchmark --benchmark-enable --benchmark-only
+# Cost of logging a large PATCH event when DEBUG is filtered out, as deployed
+# with LOGURU_LEVEL=INFO.
+
+
+@pytest.fixture(scope='module')
+def event():
+    return {
+        'resource': '/submissions/{submission_id}',
+        'httpMethod': 'PATCH',
+        'headers': {f"X-Header-{i}": 'x' * 64 for i in range(30)},
+        'pathParameters': {
+            'submission_id': '97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+        'body': simplejson.dumps({
+            'action': 'submit',
+            'selected_reports': [f"report-{i}" for i in range(50)],
+            'coords': {'latitude': 45.1, 'longitude': -122.1},
+            'notes': 'x' * 20000
+        })
+    }
+
+
+@pytest.fixture()
+def info_level():
+    logger.remove()
+    logger.add(lambda message: None, level='INFO')
+    yield
+    logger.remove()
+    logger.add(sys.stderr)
+
+
+def eager(event):
+    logger.debug('Event: ' + simplejson.dumps(event))
+
+
+def test_eager(benchmark, event, info_level):
+    benchmark.group = 'log_event'
+    benchmark(eager, event)
+
+
+def test_log_event(benchmark, event, info_level):
+    benchmark.group = 'log_event'
+    benchmark(log.log_event, event)
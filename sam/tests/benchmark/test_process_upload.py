@@ -0,0 +1,157 @@
+import io
+import os
+import random
+from decimal import Decimal
+
+import pytest
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+from sam.process_upload import app
+
+# The pure functions process_upload runs for every image, over catalogs,
+# label sets, EXIF data and responses of different sizes.
+
+ASSETS = os.path.join(os.path.dirname(__file__), '..', 'assets')
+VOCABULARY = [f"Label {i}" for i in range(2000)]
+
+
+def catalog(size, rng):
+    return [
+        {
+            'pk': 'reports',
+            'sk': f"report-{i}",
+            'name': f"Report {i}",
+            'labels': rng.sample(VOCABULARY, 3)
+        } for i in range(size)
+    ]
+
+
+def labels(count, rng):
+    return {label: Decimal(rng.uniform(50, 100)).quantize(Decimal("1.000"))
+            for label in rng.sample(VOCABULARY, count)}
+
+
+def gps_image():
+    # Rekognition-sized uploads are mostly phone photos with a GPS IFD
+    exif = Image.Exif()
+    exif[0x0110] = 'Pixel 7'
+    exif[0x8825] = {
+        1: 'N',
+        2: (IFDRational(45), IFDRational(31), IFDRational(125, 10)),
+        3: 'W',
+        4: (IFDRational(122), IFDRational(40), IFDRational(302, 10))
+    }
+    data = io.BytesIO()
+    Image.new('RGB', (64, 64)).save(data, 'JPEG', exif=exif.tobytes())
+    return data.getvalue()
+
+
+def no_exif_image():
+    data = io.BytesIO()
+    Image.new('RGB', (64, 64)).save(data, 'JPEG')
+    return data.getvalue()
+
+
+def asset(name):
+    with open(os.path.join(ASSETS, name), 'rb') as f:
+        return f.read()
+
+
+EXIF_VARIANTS = {
+    'gps': gps_image,
+    'no_exif': no_exif_image,
+    # GPSInfo present but all NaN
+    'no_gps': lambda: asset('example_upload_no_gps.jpg'),
+    # EXIF without any GPSInfo
+    'screenshot': lambda: asset('example_not_a_photo.jpg')
+}
+
+
+@pytest.mark.parametrize('label_count', [10, 50])
+@pytest.mark.parametrize('catalog_size', [10, 100, 1000])
+def test_determine_relevant_reports(benchmark, catalog_size, label_count):
+    benchmark.group = 'determine_relevant_reports'
+    rng = random.Random(0)
+    reports = catalog(catalog_size, rng)
+    image_labels = labels(label_count, rng)
+    # Make sure some of them actually match
+    image_labels[reports[0]['labels'][0]] = Decimal('87.938')
+    result = benchmark(app.determine_relevant_reports, reports, image_labels)
+    assert 'report-0' in result
+
+
+@pytest.mark.parametrize('label_count', [10, 50])
+@pytest.mark.parametrize('catalog_size', [100, 1000, 5000])
+def test_rank_reports(benchmark, catalog_size, label_count):
+    # Ranking with an already compiled catalog, as every invocation does while
+    # the catalog version stays the same
+    benchmark.group = 'rank_reports'
+    rng = random.Random(0)
+    reports = catalog(catalog_size, rng)
+    image_labels = labels(label_count, rng)
+    image_labels[reports[0]['labels'][0]] = Decimal('87.938')
+    parents = {label: rng.sample(VOCABULARY, 2) for label in image_labels}
+    ranker = app.ReportRanker(reports)
+    result = benchmark(ranker.rank, image_labels, parents, 10)
+    assert len(result) <= 10
+
+
+@pytest.mark.parametrize('catalog_size', [1000, 5000])
+def test_compile_reports(benchmark, catalog_size):
+    benchmark.group = 'compile_reports'
+    reports = catalog(catalog_size, random.Random(0))
+    ranker = benchmark(app.ReportRanker, reports)
+    assert len(ranker.report_ids) == catalog_size
+
+
+@pytest.mark.parametrize('variant', list(EXIF_VARIANTS))
+def test_get_exif_data(benchmark, variant):
+    benchmark.group = 'get_exif_data'
+    data = EXIF_VARIANTS[variant]()
+
+    def open_and_parse():
+        return app.get_exif_data(Image.open(io.BytesIO(data)))
+
+    exif_data = benchmark(open_and_parse)
+    assert ('GPSInfo' in exif_data) == (variant in ('gps', 'no_gps'))
+
+
+@pytest.mark.parametrize('ref', ['N', 'S', 'E', 'W'])
+def test_get_decimal_from_dms(benchmark, ref):
+    benchmark.group = 'get_decimal_from_dms'
+    dms = (IFDRational(45), IFDRational(31), IFDRational(125, 10))
+    result = benchmark(app.get_decimal_from_dms, dms, ref)
+    assert abs(result) == Decimal('45.520138888888887')
+
+
+@pytest.mark.parametrize('variant', list(EXIF_VARIANTS))
+def test_get_lat_lon(benchmark, variant):
+    benchmark.group = 'get_lat_lon'
+    exif_data = app.get_exif_data(
+        Image.open(io.BytesIO(EXIF_VARIANTS[variant]())))
+    lat, lon = benchmark(app.get_lat_lon, exif_data)
+    if variant == 'gps':
+        assert lat > 0 > lon
+
+
+@pytest.mark.parametrize('submission_count', [1, 100, 1000])
+def test_apigw_response(benchmark, monkeypatch, submission_count):
+    benchmark.group = 'apigw_response'
+    monkeypatch.setenv('ALLOW_ORIGIN_HEADER_VALUE', '*')
+    rng = random.Random(0)
+    body = [
+        {
+            'pk': f"submission_97cc0239-34fc-49d1-b87a-{i:012d}",
+            'sk': f"submission_97cc0239-34fc-49d1-b87a-{i:012d}",
+            'status': 'pending',
+            'ml_labels': labels(30, rng),
+            'relevant_reports': {'report-1': Decimal('160.730')},
+            'coords_image': {
+                'latitude': Decimal('45.520138888888887'),
+                'longitude': Decimal('-122.675055555555559')
+            }
+        } for i in range(submission_count)
+    ]
+    response = benchmark(app.apigw_response, 200, body)
+    assert response['statusCode'] == 200
@@ -0,0 +1,113 @@
+import asyncio
+import os
+from unittest import mock
+
+import boto3
+import pytest
+from moto import mock_dynamodb
+
+from sam.get_reports import app as get_reports
+from sam.get_submission import app as get_submission
+from sam.service import app
+
+# Run with: python -m pytest tests/benchmark --benchmark-enable --benchmark-only
+# The same requests through the Lambda handlers and through the ASGI service,
+# both against an in-process moto DynamoDB, so the difference is the adapter
+# and the report cache rather than the network.
+
+SUBMISSION_ID = '97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+
+
+@pytest.fixture()
+def report_table():
+    with mock_dynamodb(), mock.patch.dict(os.environ, {
+        'REPORT_TABLE': 'TEST_REPORT_TABLE',
+        'ALLOW_ORIGIN_HEADER_VALUE': '*',
+        # Both write their metrics, but not to the terminal
+        'METRICS_FILE': os.devnull
+    }):
+        boto3.setup_default_session()
+        client = boto3.client('dynamodb', region_name='us-west-2')
+        client.create_table(
+            TableName='TEST_REPORT_TABLE',
+            KeySchema=[
+                {'AttributeName': 'pk', 'KeyType': 'HASH'},
+                {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'pk', 'AttributeType': 'S'},
+                {'AttributeName': 'sk', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        for n in range(1, 51):
+            client.put_item(
+                TableName='TEST_REPORT_TABLE',
+                Item={
+                    'pk': {'S': 'reports'},
+                    'sk': {'S': f"report-{n}"},
+                    'name': {'S': f"Report {n}"},
+                    'labels': {'L': [{'S': f"Label {n}-{i}"} for i in
+                                     range(10)]}
+                }
+            )
+        client.put_item(
+            TableName='TEST_REPORT_TABLE',
+            Item={
+                'pk': {'S': f"submission_{SUBMISSION_ID}"},
+                'sk': {'S': f"submission_{SUBMISSION_ID}"},
+                'gsi1pk': {'S': 'pending'},
+                'gsi1sk': {'S': '2022-07-20T17:47:39.012Z'}
+            }
+        )
+        yield client
+
+
+@pytest.fixture()
+def service():
+    # One event loop for the run, like a long-running server
+    loop = asyncio.new_event_loop()
+
+    async def startup():
+        app.startup()
+
+    async def ignore(message):
+        pass
+
+    with mock.patch.dict(os.environ):
+        loop.run_until_complete(startup())
+
+        def request(method, path):
+            async def receive():
+                return {'type': 'http.request', 'body': b'',
+                        'more_body': False}
+
+            return loop.run_until_complete(
+                app.app({'type': 'http', 'method': method, 'path': path,
+                         'query_string': b''}, receive, ignore))
+
+        yield request
+    loop.close()
+
+
+@pytest.mark.benchmark(group='GET /reports')
+def test_get_reports_lambda(benchmark, report_table):
+    benchmark(get_reports.lambda_handler, {'resource': '/reports'}, None)
+
+
+@pytest.mark.benchmark(group='GET /reports')
+@pytest.mark.parametrize('cache_seconds', ['0', '60'])
+def test_get_reports_service(benchmark, report_table, service, cache_seconds):
+    with mock.patch.dict(os.environ, {'REPORTS_CACHE_SECONDS': cache_seconds}):
+        benchmark(service, 'GET', '/reports')
+
+
+@pytest.mark.benchmark(group='GET /submission/{submission_id}')
+def test_get_submission_lambda(benchmark, report_table):
+    benchmark(get_submission.lambda_handler,
+              {'pathParameters': {'submission_id': SUBMISSION_ID}}, None)
+
+
+@pytest.mark.benchmark(group='GET /submission/{submission_id}')
+def test_get_submission_service(benchmark, report_table, service):
+    benchmark(service, 'GET', f"/submission/{SUBMISSION_ID}")
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# The handlers import the shared code from the CommonLayer, which the Lambda
+# runtime puts on the path. Do the same here.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'common'))
+
+from dl_suggestion_common import aws, core
+
+# Where the benchmarks' baselines are saved, see tests/benchmark/conftest.py
+BENCHMARK_BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'benchmark', 'baselines')
+
+
+def pytest_configure(config):
+    # An absolute path, as pytest-benchmark takes a relative one from the
+    # working directory. Unless another storage was asked for.
+    if getattr(config.option, 'benchmark_storage',
+               None) == 'file://./.benchmarks':
+        config.option.benchmark_storage = f"file://{BENCHMARK_BASELINES}"
+
+
+@pytest.fixture(autouse=True)
+def reset_pooled_clients():
+    # Clients are cached for the life of the process, so don't let one
+    # created under a previous test's mocks leak into the next test.
+    aws.reset()
+    yield
+    aws.reset()
@@ -0,0 +1,351 @@
+import argparse
+import logging
+import math
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from unittest import mock
+
+import boto3
+import simplejson as json
+from loguru import logger
+from moto.server import ThreadedMotoServer
+
+# Drives the real handlers through the upload -> label -> submit -> resolve
+# flow against a local moto server, and reports latency percentiles and
+# throughput per endpoint. No AWS credentials or network access are needed.
+#
+# From the sam/ directory:
+#   PYTHONPATH=.. python -m tests.load.harness --rate 20 --concurrency 8 \
+#       --duration 30 --label-latency 0.25
+
+SAM_DIR = os.path.join(os.path.dirname(__file__), '..', '..')
+# The handlers import the shared code from the CommonLayer
+sys.path.insert(0, os.path.join(SAM_DIR, 'common'))
+
+from dl_suggestion_common import aws  # noqa: E402
+
+TABLE_NAME = 'LOAD_TEST_REPORT_TABLE'
+BUCKET_NAME = 'load-test-uploaded-images'
+REGION = 'us-west-2'
+IMAGE_PATH = os.path.join(SAM_DIR, 'tests', 'assets',
+                          'example_upload_no_gps.jpg')
+# Labels returned by the stubbed label backend, which match a couple of the
+# seeded reports.
+STUB_LABELS = [
+    {'Name': 'Fire Hydrant', 'Confidence': 72.79216003417969},
+    {'Name': 'Hydrant', 'Confidence': 87.93804168701172},
+    {'Name': 'Road', 'Confidence': 99.18000030517578},
+    {'Name': 'Tar', 'Confidence': 95.17200469970703},
+    {'Name': 'Pothole', 'Confidence': 64.39299774169922}
+]
+ENDPOINTS = ['S3 process_upload', 'GET /reports',
+             'GET /submission/{submission_id}', 'PATCH submit',
+             'PATCH resolve', 'GET /submissions']
+
+
+class StubRekognition:
+    # Stands in for Rekognition, which moto doesn't label images for
+    def __init__(self, latency):
+        self.latency = latency
+
+    def detect_labels(self, Image, MinConfidence):
+        if self.latency:
+            time.sleep(self.latency)
+        return {'Labels': [x for x in STUB_LABELS if
+                           x['Confidence'] >= MinConfidence]}
+
+
+class Results:
+    def __init__(self):
+        self.latencies = {x: [] for x in ENDPOINTS}
+        self.errors = {x: 0 for x in ENDPOINTS}
+        self.failed_flows = 0
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return 0
+    rank = max(math.ceil(p / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+
+def summarize(results, elapsed):
+    summary = {}
+    for endpoint in ENDPOINTS:
+        latencies = sorted(results.latencies[endpoint])
+        summary[endpoint] = {
+            'count': len(latencies),
+            'errors': results.errors[endpoint],
+            'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2)
+        }
+    return summary
+
+
+def format_summary(summary, elapsed, failed_flows):
+    lines = [
+        f"{'Endpoint':<24}{'Count':>8}{'Errors':>8}{'Req/s':>9}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for endpoint, x in summary.items():
+        lines.append(
+            f"{endpoint:<24}{x['count']:>8}{x['errors']:>8}"
+            f"{x['throughput']:>9}{x['p50_ms']:>10}{x['p95_ms']:>10}"
+            f"{x['p99_ms']:>10}")
+    lines.append(f"Elapsed {elapsed:.2f}s, {failed_flows} failed flows")
+    return '\n'.join(lines)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def moto_server():
+    port = free_port()
+    # Otherwise every request to the server is logged
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port,
+                                verbose=False)
+    server.start()
+    # The server shares its state with any moto mocks in the same process,
+    # e.g. an earlier test's, so start from empty.
+    urllib.request.urlopen(urllib.request.Request(
+        f"http://127.0.0.1:{port}/moto-api/reset", method='POST'))
+    env = {
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'AWS_SESSION_TOKEN': 'testing',
+        'AWS_DEFAULT_REGION': REGION,
+        # Every boto3 client, including the handlers' pooled ones, talks to
+        # the moto server.
+        'AWS_ENDPOINT_URL': f"http://127.0.0.1:{port}",
+        'REPORT_TABLE': TABLE_NAME,
+        'ALLOW_ORIGIN_HEADER_VALUE': '*'
+    }
+    try:
+        with mock.patch.dict(os.environ, env):
+            aws.reset()
+            yield
+    finally:
+        aws.reset()
+        server.stop()
+
+
+def create_resources():
+    dynamodb = boto3.client('dynamodb')
+    dynamodb.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table = boto3.resource('dynamodb').Table(TABLE_NAME)
+    with open(os.path.join(SAM_DIR, 'seed_ddb_data', 'initial_data.json')) as f:
+        with table.batch_writer() as batch:
+            for item in json.load(f):
+                batch.put_item(Item=item)
+    boto3.client('s3').create_bucket(
+        Bucket=BUCKET_NAME,
+        CreateBucketConfiguration={'LocationConstraint': REGION}
+    )
+
+
+def s3_event(object_key, size):
+    return {
+        'Records': [
+            {
+                'eventSource': 'aws:s3',
+                'eventName': 'ObjectCreated:Put',
+                's3': {
+                    'bucket': {'name': BUCKET_NAME},
+                    'object': {'key': object_key, 'size': size}
+                }
+            }
+        ]
+    }
+
+
+def apigw_event(method, resource, path, path_parameters=None,
+                query_string_parameters=None, body=None):
+    return {
+        'resource': resource,
+        'path': path,
+        'httpMethod': method,
+        'pathParameters': path_parameters or {},
+        'queryStringParameters': query_string_parameters or {},
+        'body': body
+    }
+
+
+def run_flow(handlers, results, image):
+    # One citizen's submission: upload the image, let it be labelled, pick a
+    # report and submit it, then a maintainer lists and resolves it.
+    submission_id = str(uuid.uuid4())
+    object_key = f"maint-img/{submission_id}"
+    path = f"/submission/{submission_id}"
+
+    def call(endpoint, handler, event):
+        start = time.perf_counter()
+        try:
+            response = handler(event, None)
+            ok = response is None or 200 <= response['statusCode'] < 300
+        except Exception as e:
+            logger.error(f"{endpoint} failed: {e}")
+            response = None
+            ok = False
+        results.record(endpoint, time.perf_counter() - start, ok)
+        if not ok:
+            raise RuntimeError(f"{endpoint} failed for {submission_id}")
+        return response
+
+    try:
+        boto3.client('s3').put_object(Bucket=BUCKET_NAME, Key=object_key,
+                                      Body=image)
+        call('S3 process_upload', handlers['process_upload'],
+             s3_event(object_key, len(image)))
+        call('GET /reports', handlers['get_reports'],
+             apigw_event('GET', '/reports', '/reports'))
+        call('GET /submission/{submission_id}', handlers['get_submission'],
+             apigw_event('GET', '/submission/{submission_id}', path,
+                         {'submission_id': submission_id}))
+        call('PATCH submit', handlers['patch_submission'],
+             apigw_event('PATCH', '/submission/{submission_id}', path,
+                         {'submission_id': submission_id},
+                         body=json.dumps({
+                             'action': 'submit',
+                             'selected_reports': ['report-1'],
+                             'coords': {'latitude': 45.52,
+                                        'longitude': -122.68}
+                         })))
+        call('GET /submissions', handlers['get_submissions'],
+             apigw_event('GET', '/submissions', '/submissions',
+                         query_string_parameters={'status': 'submitted'}))
+        call('PATCH resolve', handlers['patch_submission'],
+             apigw_event('PATCH', '/submission/{submission_id}', path,
+                         {'submission_id': submission_id},
+                         body=json.dumps({'action': 'resolve'})))
+    except RuntimeError:
+        with results._lock:
+            results.failed_flows += 1
+
+
+def run(rate, concurrency, duration, label_latency):
+    # Flows are started at a fixed rate (open loop) and run on up to
+    # `concurrency` threads, so a slow backend shows up as queueing rather
+    # than as a lower request rate.
+    from sam.get_reports import app as get_reports
+    from sam.get_submission import app as get_submission
+    from sam.get_submissions import app as get_submissions
+    from sam.patch_submission import app as patch_submission
+    from sam.process_upload import app as process_upload
+
+    handlers = {
+        'get_reports': get_reports.lambda_handler,
+        'get_submission': get_submission.lambda_handler,
+        'get_submissions': get_submissions.lambda_handler,
+        'patch_submission': patch_submission.lambda_handler,
+        'process_upload': process_upload.lambda_handler
+    }
+    with open(IMAGE_PATH, 'rb') as f:
+        image = f.read()
+    rekognition = StubRekognition(label_latency)
+
+    def client(service_name, **kwargs):
+        if service_name == 'rekognition':
+            return rekognition
+        return aws.client(service_name, **kwargs)
+
+    results = Results()
+    metrics_file = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False)
+    metrics_file.close()
+    with moto_server(), \
+            mock.patch.dict(os.environ, {'METRICS_FILE': metrics_file.name}), \
+            mock.patch.object(process_upload, 'client', client):
+        create_resources()
+        flows = int(rate * duration)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for i in range(flows):
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(run_flow, handlers, results, image)
+        elapsed = time.perf_counter() - start
+    return summarize(results, elapsed), elapsed, results.failed_flows, \
+        metrics_file.name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load test the handlers against a local moto server.')
+    parser.add_argument('--rate', type=float, default=10,
+                        help='Flows started per second')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Flows in flight at once')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds to start flows for')
+    parser.add_argument('--label-latency', type=float, default=0.2,
+                        help='Seconds the stubbed label backend takes')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the summary as JSON')
+    args = parser.parse_args(argv)
+    # The handlers log at DEBUG, which would drown out the report
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    summary, elapsed, failed_flows, metrics_path = run(
+        args.rate, args.concurrency, args.duration, args.label_latency)
+    if args.json:
+        print(json.dumps({
+            'elapsed': round(elapsed, 2),
+            'failed_flows': failed_flows,
+            'metrics_file': metrics_path,
+            'endpoints': summary
+        }, indent=2))
+    else:
+        print(format_summary(summary, elapsed, failed_flows))
+        print(f"Handler metrics written to {metrics_path}")
+    return 1 if failed_flows else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+from tests.load import harness
+
+
+def test_percentile():
+    values = [x / 100 for x in range(1, 101)]
+    assert harness.percentile(values, 50) == 0.5
+    assert harness.percentile(values, 95) == 0.95
+    assert harness.percentile(values, 99) == 0.99
+    assert harness.percentile([0.2], 99) == 0.2
+    assert harness.percentile([], 50) == 0
+
+
+def test_run():
+    # A short run, enough to check the whole flow works against the server
+    summary, elapsed, failed_flows, metrics_path = harness.run(
+        rate=5, concurrency=2, duration=1, label_latency=0)
+    assert failed_flows == 0
+    for endpoint in harness.ENDPOINTS:
+        assert summary[endpoint]['count'] == 5
+        assert summary[endpoint]['errors'] == 0
+        assert summary[endpoint]['p50_ms'] <= summary[endpoint]['p99_ms']
+    with open(metrics_path) as f:
+        assert 'ProcessUpload' in f.read()
@@ -0,0 +1,169 @@
+import os
+from unittest import mock
+
+import boto3
+from moto import mock_dynamodb
+
+from dl_suggestion_common import geohash, sort_key, status_key
+from sam.aggregate_stats import app
+
+CELL = geohash(33.7188111, -112.1748879, 5)
+
+
+def create_table():
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return boto3.resource('dynamodb', region_name='us-west-2').Table(
+        'TEST_REPORT_TABLE')
+
+
+def image(n, gsi1pk, gsi1sk, selected_reports=None, coords_browser=(0, 0),
+          counted=True):
+    item = {
+        'pk': {'S': f"submission_{n}"},
+        'sk': {'S': f"submission_{n}"},
+        'gsi1pk': {'S': gsi1pk},
+        'gsi1sk': {'S': gsi1sk},
+        'coords_image': {'M': {'latitude': {'N': '33.7188111'},
+                               'longitude': {'N': '-112.1748879'}}}
+    }
+    if counted:
+        item['stats_counted'] = {'BOOL': True}
+    if selected_reports is not None:
+        item['selected_reports'] = {'L': [{'S': x} for x in selected_reports]}
+        item['coords_browser'] = {'M': {
+            'latitude': {'N': str(coords_browser[0])},
+            'longitude': {'N': str(coords_browser[1])}}}
+    return item
+
+
+def record(sequence_number, old_image=None, new_image=None):
+    dynamodb = {'SequenceNumber': str(sequence_number)}
+    if old_image:
+        dynamodb['OldImage'] = old_image
+    if new_image:
+        dynamodb['NewImage'] = new_image
+    return {'eventName': 'MODIFY', 'dynamodb': dynamodb}
+
+
+def counts(table):
+    items = table.scan()['Items']
+    return {(x['pk'], x['sk']): x['submission_count'] for x in items if
+            x['pk'].startswith('stats#') and x['submission_count']}
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+def test_lambda_handler():
+    table = create_table()
+    pending = [image(n, f"pending#{n % 2}",
+                     f"2022-07-20T17:47:0{n}.012Z#{n}") for n in range(3)]
+    app.lambda_handler({'Records': [
+        record(n + 1, new_image=x) for n, x in enumerate(pending)]}, None)
+    assert counts(table) == {
+        ('stats#pending', f"2022-07-20#none#{CELL}"): 3}
+
+    # Submitted the next day, one from somewhere else with two reports
+    submitted = image(0, 'submitted#0', '2022-07-21T09:00:00.000Z#0',
+                      ['report-1'])
+    elsewhere = image(1, 'submitted#1', '2022-07-21T10:00:00.000Z#1',
+                      ['report-1', 'report-2'], (47.6062, -122.3321))
+    app.lambda_handler({'Records': [
+        record(4, pending[0], submitted),
+        record(5, pending[1], elsewhere)]}, None)
+    seattle = geohash(47.6062, -122.3321, 5)
+    assert counts(table) == {
+        ('stats#pending', f"2022-07-20#none#{CELL}"): 1,
+        ('stats#submitted', f"2022-07-21#report-1#{CELL}"): 1,
+        ('stats#submitted', f"2022-07-21#report-1#{seattle}"): 1,
+        ('stats#submitted', f"2022-07-21#report-2#{seattle}"): 1}
+
+    # Resolved, then archived, which it still counts as
+    resolved = image(0, 'resolved#0', '2022-07-22T09:00:00.000Z#0',
+                     ['report-1'])
+    stub = {'pk': resolved['pk'], 'sk': resolved['sk'],
+            'archive_key': {'S': 'submissions/resolved_date=2022-07-22/x'}}
+    app.lambda_handler({'Records': [
+        record(6, submitted, resolved),
+        record(7, resolved, stub),
+        # Deleted
+        record(8, pending[2])]}, None)
+    assert counts(table) == {
+        ('stats#submitted', f"2022-07-21#report-1#{seattle}"): 1,
+        ('stats#submitted', f"2022-07-21#report-2#{seattle}"): 1,
+        ('stats#resolved', f"2022-07-22#report-1#{CELL}"): 1}
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE',
+                              'SUBMISSION_SHARDS': '2'})
+def test_submissions_from_before_the_counters():
+    table = create_table()
+    # Resolved before the counters existed, never counted
+    legacy = image(0, 'submitted', 'submission_0', ['report-1'],
+                   counted=False)
+    resolved = image(0, 'resolved', 'submission_0', ['report-1'],
+                     counted=False)
+    app.lambda_handler({'Records': [record(1, legacy, resolved)]}, None)
+    assert counts(table) == {}
+
+    # Backfilled, which the stream then counts once
+    items = [{'pk': f"submission_{n}", 'sk': f"submission_{n}",
+              'gsi1pk': status_key('pending', str(n)),
+              'gsi1sk': sort_key('2022-07-20T17:47:41.012Z', str(n))}
+             for n in range(1, 4)]
+    items[2]['stats_counted'] = True
+    items.append({'pk': 'submission_0', 'sk': 'submission_0',
+                  'gsi1pk': 'resolved', 'gsi1sk': 'submission_0'})
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+    assert app.backfill_handler({}, None) == {
+        'partitions': 9, 'marked': 3, 'skipped': 0}
+    assert app.backfill_handler({}, None)['marked'] == 0
+    assert table.get_item(Key={'pk': 'submission_1', 'sk': 'submission_1'})[
+        'Item']['stats_counted'] is True
+    backfilled = dict(resolved, stats_counted={'BOOL': True})
+    app.lambda_handler({'Records': [record(2, resolved, backfilled)]}, None)
+    assert counts(table) == {
+        ('stats#resolved', f"none#report-1#{CELL}"): 1}
+
+    # And after that moves between counters like any other
+    reopened = image(0, 'submitted#0', '2022-07-23T09:00:00.000Z#0',
+                     ['report-1'])
+    app.lambda_handler({'Records': [record(3, backfilled, reopened)]}, None)
+    assert counts(table) == {
+        ('stats#submitted', f"2022-07-23#report-1#{CELL}"): 1}
+
+
+def test_counters_legacy_sort_key_and_no_coordinates():
+    item = image(0, 'pending', 'submission_0')
+    del item['coords_image']
+    assert app.counters(item) == [('pending', 'none', 'none', 'none')]
+    assert app.counters(None) == []
@@ -0,0 +1,141 @@
+import asyncio
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+from dl_suggestion_common import aio
+from tests.load import harness
+
+
+@pytest.fixture(scope='module')
+def moto_server():
+    # aiobotocore can't be intercepted by the moto decorators, so these run
+    # against a moto server instead.
+    with harness.moto_server():
+        harness.create_resources()
+        yield
+
+
+def run(coroutine):
+    async def with_session():
+        async with aio.Session(max_concurrency=10) as session:
+            return await coroutine(session)
+
+    return asyncio.run(with_session())
+
+
+def submission(n, status='pending'):
+    submission_id = f"97cc0239-34fc-49d1-b87a-{n:012d}"
+    return {
+        'pk': f"submission_{submission_id}",
+        'sk': f"submission_{submission_id}",
+        'gsi1pk': status,
+        'gsi1sk': f"2022-07-20T17:47:{n % 60:02d}.012Z",
+        'ml_labels': {'Hydrant': Decimal('87.93804168701172')}
+    }
+
+
+def test_get_item_and_query(moto_server):
+    async def test(session):
+        table = session.table()
+        report = await table.get_item({'pk': 'reports', 'sk': 'report-1'})
+        missing = await table.get_item({'pk': 'reports', 'sk': 'missing'})
+        reports = await table.query(Key('pk').eq('reports'))
+        filtered = await table.query(Key('pk').eq('reports'),
+                                     filter=Attr('sk').eq('report-1'))
+        return report, missing, reports, filtered
+
+    report, missing, reports, filtered = run(test)
+    assert report['sk'] == 'report-1'
+    assert missing is None
+    assert len(reports) > 1
+    assert filtered == [report]
+
+
+def test_batch_write_query_pages_and_batch_get(moto_server):
+    items = [submission(n, 'aio-batch') for n in range(120)]
+
+    async def test(session):
+        table = session.table()
+        unprocessed = await table.batch_write(put_items=items)
+        queried = await table.query(Key('gsi1pk').eq('aio-batch'),
+                                    index_name='GSI1', Limit=50)
+        keys = [{'pk': x['pk'], 'sk': x['sk']} for x in items]
+        found, unprocessed_keys = await table.batch_get(
+            keys + [{'pk': 'submission_missing', 'sk': 'submission_missing'}])
+        await table.batch_write(delete_keys=keys)
+        deleted = await table.batch_get(keys)
+        return unprocessed, queried, found, unprocessed_keys, deleted
+
+    unprocessed, queried, found, unprocessed_keys, deleted = run(test)
+    assert unprocessed == []
+    assert len(queried) == 120
+    assert queried[0]['ml_labels']['Hydrant'] == Decimal('87.93804168701172')
+    assert sorted(x['pk'] for x in found) == sorted(x['pk'] for x in items)
+    assert unprocessed_keys == []
+    assert deleted == ([], [])
+
+
+def test_update_item_condition(moto_server):
+    item = submission(999)
+    key = {'pk': item['pk'], 'sk': item['sk']}
+
+    async def test(session):
+        table = session.table()
+        await table.batch_write(put_items=[item])
+        updated = await table.update_item(
+            key, 'SET gsi1pk = :gsi1pk', {':gsi1pk': 'resolved'},
+            condition=Attr('pk').eq(item['pk']), return_values='ALL_NEW')
+        with pytest.raises(ClientError) as e:
+            await table.update_item(
+                {'pk': 'submission_missing', 'sk': 'submission_missing'},
+                'SET gsi1pk = :gsi1pk', {':gsi1pk': 'resolved'},
+                condition=Attr('pk').exists())
+        return updated, e.value
+
+    updated, error = run(test)
+    assert updated['gsi1pk'] == 'resolved'
+    assert error.response['Error']['Code'] == \
+           'ConditionalCheckFailedException'
+
+
+def test_concurrent_requests(moto_server):
+    async def test(session):
+        table = session.table()
+        return await asyncio.gather(
+            *[table.get_item({'pk': 'reports', 'sk': f"report-{n % 5 + 1}"})
+              for n in range(200)])
+
+    items = run(test)
+    assert len(items) == 200
+    assert all(items)
+
+
+def test_s3(moto_server):
+    async def test(session):
+        await session.put_object(harness.BUCKET_NAME, 'maint-img/aio', b'jpeg')
+        return await session.get_object(harness.BUCKET_NAME, 'maint-img/aio')
+
+    assert run(test) == b'jpeg'
+
+
+def test_detect_labels(moto_server):
+    # moto doesn't implement DetectLabels
+    async def test(session):
+        client = await session.client('rekognition')
+        with mock.patch.object(client, 'detect_labels',
+                               mock.AsyncMock(return_value={
+                                   'Labels': harness.STUB_LABELS})) as detect:
+            labels = await session.detect_labels(harness.BUCKET_NAME,
+                                                  'maint-img/aio', 55)
+        return labels, detect
+
+    labels, detect = run(test)
+    assert labels == harness.STUB_LABELS
+    detect.assert_awaited_once_with(
+        Image={'S3Object': {'Bucket': harness.BUCKET_NAME,
+                            'Name': 'maint-img/aio'}},
+        MinConfidence=55)
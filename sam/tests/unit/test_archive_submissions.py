@@ -0,0 +1,176 @@
+import io
+import json
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+import boto3
+import pyarrow.parquet as pq
+from moto import mock_dynamodb, mock_s3
+
+from dl_suggestion_common import core, sort_key, status_key
+from sam.archive_submissions import app
+
+ARCHIVE_BUCKET = 'test-submission-archive'
+
+
+def create_resources():
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    boto3.client('s3', region_name='us-west-2').create_bucket(
+        Bucket=ARCHIVE_BUCKET,
+        CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+    return boto3.resource('dynamodb', region_name='us-west-2').Table(
+        'TEST_REPORT_TABLE')
+
+
+def submission(n, days_ago):
+    submission_id = f"97cc0239-34fc-49d1-b87a-{n:012d}"
+    timestamp = (datetime.utcnow() - timedelta(days=days_ago)).isoformat()[
+                :-3] + 'Z'
+    return {
+        'pk': f"submission_{submission_id}",
+        'sk': f"submission_{submission_id}",
+        'gsi1pk': status_key('resolved', submission_id),
+        'gsi1sk': sort_key(timestamp, submission_id),
+        'ml_labels': {'Fire Hydrant': Decimal('72.792'),
+                      'Hydrant': Decimal('87.938')},
+        'relevant_reports': {'report-1': Decimal('160.73')},
+        'selected_reports': ['report-1'],
+        'coords_image': {'latitude': Decimal('33.7188111'),
+                         'longitude': Decimal('-112.1748879')},
+        'coords_browser': {'latitude': Decimal('0'),
+                           'longitude': Decimal('0')},
+        'timestamp_uploaded': '2022-06-07T18:55:02.101Z',
+        'timestamp_submitted': '2022-06-07T18:57:16.564Z',
+        'timestamp_resolved': timestamp
+    }
+
+
+@mock_dynamodb
+@mock_s3
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE',
+                              'SUBMISSION_ARCHIVE_BUCKET': ARCHIVE_BUCKET,
+                              'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE',
+                              'SUBMISSION_SHARDS': '1',
+                              'ARCHIVE_AFTER_DAYS': '90',
+                              'ARCHIVE_FILE_ROWS': '3'})
+def test_lambda_handler(tmp_path):
+    table = create_resources()
+    # Eight old enough to archive, over two days, and two which aren't
+    items = [submission(n, 100 + n % 2) for n in range(8)] + [
+        submission(n, 30) for n in range(8, 10)]
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+
+    metrics_file = tmp_path / 'metrics.jsonl'
+    with mock.patch.dict(os.environ, {'METRICS_FILE': str(metrics_file)}):
+        ret = app.lambda_handler({}, None)
+    # Including what the workers recorded
+    assert 'WriteParquet' in json.loads(metrics_file.read_text())
+    assert ret['archived'] == 8
+    assert ret['skipped'] == 0
+    # Four a day, in files of at most three
+    assert ret['files'] == 4
+    s3 = boto3.client('s3', region_name='us-west-2')
+    keys = [x['Key'] for x in s3.list_objects_v2(
+        Bucket=ARCHIVE_BUCKET, Prefix='submissions/')['Contents']]
+    assert len(keys) == ret['files']
+    assert {x.split('/')[1] for x in keys} == {
+        'resolved_date=' + items[0]['timestamp_resolved'][:10],
+        'resolved_date=' + items[1]['timestamp_resolved'][:10]}
+    files = {key: pq.read_table(io.BytesIO(
+        s3.get_object(Bucket=ARCHIVE_BUCKET, Key=key)['Body'].read())
+    ).to_pylist() for key in keys}
+    assert sorted(x['submission_id'] for rows in files.values() for x in
+                  rows) == sorted(x['pk'][len('submission_'):] for x in
+                                  items[:8])
+    assert max(len(x) for x in files.values()) == 3
+    # And each one on its own, for reading by id
+    assert sorted(x['Key'] for x in s3.list_objects_v2(
+        Bucket=ARCHIVE_BUCKET, Prefix='archived/')['Contents']) == sorted(
+        core.archived_item_key(x['pk'][len('submission_'):]) for x in
+        items[:8])
+
+    # Archived ones are stubs, out of GSI1, the rest are untouched
+    stub = table.get_item(Key={'pk': items[0]['pk'],
+                               'sk': items[0]['sk']})['Item']
+    assert set(stub) == {'pk', 'sk', 'archive_key', 'timestamp_archived'}
+    assert stub['archive_key'] in keys
+    assert table.get_item(Key={'pk': items[9]['pk'],
+                               'sk': items[9]['sk']})['Item'] == items[9]
+
+    # But still found by id, as they were
+    status_code, body = core.get_submission(items[0]['pk'][len('submission_'):])
+    assert status_code == 200
+    expected = core.submission_body(dict(items[0]))
+    assert body == expected
+    status_code, body = core.batch_get(json.dumps({'submission_ids': [
+        x['pk'][len('submission_'):] for x in items[::3]]}))
+    assert status_code == 200
+    assert body['not_found'] == []
+    assert [x['timestamp_resolved'] for x in body['submissions']] == [
+        x['timestamp_resolved'] for x in items[::3]]
+
+    # Archived submissions can't be reopened
+    status_code, _ = core.patch_submission(
+        items[0]['pk'][len('submission_'):], json.dumps({'action': 'reopen'}))
+    assert status_code == 404
+
+    # One missing from the archive isn't found
+    s3.delete_object(Bucket=ARCHIVE_BUCKET, Key=core.archived_item_key(
+        items[0]['pk'][len('submission_'):]))
+    status_code, _ = core.get_submission(items[0]['pk'][len('submission_'):])
+    assert status_code == 404
+
+    # Nothing left to archive
+    assert app.lambda_handler({}, None)['archived'] == 0
+
+
+@mock_dynamodb
+@mock_s3
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE',
+                              'SUBMISSION_ARCHIVE_BUCKET': ARCHIVE_BUCKET,
+                              'SUBMISSION_SHARDS': '1'})
+def test_archive_items_skips_reopened():
+    table = create_resources()
+    item = submission(0, 100)
+    table.put_item(Item=item)
+    # Reopened after the job read it
+    table.update_item(Key={'pk': item['pk'], 'sk': item['sk']},
+                      UpdateExpression='SET gsi1pk = :gsi1pk',
+                      ExpressionAttributeValues={
+                          ':gsi1pk': status_key('submitted', item['pk'])})
+    result = {'files': 0, 'archived': 0, 'skipped': 0}
+    app.archive_items(item['timestamp_resolved'][:10], [item], result)
+    assert result == {'files': 1, 'archived': 0, 'skipped': 1}
+    assert 'archive_key' not in table.get_item(
+        Key={'pk': item['pk'], 'sk': item['sk']})['Item']
@@ -0,0 +1,217 @@
+import json
+import os
+from unittest import mock
+
+import boto3
+import pytest
+from moto import mock_dynamodb
+
+from dl_suggestion_common import core
+from sam.batch_get_submissions import app
+
+
+@pytest.fixture()
+def apigw_event():
+    ''' Generates API GW Event'''
+
+    return {
+        "resource": "/submissions/batch-get",
+        "path": "/submissions/batch-get",
+        "httpMethod": "POST",
+        "body": "{\"submission_ids\":[\"70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11\",\"97cc0239-34fc-49d1-b87a-eb226ecc0e81\",\"1c9e3a77-3f0b-4b8e-a4a1-9d4c2b7e8f02\"]}"
+    }
+
+
+@pytest.fixture()
+def apigw_event_bad_id():
+    ''' Generates API GW Event'''
+
+    return {
+        "resource": "/submissions/batch-get",
+        "path": "/submissions/batch-get",
+        "httpMethod": "POST",
+        "body": "{\"submission_ids\":[\"97cc0239-34fc-49d1-b87a-eb226ecc0e81\",\"97cc0239\"]}"
+    }
+
+
+@pytest.fixture()
+def apigw_event_bad_body():
+    ''' Generates API GW Event'''
+
+    return {
+        "resource": "/submissions/batch-get",
+        "path": "/submissions/batch-get",
+        "httpMethod": "POST",
+        "body": "{\"malformed\"}"
+    }
+
+
+@pytest.fixture()
+def apigw_event_too_many():
+    ''' Generates API GW Event'''
+
+    return {
+        "resource": "/submissions/batch-get",
+        "path": "/submissions/batch-get",
+        "httpMethod": "POST",
+        "body": json.dumps({
+            "submission_ids": [f"97cc0239-34fc-49d1-b87a-{i:012d}" for i in
+                               range(101)]
+        })
+    }
+
+
+def create_submission(client, submission_id, status):
+    client.put_item(
+        TableName='TEST_REPORT_TABLE',
+        Item={
+            'pk': {'S': f"submission_{submission_id}"},
+            'sk': {'S': f"submission_{submission_id}"},
+            'gsi1pk': {'S': status},
+            'gsi1sk': {'S': f"submission_{submission_id}"},
+            'ml_labels': {
+                'M': {
+                    'Fire Hydrant': {'N': '72.792'},
+                    'Hydrant': {'N': '87.938'}
+                }
+            },
+            'relevant_reports': {
+                'M': {
+                    'report-1': {'N': '160.73'}
+                }
+            }
+        }
+    )
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler(apigw_event):
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    create_submission(client, '97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+                      'pending')
+    create_submission(client, '70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11',
+                      'submitted')
+    ret = app.lambda_handler(apigw_event, None)
+    assert ret['statusCode'] == 200
+    ret_body = json.loads(ret['body'])
+    # Returned in request order
+    assert [x['pk'] for x in ret_body['submissions']] == [
+        'submission_70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11',
+        'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    ]
+    assert ret_body['submissions'][0]['status'] == 'submitted'
+    assert ret_body['submissions'][1]['status'] == 'pending'
+    assert 'gsi1pk' not in ret_body['submissions'][0]
+    assert ret_body['not_found'] == ['1c9e3a77-3f0b-4b8e-a4a1-9d4c2b7e8f02']
+    assert 'unprocessed' not in ret_body
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler_bad_submission_id(apigw_event_bad_id):
+    ret = app.lambda_handler(apigw_event_bad_id, None)
+    assert ret['statusCode'] == 400
+    assert ret[
+               'body'] == 'Invalid submissions_id. Submission ID must be UUIDv4 format.'
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler_bad_body(apigw_event_bad_body):
+    ret = app.lambda_handler(apigw_event_bad_body, None)
+    assert ret['statusCode'] == 400
+    assert ret['body'] == 'Invalid batch get format. Must have an JSON body.'
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler_too_many(apigw_event_too_many):
+    ret = app.lambda_handler(apigw_event_too_many, None)
+    assert ret['statusCode'] == 400
+    assert ret[
+               'body'] == 'Invalid batch get format. Must request between 1 and 100 submissions.'
+
+
+@mock.patch('time.sleep')
+def test_batch_get_submissions_unprocessed_keys(mock_sleep):
+    key = {
+        'pk': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+        'sk': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    }
+    dynamodb = mock.MagicMock()
+    dynamodb.batch_get_item.side_effect = [
+        {
+            'Responses': {'TEST_REPORT_TABLE': []},
+            'UnprocessedKeys': {'TEST_REPORT_TABLE': {'Keys': [key]}}
+        },
+        {
+            'Responses': {'TEST_REPORT_TABLE': [dict(key, gsi1pk='pending')]},
+            'UnprocessedKeys': {}
+        }
+    ]
+    items, unprocessed_ids = core.batch_get_submissions(
+        dynamodb, 'TEST_REPORT_TABLE', ['97cc0239-34fc-49d1-b87a-eb226ecc0e81'])
+    assert dynamodb.batch_get_item.call_count == 2
+    assert dynamodb.batch_get_item.call_args.kwargs['RequestItems'] == {
+        'TEST_REPORT_TABLE': {'Keys': [key]}}
+    assert mock_sleep.call_count == 1
+    assert list(items) == ['97cc0239-34fc-49d1-b87a-eb226ecc0e81']
+    assert unprocessed_ids == []
+
+
+@mock.patch('time.sleep')
+def test_batch_get_submissions_gives_up(mock_sleep):
+    key = {
+        'pk': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+        'sk': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    }
+    dynamodb = mock.MagicMock()
+    dynamodb.batch_get_item.return_value = {
+        'Responses': {'TEST_REPORT_TABLE': []},
+        'UnprocessedKeys': {'TEST_REPORT_TABLE': {'Keys': [key]}}
+    }
+    items, unprocessed_ids = core.batch_get_submissions(
+        dynamodb, 'TEST_REPORT_TABLE', ['97cc0239-34fc-49d1-b87a-eb226ecc0e81'])
+    assert dynamodb.batch_get_item.call_count == core.BATCH_GET_MAX_ATTEMPTS
+    assert items == {}
+    assert unprocessed_ids == ['97cc0239-34fc-49d1-b87a-eb226ecc0e81']
+
+
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_apigw_response_no_body():
+    ret = app.apigw_response(200, body=None)
+    assert ret['statusCode'] == 200
+    assert ret['headers']['Access-Control-Allow-Origin'] == 'TEST_HEADER_VALUE'
+    assert 'body' not in ret
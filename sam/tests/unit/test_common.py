@@ -0,0 +1,334 @@
+import json
+import os
+import sys
+from unittest import mock
+
+import boto3
+import pytest
+import simplejson
+from boto3.dynamodb.types import TypeDeserializer
+from loguru import logger
+from moto import mock_dynamodb
+
+from dl_suggestion_common import (aws, ddb_json, emf, idempotency, log,
+                                  responses, shards, stats, validation)
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+def test_clients_are_pooled():
+    s3 = aws.client('s3')
+    assert aws.client('s3') is s3
+    assert aws.client('s3', region_name='us-east-1') is not s3
+    assert aws.resource('dynamodb') is aws.resource('dynamodb')
+    assert aws.table() is aws.table('TEST_REPORT_TABLE')
+    assert aws.table().name == 'TEST_REPORT_TABLE'
+    config = s3.meta.config
+    assert config.tcp_keepalive is True
+    assert config.retries['mode'] == 'adaptive'
+    assert config.max_pool_connections == 50
+
+
+def test_reset():
+    s3 = aws.client('s3')
+    aws.reset()
+    assert aws.client('s3') is not s3
+
+
+def test_client_uses_boto3_client():
+    with mock.patch('boto3.client') as mock_client:
+        aws.client('rekognition')
+    mock_client.assert_called_once_with('rekognition', config=aws.BOTO_CONFIG)
+
+
+def test_match_submission_id():
+    assert validation.match_submission_id(
+        '97cc0239-34fc-49d1-b87a-eb226ecc0e81') == '97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    assert validation.match_submission_id('97cc0239') is None
+    assert validation.match_submission_id(None) is None
+
+
+def test_match_upload_key():
+    assert validation.match_upload_key(
+        'maint-img/97cc0239-34fc-49d1-b87a-eb226ecc0e81') == '97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    assert validation.match_upload_key(
+        'other/97cc0239-34fc-49d1-b87a-eb226ecc0e81') is None
+
+
+@mock.patch.dict(os.environ, {'SUBMISSION_SHARDS': '4'})
+def test_status_key():
+    submission_id = '97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    key = shards.status_key('pending', submission_id)
+    assert key.startswith('pending#')
+    assert 0 <= int(key.split('#')[1]) < 4
+    # A submission stays on its shard through every status change
+    assert shards.status_key('resolved', submission_id) == \
+           'resolved#' + key.split('#')[1]
+    assert len({shards.status_key('pending', f"{n}") for n in range(100)}) == 4
+
+
+@mock.patch.dict(os.environ, {'SUBMISSION_SHARDS': '3'})
+def test_status_keys():
+    assert shards.status_keys('submitted') == [
+        'submitted', 'submitted#0', 'submitted#1', 'submitted#2']
+    assert shards.status_keys('submitted', 1) == ['submitted', 'submitted#0']
+    assert shards.status_of('submitted#2') == 'submitted'
+    assert shards.status_of('submitted') == 'submitted'
+
+
+def test_geohash():
+    assert stats.geohash(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    assert stats.geohash(-25.382708, -49.265506, 8) == '6gkzwgjz'
+    # Cells nest
+    assert stats.geohash(57.64911, 10.40744, 5) == 'u4pru'
+    assert stats.stats_dimensions(stats.stats_key(
+        'resolved', '2022-07-20', 'report-1', 'u4pru')['sk']) == (
+               '2022-07-20', 'report-1', 'u4pru')
+
+
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_apigw_response():
+    ret = responses.apigw_response(200, body={'key': 'value'})
+    assert ret['statusCode'] == 200
+    assert ret['headers']['Access-Control-Allow-Origin'] == 'TEST_HEADER_VALUE'
+    assert ret['body'] == '{"key": "value"}'
+    assert 'body' not in responses.apigw_response(204)
+
+
+def test_submission_body():
+    item = {
+        'pk': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+        'gsi1pk': 'pending',
+        'gsi1sk': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    }
+    assert responses.submission_body(item) == {
+        'pk': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+        'status': 'pending'
+    }
+
+
+def test_dumps_item_matches_deserialized():
+    item = {
+        'pk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+        'timestamp_submitted': {'S': '2023-11-13T19:13:22.123Z'},
+        'ml_labels': {
+            'M': {
+                'Fire Hydrant': {'N': '72.792'},
+                'Hydrant': {'N': '87.938'},
+                'Caf\u00e9 "Sign"': {'N': '-1E+3'}
+            }
+        },
+        'coordinates': {'L': [{'N': '45.1'}, {'N': '-122.0000001'}]},
+        'flags': {'SS': ['a', 'b']},
+        'counts': {'NS': ['1', '2.5']},
+        'blob': {'B': b'\x00\x01'},
+        'blobs': {'BS': [b'\x02']},
+        'archived': {'BOOL': False},
+        'public': {'BOOL': True},
+        'resolved_by': {'NULL': True},
+        'empty': {'M': {}}
+    }
+    deserializer = TypeDeserializer()
+    deserialized = {k: deserializer.deserialize(v) for k, v in item.items()}
+    # Binary comes back base64 encoded, sets as lists
+    deserialized['blob'] = 'AAE='
+    deserialized['blobs'] = ['Ag==']
+    deserialized['flags'] = sorted(deserialized['flags'])
+    deserialized['counts'] = [1, 2.5]
+    assert simplejson.loads(ddb_json.dumps_item(item)) == simplejson.loads(
+        simplejson.dumps(deserialized))
+    # Numbers DynamoDB already normalized are passed through untouched
+    assert ddb_json.dumps_value({'N': '87.938'}) == '87.938'
+    assert ddb_json.dumps_value({'N': '-1E+3'}) == '-1E+3'
+    assert ddb_json.dumps_value({'N': '.5'}) == '0.5'
+
+
+def test_dumps_items_matches_simplejson():
+    items = [
+        {'pk': {'S': 'a'}, 'score': {'N': '160.73'}},
+        {'pk': {'S': 'b'}, 'labels': {'L': [{'S': 'Road'}, {'S': 'Tar'}]}}
+    ]
+    deserializer = TypeDeserializer()
+    expected = simplejson.dumps(
+        [{k: deserializer.deserialize(v) for k, v in item.items()} for item in
+         items])
+    assert ddb_json.dumps_items(items) == expected
+    assert ddb_json.dumps_items([]) == '[]'
+
+
+def test_dumps_value_unsupported_type():
+    with pytest.raises(TypeError):
+        ddb_json.dumps_value({'X': 'unknown'})
+
+
+def test_metrics_serialize():
+    metrics = emf.Metrics('TestService')
+    metrics.put_dimension('Status', 'pending')
+    metrics.put_metric('ItemCount', 3, 'Count')
+    metrics.put_metric('ImageBytes', 10, 'Bytes')
+    metrics.put_metric('ImageBytes', 20, 'Bytes')
+    metrics.add_count('Retries')
+    metrics.add_count('Retries', 2)
+    metrics.set_property('RequestId', 'abc')
+    with metrics.timer('Query'):
+        pass
+    lines = [json.loads(x) for x in metrics.serialize()]
+    assert len(lines) == 1
+    directive = lines[0]['_aws']['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == emf.DEFAULT_NAMESPACE
+    assert directive['Dimensions'] == [['Service', 'Status']]
+    assert {'Name': 'Query', 'Unit': 'Milliseconds'} in directive['Metrics']
+    assert lines[0]['Service'] == 'TestService'
+    assert lines[0]['Status'] == 'pending'
+    assert lines[0]['ItemCount'] == 3
+    assert lines[0]['ImageBytes'] == [10, 20]
+    assert lines[0]['Retries'] == 3
+    assert lines[0]['RequestId'] == 'abc'
+    assert lines[0]['Query'] >= 0
+
+
+def test_metrics_serialize_splits_lines():
+    metrics = emf.Metrics('TestService')
+    for i in range(emf.MAX_METRICS_PER_LINE + 1):
+        metrics.put_metric(f"Metric{i}", i)
+    lines = [json.loads(x) for x in metrics.serialize()]
+    assert len(lines) == 2
+    assert len(lines[1]['_aws']['CloudWatchMetrics'][0]['Metrics']) == 1
+
+
+def test_with_metrics_file_sink(tmp_path):
+    @emf.with_metrics('TestService')
+    def handler(event, context):
+        emf.metrics().put_metric('ItemCount', 2, 'Count')
+        return {'statusCode': 200, 'body': '[1, 2]'}
+
+    with mock.patch.dict(os.environ,
+                         {'METRICS_FILE': str(tmp_path / 'metrics.jsonl')}):
+        assert handler({}, None)['statusCode'] == 200
+        handler({}, None)
+    with open(tmp_path / 'metrics.jsonl') as f:
+        lines = [json.loads(line) for line in f]
+    # One line per invocation, not accumulated across invocations
+    assert len(lines) == 2
+    assert lines[0]['ItemCount'] == 2
+    assert lines[0]['ResponseBytes'] == 6
+    assert lines[0]['StatusCode'] == 200
+    assert lines[0]['Duration'] >= 0
+
+
+@pytest.fixture()
+def log_messages():
+    # Capture at INFO, as deployed with LOGURU_LEVEL=INFO
+    messages = []
+    logger.remove()
+    logger.add(messages.append, level='INFO', format='{level} {message}')
+    yield messages
+    logger.remove()
+    logger.add(sys.stderr)
+
+
+def test_log_event_is_lazy(log_messages):
+    with mock.patch.object(log, 'dumps_event') as mock_dumps:
+        log.log_event({'body': 'x'})
+    mock_dumps.assert_not_called()
+    assert log_messages == []
+
+
+@mock.patch.dict(os.environ, {'LOG_EVENT_SAMPLE_RATE': '1'})
+def test_log_event_sampled(log_messages):
+    log.log_event({'body': 'x' * 2000})
+    assert len(log_messages) == 1
+    assert log_messages[0].startswith('INFO Event (Sampled): ')
+    # Sampled events are logged in full
+    assert 'x' * 2000 in log_messages[0]
+
+
+def test_log_event_debug():
+    messages = []
+    handler_id = logger.add(messages.append, level='DEBUG',
+                            format='{message}')
+    try:
+        with mock.patch.dict(os.environ, {'LOG_FIELD_MAX_LENGTH': '10'}):
+            log.log_event({'body': 'x' * 20, 'size': 20})
+    finally:
+        logger.remove(handler_id)
+    assert messages == [
+        'Event: {"body": "xxxxxxxxxx...(20 chars)", "size": 20}\n']
+
+
+def test_truncate():
+    event = {'Records': [{'body': 'abcdef'}], 'count': 1, 'short': 'abc'}
+    assert log.truncate(event, 3) == {
+        'Records': [{'body': 'abc...(6 chars)'}],
+        'count': 1,
+        'short': 'abc'
+    }
+    assert log.dumps_event(event, 0) == json.dumps(event)
+
+
+def create_idempotency_table():
+    boto3.client('dynamodb', region_name='us-west-2').create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return aws.table('TEST_REPORT_TABLE')
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'IDEMPOTENCY_TABLE': 'TEST_REPORT_TABLE'})
+def test_idempotent():
+    table = create_idempotency_table()
+    key = idempotency.idempotency_key('s3://bucket/key', 'v1')
+    with idempotency.idempotent('s3://bucket/key', 'v1') as claimed:
+        assert claimed
+        # A concurrent duplicate can't take the lease
+        with idempotency.idempotent('s3://bucket/key', 'v1') as duplicate:
+            assert not duplicate
+        assert table.get_item(Key=key)['Item'][
+                   'idempotency_status'] == idempotency.IN_PROGRESS
+    item = table.get_item(Key=key)['Item']
+    assert item['idempotency_status'] == idempotency.COMPLETED
+    assert 'lease_token' not in item
+    # Nor a later one, but another version is processed
+    with idempotency.idempotent('s3://bucket/key', 'v1') as duplicate:
+        assert not duplicate
+    with idempotency.idempotent('s3://bucket/key', 'v2') as claimed:
+        assert claimed
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'IDEMPOTENCY_TABLE': 'TEST_REPORT_TABLE'})
+def test_idempotent_failure_and_expired_lease():
+    table = create_idempotency_table()
+    key = idempotency.idempotency_key('s3://bucket/key', 'v1')
+    # Released when processing fails, so the retry can claim it
+    with pytest.raises(ValueError):
+        with idempotency.idempotent('s3://bucket/key', 'v1') as claimed:
+            assert claimed
+            raise ValueError()
+    assert 'Item' not in table.get_item(Key=key)
+    # Left behind by an invocation which timed out
+    token = idempotency.claim('s3://bucket/key', 'v1')
+    assert idempotency.claim('s3://bucket/key', 'v1') is None
+    table.update_item(Key=key, UpdateExpression='SET lease_expires_at = :past',
+                      ExpressionAttributeValues={':past': 0})
+    with idempotency.idempotent('s3://bucket/key', 'v1') as claimed:
+        assert claimed
+    # The first can no longer complete or release it
+    idempotency.complete('s3://bucket/key', 'v1', token)
+    idempotency.release('s3://bucket/key', 'v1', token)
+    assert table.get_item(Key=key)['Item'][
+               'idempotency_status'] == idempotency.COMPLETED
+
+
+def test_idempotent_not_configured():
+    with idempotency.idempotent('s3://bucket/key', 'v1') as claimed:
+        assert claimed
@@ -0,0 +1,75 @@
+import base64
+import json
+import os
+from unittest import mock
+
+import boto3
+import pytest
+import requests
+from moto import mock_s3
+
+from dl_suggestion_common import match_upload_key
+from sam.create_upload import app
+
+UPLOADED_IMAGES_BUCKET = 'test-uploaded-images'
+
+
+@pytest.fixture()
+def apigw_event():
+    ''' Generates API GW Event'''
+
+    return {
+        "resource": "/uploads",
+        "path": "/uploads",
+        "httpMethod": "POST",
+        "body": json.dumps({'content_type': 'image/png'})
+    }
+
+
+@pytest.fixture()
+def uploaded_images():
+    with mock_s3():
+        boto3.setup_default_session()
+        s3 = boto3.client('s3', region_name='us-west-2')
+        s3.create_bucket(
+            Bucket=UPLOADED_IMAGES_BUCKET,
+            CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+        yield s3
+
+
+@mock.patch.dict(os.environ, {'UPLOADED_IMAGES_BUCKET': UPLOADED_IMAGES_BUCKET,
+                              'UPLOAD_MAX_BYTES': '1024'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler(uploaded_images, apigw_event):
+    ret = app.lambda_handler(apigw_event, None)
+    assert ret['statusCode'] == 201
+    data = json.loads(ret['body'])
+    assert data['max_bytes'] == 1024
+    assert data['fields']['Content-Type'] == 'image/png'
+    # Only where ProcessUpload expects it, under the id it was given
+    assert match_upload_key(data['fields']['key']) == data['submission_id']
+    policy = json.loads(base64.b64decode(data['fields']['policy']))
+    assert {'Content-Type': 'image/png'} in policy['conditions']
+    assert ['content-length-range', 1, 1024] in policy['conditions']
+
+    response = requests.post(data['url'], data=data['fields'],
+                             files={'file': b'\x89PNG'})
+    assert response.status_code == 204
+    uploaded = uploaded_images.get_object(Bucket=UPLOADED_IMAGES_BUCKET,
+                                          Key=data['fields']['key'])
+    assert uploaded['ContentType'] == 'image/png'
+
+    # Every upload gets its own id, JPEG by default
+    ret = app.lambda_handler(dict(apigw_event, body=None), None)
+    assert ret['statusCode'] == 201
+    other = json.loads(ret['body'])
+    assert other['submission_id'] != data['submission_id']
+    assert other['fields']['Content-Type'] == 'image/jpeg'
+
+
+@mock.patch.dict(os.environ, {'UPLOADED_IMAGES_BUCKET': UPLOADED_IMAGES_BUCKET})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler_invalid(uploaded_images, apigw_event):
+    for body in ('{bad', '[]', json.dumps({'content_type': 'image/gif'})):
+        ret = app.lambda_handler(dict(apigw_event, body=body), None)
+        assert ret['statusCode'] == 400
@@ -0,0 +1,150 @@
+import io
+import os
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock
+
+import boto3
+import pyarrow.parquet as pq
+from moto import mock_dynamodb, mock_s3
+
+from dl_suggestion_common import sort_key, status_key
+from sam.export_submissions import app
+
+EXPORT_BUCKET = 'test-submission-archive'
+
+
+def create_resources():
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    boto3.client('s3', region_name='us-west-2').create_bucket(
+        Bucket=EXPORT_BUCKET,
+        CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+    return boto3.resource('dynamodb', region_name='us-west-2').Table(
+        'TEST_REPORT_TABLE')
+
+
+def submission(n, status, minutes_ago):
+    submission_id = f"97cc0239-34fc-49d1-b87a-{n:012d}"
+    timestamp = (datetime.utcnow() - timedelta(
+        minutes=minutes_ago)).isoformat()[:-3] + 'Z'
+    return {
+        'pk': f"submission_{submission_id}",
+        'sk': f"submission_{submission_id}",
+        'gsi1pk': status_key(status, submission_id),
+        'gsi1sk': sort_key(timestamp, submission_id),
+        'ml_labels': {'Hydrant': Decimal('87.938')},
+        'relevant_reports': {'report-1': Decimal('160.73')},
+        'coords_image': {'latitude': Decimal('33.7188111'),
+                         'longitude': Decimal('-112.1748879')},
+        'timestamp_uploaded': timestamp
+    }
+
+
+def exported_rows(prefix=''):
+    s3 = boto3.client('s3', region_name='us-west-2')
+    response = s3.list_objects_v2(Bucket=EXPORT_BUCKET,
+                                  Prefix=app.EXPORT_PREFIX + prefix)
+    return [row for x in response.get('Contents', []) for row in
+            pq.read_table(io.BytesIO(s3.get_object(
+                Bucket=EXPORT_BUCKET, Key=x['Key'])['Body'].read())).to_pylist()]
+
+
+@mock_dynamodb
+@mock_s3
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE',
+                              'SUBMISSION_ARCHIVE_BUCKET': EXPORT_BUCKET,
+                              'SUBMISSION_SHARDS': '2',
+                              # moto returns every item to every segment
+                              'EXPORT_SEGMENTS': '1',
+                              'EXPORT_BATCH_ROWS': '2',
+                              'EXPORT_FILE_ROWS': '3'})
+def test_lambda_handler():
+    table = create_resources()
+    items = [submission(n, 'pending', 30 + n) for n in range(7)]
+    # Not a submission, and one still being written
+    table.put_item(Item={'pk': 'reports', 'sk': 'report-1'})
+    items.append(submission(7, 'pending', 0))
+    item = submission(8, 'submitted', 45)
+    item['selected_reports'] = ['report-1']
+    item['timestamp_submitted'] = item['gsi1sk'].split('#')[0]
+    items.append(item)
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+
+    ret = app.lambda_handler({}, None)
+    assert ret['mode'] == 'full'
+    assert ret['rows'] == 8
+    rows = {x['submission_id']: x for x in exported_rows()}
+    assert len(rows) == 8
+    assert items[7]['pk'][len('submission_'):] not in rows
+    row = rows[items[8]['pk'][len('submission_'):]]
+    assert row['status'] == 'submitted'
+    assert row['ml_labels'] == [('Hydrant', 87.938)]
+    assert row['selected_reports'] == ['report-1']
+    assert row['coords_image_latitude'] == 33.7188111
+    assert row['coords_browser_latitude'] is None
+    assert row['timestamp_status'] == row['timestamp_submitted']
+    assert row['timestamp_submitted'].tzinfo is not None
+    assert row['timestamp_resolved'] is None
+    assert table.get_item(Key=app.EXPORT_HIGH_WATER_KEY)['Item'][
+               'exported_to'] == ret['to']
+
+    # Only what changed since then the next time
+    with mock.patch.dict(os.environ, {'EXPORT_LAG_SECONDS': '0'}):
+        resolved = submission(3, 'resolved', 0)
+        table.update_item(
+            Key={'pk': resolved['pk'], 'sk': resolved['sk']},
+            UpdateExpression='SET gsi1pk = :gsi1pk, gsi1sk = :gsi1sk',
+            ExpressionAttributeValues={':gsi1pk': resolved['gsi1pk'],
+                                       ':gsi1sk': resolved['gsi1sk']})
+        ret = app.lambda_handler({}, None)
+    assert ret['mode'] == 'incremental'
+    assert ret['rows'] == 2
+    latest = exported_rows(f"export_date={ret['to'][:10]}/")
+    assert sorted((x['submission_id'], x['status']) for x in latest if
+                  x['timestamp_status'] >= datetime.fromisoformat(
+                      ret['from'])) == [
+               (items[3]['pk'][len('submission_'):], 'resolved'),
+               (items[7]['pk'][len('submission_'):], 'pending')]
+
+
+def test_to_row_legacy_sort_key():
+    row = app.to_row({
+        'pk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+        'gsi1pk': {'S': 'pending'},
+        'gsi1sk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+        'timestamp_uploaded': {'S': '2022-07-20T17:47:41.012Z'}
+    })
+    assert row['status'] == 'pending'
+    assert row['timestamp_status'] is None
+    assert row['ml_labels'] is None
+    assert row['timestamp_uploaded'] == datetime(2022, 7, 20, 17, 47, 41,
+                                                 12000, tzinfo=timezone.utc)
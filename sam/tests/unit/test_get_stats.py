@@ -0,0 +1,106 @@
+import json
+import os
+from unittest import mock
+
+import boto3
+import pytest
+from moto import mock_dynamodb
+
+from sam.get_stats import app
+
+
+@pytest.fixture()
+def apigw_event():
+    ''' Generates API GW Event'''
+
+    return {
+        "resource": "/stats",
+        "path": "/stats",
+        "httpMethod": "GET",
+        "queryStringParameters": {
+            "status": "resolved"
+        }
+    }
+
+
+@pytest.fixture()
+def stats_table():
+    with mock_dynamodb():
+        boto3.setup_default_session()
+        client = boto3.client('dynamodb', region_name='us-west-2')
+        client.create_table(
+            TableName='TEST_REPORT_TABLE',
+            KeySchema=[
+                {'AttributeName': 'pk', 'KeyType': 'HASH'},
+                {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'pk', 'AttributeType': 'S'},
+                {'AttributeName': 'sk', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        table = boto3.resource('dynamodb', region_name='us-west-2').Table(
+            'TEST_REPORT_TABLE')
+        counters = [
+            ('stats#resolved', '2022-07-18#report-1#9tbq8', 2),
+            ('stats#resolved', '2022-07-19#report-1#9tbqb', 3),
+            ('stats#resolved', '2022-07-25#report-2#9tbq8', 4),
+            ('stats#resolved', '2022-07-26#report-1#c23nb', 1),
+            # Every submission counted here moved on
+            ('stats#resolved', '2022-07-26#report-2#c23nb', 0),
+            ('stats#resolved', 'none#report-1#none', 5),
+            ('stats#submitted', '2022-07-26#report-1#9tbq8', 7)
+        ]
+        with table.batch_writer() as batch:
+            for pk, sk, count in counters:
+                batch.put_item(Item={'pk': pk, 'sk': sk,
+                                     'submission_count': count})
+        yield table
+
+
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler(stats_table, apigw_event):
+    def stats(**parameters):
+        ret = app.lambda_handler(dict(apigw_event, queryStringParameters=dict(
+            parameters, status='resolved')), None)
+        assert ret['statusCode'] == 200
+        return json.loads(ret['body'])
+
+    assert stats() == {'status': 'resolved', 'total': 15, 'groups': []}
+    # Resolutions per week
+    assert stats(group_by='week', **{'from': '2022-07-18'})['groups'] == [
+        {'week': '2022-W29', 'count': 5},
+        {'week': '2022-W30', 'count': 5}]
+    assert stats(group_by='report,cell', precision='4', to='2022-07-26')[
+               'groups'] == [
+               {'report': 'report-1', 'cell': '9tbq', 'count': 5},
+               {'report': 'report-2', 'cell': '9tbq', 'count': 4}]
+    assert stats(report='report-1', cell='9tbq', group_by='day')[
+               'groups'] == [
+               {'day': '2022-07-18', 'count': 2},
+               {'day': '2022-07-19', 'count': 3}]
+    assert stats(**{'from': '2022-07-26T00:00:00.000Z',
+                    'to': '2022-07-27'})['total'] == 1
+
+
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler_invalid(stats_table, apigw_event):
+    for parameters in ({'status': 'open'}, {'status': 'resolved',
+                                            'group_by': 'district'},
+                       {'status': 'resolved', 'cell': 'ai'},
+                       {'status': 'resolved', 'precision': '0'},
+                       {'status': 'resolved', 'from': 'last week'},
+                       # DynamoDB rejects a BETWEEN the wrong way round
+                       {'status': 'resolved', 'from': '2022-07-27',
+                        'to': '2022-07-26'},
+                       # Counted by day, so bounds are whole days apart
+                       {'status': 'resolved', 'from': '2022-07-26',
+                        'to': '2022-07-26T12:00:00.000Z'},
+                       {'status': 'resolved', 'from': '2022-07-26T12:00'},
+                       {'status': 'resolved', 'to': '2022-07-26T00:00:01Z'}):
+        ret = app.lambda_handler(
+            dict(apigw_event, queryStringParameters=parameters), None)
+        assert ret['statusCode'] == 400
@@ -6,6 +6,7 @@ import boto3
 import pytest
 from moto import mock_dynamodb
 
+from dl_suggestion_common import core
 from sam.get_submissions import app
 
 
@@ -175,3 +176,155 @@ def test_apigw_response_with_body():
     assert ret['headers'][
                'Access-Control-Allow-Methods'] == 'DELETE,GET,HEAD,OPTIONS,PATCH,POST,PUT'
     assert ret['body'] == '{"key": "value"}'
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+@mock.patch.dict(os.environ, {'SUBMISSION_SHARDS': '4'})
+def test_lambda_handler_merges_shards(apigw_event):
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    # One submission from before sharding, the rest spread over the shards
+    gsi1pks = ['submitted'] + [f"submitted#{n % 4}" for n in range(11)]
+    for n, gsi1pk in enumerate(gsi1pks):
+        client.put_item(
+            TableName='TEST_REPORT_TABLE',
+            Item={
+                'pk': {'S': f"submission_{n}"},
+                'sk': {'S': f"submission_{n}"},
+                'gsi1pk': {'S': gsi1pk},
+                'gsi1sk': {'S': f"submission_{n:02d}"}
+            }
+        )
+    client.put_item(
+        TableName='TEST_REPORT_TABLE',
+        Item={
+            'pk': {'S': 'submission_pending'},
+            'sk': {'S': 'submission_pending'},
+            'gsi1pk': {'S': 'pending#0'},
+            'gsi1sk': {'S': 'submission_pending'}
+        }
+    )
+    ret = app.lambda_handler(apigw_event, None)
+    assert ret['statusCode'] == 200
+    ret_body = json.loads(ret['body'])
+    assert [x['sk'] for x in ret_body] == \
+           [f"submission_{n}" for n in range(12)]
+    assert {x['gsi1pk'] for x in ret_body} == {'submitted'}
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+@mock.patch.dict(os.environ, {'SUBMISSION_SHARDS': '4'})
+def test_lambda_handler_time_range(apigw_event):
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    # Submitted an hour apart on 2022-07-20, plus one still sorted by id
+    for n in range(10):
+        client.put_item(
+            TableName='TEST_REPORT_TABLE',
+            Item={
+                'pk': {'S': f"submission_{n}"},
+                'sk': {'S': f"submission_{n}"},
+                'gsi1pk': {'S': f"submitted#{n % 4}"},
+                'gsi1sk': {'S': f"2022-07-20T{n + 10}:00:00.000Z#{n}"}
+            }
+        )
+    client.put_item(
+        TableName='TEST_REPORT_TABLE',
+        Item={
+            'pk': {'S': 'submission_legacy'},
+            'sk': {'S': 'submission_legacy'},
+            'gsi1pk': {'S': 'submitted'},
+            'gsi1sk': {'S': 'submission_legacy'}
+        }
+    )
+
+    def listed(**parameters):
+        ret = app.lambda_handler(dict(apigw_event, queryStringParameters=dict(
+            parameters, status='submitted')), None)
+        assert ret['statusCode'] == 200
+        return [x['sk'] for x in json.loads(ret.get('body', '[]'))]
+
+    assert listed() == [f"submission_{n}" for n in range(10)] + [
+        'submission_legacy']
+    assert listed(order='desc') == ['submission_legacy'] + [
+        f"submission_{n}" for n in reversed(range(10))]
+    assert listed(**{'from': '2022-07-20T15:00:00.000Z'}) == [
+        f"submission_{n}" for n in range(5, 10)]
+    assert listed(to='2022-07-20T12') == ['submission_0', 'submission_1']
+    assert listed(**{'from': '2022-07-20T12:00', 'to': '2022-07-20T14:00Z',
+                     'order': 'desc'}) == ['submission_3', 'submission_2']
+    assert listed(**{'from': '2022-07-21'}) == []
+
+    # Shards with more than a page cut the listing short, to where it's
+    # still complete
+    dynamodb = core.client('dynamodb')
+    with mock.patch.object(core, 'client', lambda _: mock.Mock(
+            query=lambda **kwargs: dynamodb.query(Limit=2, **kwargs))):
+        assert listed() == [f"submission_{n}" for n in range(5)]
+        assert listed(order='desc') == ['submission_legacy'] + [
+            f"submission_{n}" for n in range(9, 4, -1)]
+
+    # Including ranges which end before they start, which DynamoDB rejects
+    for parameters in ({'from': 'yesterday'}, {'to': '2022-07-20 12:00'},
+                       {'order': 'newest'},
+                       {'from': '2022-07-21', 'to': '2022-07-20'},
+                       {'from': '2022-07-20T12', 'to': '2022-07-20T12'}):
+        ret = app.lambda_handler(dict(apigw_event, queryStringParameters=dict(
+            parameters, status='submitted')), None)
+        assert ret['statusCode'] == 400
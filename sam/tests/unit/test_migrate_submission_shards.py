@@ -0,0 +1,109 @@
+import os
+from unittest import mock
+
+import boto3
+from moto import mock_dynamodb
+
+from dl_suggestion_common import sort_key, status_key
+from sam.migrate_submission_shards import app
+
+
+def create_table():
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return boto3.resource('dynamodb', region_name='us-west-2').Table(
+        'TEST_REPORT_TABLE')
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'SUBMISSION_SHARDS': '2'})
+def test_lambda_handler():
+    table = create_table()
+    submission_ids = [f"97cc0239-34fc-49d1-b87a-{n:012d}" for n in range(20)]
+    # Unsharded, sharded with a larger count, and already on the right shard
+    gsi1pks = ['submitted'] * 10 + \
+              [f"pending#{n % 5}" for n in range(5)] + \
+              [status_key('resolved', x) for x in submission_ids[15:]]
+    with table.batch_writer() as batch:
+        for n, (submission_id, gsi1pk) in enumerate(
+                zip(submission_ids, gsi1pks)):
+            item = {
+                'pk': f"submission_{submission_id}",
+                'sk': f"submission_{submission_id}",
+                'gsi1pk': gsi1pk,
+                'gsi1sk': f"submission_{submission_id}"
+            }
+            # Some were sorted by id when they entered their status, the
+            # rest have no timestamp to sort by instead
+            if n < 5:
+                item['timestamp_submitted'] = f"2022-07-20T17:47:0{n}.012Z"
+            if n == 15:
+                item['timestamp_resolved'] = '2022-07-21T09:12:00.000Z'
+            batch.put_item(Item=item)
+    # Only the sort key of the 16th is out of date
+    moved = sum(status_key(x.split('#')[0], y) != x for x, y in
+                zip(gsi1pks, submission_ids)) + 1
+
+    ret = app.lambda_handler({'from_shards': 5}, None)
+    assert ret == {'partitions': 18, 'migrated': moved, 'skipped': 0}
+    for submission_id, gsi1pk in zip(submission_ids, gsi1pks):
+        item = table.get_item(Key={
+            'pk': f"submission_{submission_id}",
+            'sk': f"submission_{submission_id}"
+        })['Item']
+        assert item['gsi1pk'] == status_key(gsi1pk.split('#')[0],
+                                            submission_id)
+        timestamp = item.get('timestamp_submitted',
+                             item.get('timestamp_resolved'))
+        if timestamp:
+            assert item['gsi1sk'] == sort_key(timestamp, submission_id)
+        else:
+            assert item['gsi1sk'] == f"submission_{submission_id}"
+    # Nothing left to move
+    assert app.lambda_handler({}, None)['migrated'] == 0
+
+
+def test_migrated_keys_latest_timestamp():
+    submission_id = '97cc0239-34fc-49d1-b87a-000000000000'
+    item = {
+        'pk': f"submission_{submission_id}",
+        'sk': f"submission_{submission_id}",
+        'gsi1pk': 'submitted',
+        'gsi1sk': f"submission_{submission_id}",
+        'timestamp_submitted': '2022-07-20T17:47:00.012Z'
+    }
+    # Reopened after it was submitted
+    item['timestamp_reopened'] = '2022-07-21T09:12:00.000Z'
+    assert app.migrated_keys(item)[1] == sort_key(item['timestamp_reopened'],
+                                                  submission_id)
+    # Then submitted again
+    item['timestamp_submitted'] = '2022-07-22T11:30:00.000Z'
+    assert app.migrated_keys(item)[1] == sort_key(item['timestamp_submitted'],
+                                                  submission_id)
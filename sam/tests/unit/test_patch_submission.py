@@ -6,6 +6,7 @@ import boto3
 import pytest
 from moto import mock_dynamodb
 
+from dl_suggestion_common import sort_key, status_key
 from sam.patch_submission import app
 
 
@@ -316,6 +317,257 @@ def test_lambda_handler_resolve_with_reports(apigw_event_resolve):
     assert 'body' not in ret
 
 
+@pytest.fixture()
+def apigw_event_bulk_resolve():
+    ''' Generates API GW Event'''
+
+    return {
+        "resource": "/submissions/bulk",
+        "path": "/submissions/bulk",
+        "httpMethod": "POST",
+        "pathParameters": None,
+        "body": "{\"action\":\"resolve\",\"submission_ids\":[\"97cc0239-34fc-49d1-b87a-eb226ecc0e81\",\"1c9e3a77-3f0b-4b8e-a4a1-9d4c2b7e8f02\",\"70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11\"]}"
+    }
+
+
+@pytest.fixture()
+def apigw_event_bulk_resolve_atomic():
+    ''' Generates API GW Event'''
+
+    return {
+        "resource": "/submissions/bulk",
+        "path": "/submissions/bulk",
+        "httpMethod": "POST",
+        "pathParameters": None,
+        "body": "{\"action\":\"resolve\",\"atomic\":true,\"submission_ids\":[\"97cc0239-34fc-49d1-b87a-eb226ecc0e81\",\"1c9e3a77-3f0b-4b8e-a4a1-9d4c2b7e8f02\",\"70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11\"]}"
+    }
+
+
+@pytest.fixture()
+def apigw_event_bulk_bad_action():
+    ''' Generates API GW Event'''
+
+    return {
+        "resource": "/submissions/bulk",
+        "path": "/submissions/bulk",
+        "httpMethod": "POST",
+        "pathParameters": None,
+        "body": "{\"action\":\"submit\",\"submission_ids\":[\"97cc0239-34fc-49d1-b87a-eb226ecc0e81\"]}"
+    }
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler_bulk_resolve(apigw_event_bulk_resolve):
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    for submission_id in ['97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+                          '70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11']:
+        client.put_item(
+            TableName='TEST_REPORT_TABLE',
+            Item={
+                'pk': {'S': f"submission_{submission_id}"},
+                'sk': {'S': f"submission_{submission_id}"},
+                'gsi1pk': {'S': 'submitted'},
+                'gsi1sk': {'S': f"submission_{submission_id}"}
+            }
+        )
+    ret = app.lambda_handler(apigw_event_bulk_resolve, None)
+    assert ret['statusCode'] == 200
+    results = json.loads(ret['body'])['results']
+    assert results == [
+        {'submission_id': '97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+         'statusCode': 204},
+        {'submission_id': '1c9e3a77-3f0b-4b8e-a4a1-9d4c2b7e8f02',
+         'statusCode': 404},
+        {'submission_id': '70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11',
+         'statusCode': 204}
+    ]
+    response = client.get_item(
+        TableName=os.environ['REPORT_TABLE'],
+        Key={
+            'pk': {'S': 'submission_70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11'},
+            'sk': {'S': 'submission_70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11'}
+        },
+    )
+    assert response['Item']['gsi1pk']['S'] == status_key(
+        'resolved', '70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11')
+    assert response['Item']['gsi1sk']['S'] == sort_key(
+        response['Item']['timestamp_resolved']['S'],
+        '70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11')
+    # The missing submission must not have been created
+    response = client.get_item(
+        TableName=os.environ['REPORT_TABLE'],
+        Key={
+            'pk': {'S': 'submission_1c9e3a77-3f0b-4b8e-a4a1-9d4c2b7e8f02'},
+            'sk': {'S': 'submission_1c9e3a77-3f0b-4b8e-a4a1-9d4c2b7e8f02'}
+        },
+    )
+    assert 'Item' not in response
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler_bulk_resolve_atomic(apigw_event_bulk_resolve_atomic):
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    for submission_id in ['97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+                          '70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11']:
+        client.put_item(
+            TableName='TEST_REPORT_TABLE',
+            Item={
+                'pk': {'S': f"submission_{submission_id}"},
+                'sk': {'S': f"submission_{submission_id}"},
+                'gsi1pk': {'S': 'submitted'},
+                'gsi1sk': {'S': f"submission_{submission_id}"}
+            }
+        )
+    ret = app.lambda_handler(apigw_event_bulk_resolve_atomic, None)
+    assert ret['statusCode'] == 200
+    results = json.loads(ret['body'])['results']
+    assert [x['statusCode'] for x in results] == [409, 404, 409]
+    # The whole transaction was rolled back
+    response = client.get_item(
+        TableName=os.environ['REPORT_TABLE'],
+        Key={
+            'pk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+            'sk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'}
+        },
+    )
+    assert response['Item']['gsi1pk']['S'] == 'submitted'
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler_bulk_reopen_atomic(apigw_event_bulk_resolve_atomic):
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    for submission_id in ['97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+                          '70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11']:
+        client.put_item(
+            TableName='TEST_REPORT_TABLE',
+            Item={
+                'pk': {'S': f"submission_{submission_id}"},
+                'sk': {'S': f"submission_{submission_id}"},
+                'gsi1pk': {'S': 'submitted'},
+                'gsi1sk': {'S': f"submission_{submission_id}"}
+            }
+        )
+    apigw_event_bulk_resolve_atomic['body'] = json.dumps({
+        'action': 'reopen',
+        'atomic': True,
+        'submission_ids': ['97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+                           '70b2a1e7-6a4c-4d8e-9d1e-2c4d1b0f5a11']
+    })
+    ret = app.lambda_handler(apigw_event_bulk_resolve_atomic, None)
+    assert ret['statusCode'] == 200
+    results = json.loads(ret['body'])['results']
+    assert [x['statusCode'] for x in results] == [204, 204]
+    response = client.get_item(
+        TableName=os.environ['REPORT_TABLE'],
+        Key={
+            'pk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+            'sk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'}
+        },
+    )
+    assert response['Item']['gsi1pk']['S'] == status_key(
+        'submitted', '97cc0239-34fc-49d1-b87a-eb226ecc0e81')
+    assert response['Item']['gsi1sk']['S'] == sort_key(
+        response['Item']['timestamp_reopened']['S'],
+        '97cc0239-34fc-49d1-b87a-eb226ecc0e81')
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_lambda_handler_bulk_bad_action(apigw_event_bulk_bad_action):
+    ret = app.lambda_handler(apigw_event_bulk_bad_action, None)
+    assert ret['statusCode'] == 400
+    assert ret[
+               'body'] == 'Invalid bulk format. Action must be one of resolve, reopen.'
+
+
 @mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
 def test_apigw_response_no_body():
     ret = app.apigw_response(200, body=None)
@@ -1,3 +1,5 @@
+import gzip
+import json
 import os
 import shutil
 from decimal import *
@@ -7,8 +9,11 @@ import boto3
 import botocore.session
 import pytest
 from botocore.stub import Stubber
-from moto import mock_dynamodb, mock_s3
+from moto import mock_dynamodb, mock_s3, mock_apigatewaymanagementapi
+from moto.apigatewaymanagementapi.models import \
+    apigatewaymanagementapi_backends
 
+from dl_suggestion_common import status_key
 from sam.process_upload import app
 
 
@@ -218,7 +223,8 @@ def test_lambda_handler(s3_event):
         '33.719')
     assert response['Item']['coords_image']['M']['longitude']['N'].startswith(
         '-112.175')
-    assert response['Item']['gsi1pk']['S'] == 'pending'
+    assert response['Item']['gsi1pk']['S'] == status_key(
+        'pending', '97cc0239-34fc-49d1-b87a-eb226ecc0e81')
     assert response['Item']['relevant_reports']['M']['report-1'][
         'N'].startswith('191.45')
     assert 'Fire Hydrant' in response['Item']['ml_labels']['M']
@@ -370,7 +376,8 @@ def test_lambda_handler_bad_id(s3_event_bad_id):
 @mock_s3
 @mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
 @mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
-def test_lambda_handler_photo_no_gps(s3_event):
+def test_lambda_handler_photo_no_gps(s3_event, tmp_path):
+    os.environ['METRICS_FILE'] = str(tmp_path / 'metrics.jsonl')
     s3 = boto3.client('s3')
     bucket = s3.create_bucket(
         Bucket='test-bucket-uploaded-images',
@@ -421,8 +428,23 @@ def test_lambda_handler_photo_no_gps(s3_event):
     )
     assert response['Item']['coords_image']['M']['latitude']['N'] == '0'
     assert response['Item']['coords_image']['M']['longitude']['N'] == '0'
-    assert response['Item']['gsi1pk']['S'] == 'pending'
+    assert response['Item']['gsi1pk']['S'] == status_key(
+        'pending', '97cc0239-34fc-49d1-b87a-eb226ecc0e81')
     assert 'Fire Hydrant' in response['Item']['ml_labels']['M']
+    # Every stage of the processing is timed in one EMF line
+    with open(os.environ['METRICS_FILE']) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 1
+    assert lines[0]['Service'] == 'ProcessUpload'
+    metric_names = [x['Name'] for x in
+                    lines[0]['_aws']['CloudWatchMetrics'][0]['Metrics']]
+    for name in ['Rekognition', 'ReportsQuery', 'S3Download', 'ExifParse',
+                 'DynamoDBWrite', 'Duration']:
+        assert name in metric_names
+        assert lines[0][name] >= 0
+    assert lines[0]['ImageBytes'] == s3_event['Records'][0]['s3']['object'][
+        'size']
+    assert lines[0]['LabelCount'] > 0
 
 
 @mock_dynamodb
@@ -554,6 +576,44 @@ def test_lambda_handler_empty_file(s3_event):
         assert 'Contents' not in response
 
 
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE',
+                              'IDEMPOTENCY_TABLE': 'TEST_REPORT_TABLE'})
+def test_lambda_handler_duplicate(s3_event):
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    s3_event['Records'][0]['s3']['object']['versionId'] = 'version-1'
+    # Delivered twice, then redriven from the DLQ
+    s3_event['Records'].append(s3_event['Records'][0])
+    with mock.patch.object(app, 'process_image') as process_image:
+        app.lambda_handler(s3_event, None)
+        app.lambda_handler(s3_event, None)
+        assert process_image.call_count == 1
+        # A new version of the object is processed again
+        s3_event['Records'][0]['s3']['object']['versionId'] = 'version-2'
+        app.lambda_handler(s3_event, None)
+        assert process_image.call_count == 2
+    response = client.get_item(
+        TableName='TEST_REPORT_TABLE',
+        Key={
+            'pk': {'S': 'idempotency#s3://test-bucket-uploaded-images/maint-img/97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+            'sk': {'S': 'version-1'}
+        },
+    )
+    assert response['Item']['idempotency_status']['S'] == 'completed'
+
+
 @mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
 def test_apigw_response_no_body():
     ret = app.apigw_response(200, body=None)
@@ -576,3 +636,360 @@ def test_apigw_response_with_body():
     assert ret['headers'][
                'Access-Control-Allow-Methods'] == 'DELETE,GET,HEAD,OPTIONS,PATCH,POST,PUT'
     assert ret['body'] == '{"key": "value"}'
+
+
+@mock_dynamodb
+@mock_apigatewaymanagementapi
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {
+    'WEBSOCKET_ENDPOINT': 'https://execute-api.us-west-2.amazonaws.com'})
+def test_notify_subscribers():
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    client.put_item(
+        TableName='TEST_REPORT_TABLE',
+        Item={
+            'pk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+            'sk': {'S': 'connection_L0SM9cOFvHcCIhw'},
+            'connection_id': {'S': 'L0SM9cOFvHcCIhw'},
+            'expires_at': {'N': '1700000000'}
+        }
+    )
+    app.notify_subscribers('97cc0239-34fc-49d1-b87a-eb226ecc0e81', {
+        'type': 'submission',
+        'submission': {'relevant_reports': {'report-1': Decimal('191.450')}}
+    })
+    backend = apigatewaymanagementapi_backends['123456789012']['us-west-2']
+    assert backend.connections['L0SM9cOFvHcCIhw'].data == \
+           b'{"type": "submission", "submission": {"relevant_reports": {"report-1": 191.450}}}'
+    # The subscription is removed once notified
+    response = client.get_item(
+        TableName=os.environ['REPORT_TABLE'],
+        Key={
+            'pk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+            'sk': {'S': 'connection_L0SM9cOFvHcCIhw'}
+        },
+    )
+    assert 'Item' not in response
+
+
+def boto3_client_side_effect_apigw_gone(*args, **kwargs):
+    apigw = botocore.session.get_session().create_client(
+        'apigatewaymanagementapi', region_name='us-west-2',
+        endpoint_url=kwargs['endpoint_url'])
+    stubber = Stubber(apigw)
+    stubber.add_client_error(
+        method='post_to_connection',
+        service_error_code='GoneException',
+        http_status_code=410
+    )
+    stubber.activate()
+    return apigw
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {
+    'WEBSOCKET_ENDPOINT': 'https://execute-api.us-west-2.amazonaws.com'})
+def test_notify_subscribers_connection_gone():
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    client.put_item(
+        TableName='TEST_REPORT_TABLE',
+        Item={
+            'pk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+            'sk': {'S': 'connection_L0SM9cOFvHcCIhw'},
+            'connection_id': {'S': 'L0SM9cOFvHcCIhw'},
+            'expires_at': {'N': '1700000000'}
+        }
+    )
+    with mock.patch('boto3.client', mock.MagicMock(
+            side_effect=boto3_client_side_effect_apigw_gone)):
+        app.notify_subscribers('97cc0239-34fc-49d1-b87a-eb226ecc0e81', {
+            'type': 'discarded',
+            'reason': 'not an image'
+        })
+    response = client.get_item(
+        TableName=os.environ['REPORT_TABLE'],
+        Key={
+            'pk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+            'sk': {'S': 'connection_L0SM9cOFvHcCIhw'}
+        },
+    )
+    assert 'Item' not in response
+
+
+CATALOG = [
+    {'pk': 'reports', 'sk': 'report-1', 'name': 'Damaged Fire Hydrant',
+     'labels': ['Fire Hydrant', 'Hydrant', 'Street']},
+    {'pk': 'reports', 'sk': 'report-2', 'name': 'Damaged Traffic Light',
+     'labels': ['Traffic Light', 'Street']},
+    {'pk': 'reports', 'sk': 'report-3', 'name': 'Abandoned Vehicle',
+     'labels': ['Vehicle', 'Street'],
+     'label_weights': {'Vehicle': Decimal('2')}},
+    {'pk': 'reports', 'sk': 'report-4', 'name': 'Pot Hole',
+     'labels': ['Pothole', 'Street']}
+]
+
+
+def test_report_ranker_down_weights_common_labels():
+    ranker = app.ReportRanker(CATALOG)
+    ranked = ranker.rank({'Fire Hydrant': Decimal('90.000'),
+                          'Street': Decimal('90.000')})
+    # Every report has "Street", so it only adds its confidence, while
+    # "Fire Hydrant" adds 1 + ln(4) times its confidence
+    assert ranked == {
+        'report-1': Decimal('304.766'),
+        'report-2': Decimal('90.000'),
+        'report-3': Decimal('90.000'),
+        'report-4': Decimal('90.000')
+    }
+    assert ranker.rank({'Tree': Decimal('99.000')}) == {}
+
+
+def test_report_ranker_parents_and_weights():
+    ranker = app.ReportRanker(CATALOG)
+    # Car isn't in the catalog, but its parent Vehicle is, at half the
+    # confidence and twice the weight
+    ranked = ranker.rank({'Car': Decimal('80.000')},
+                         {'Car': ['Vehicle', 'Transportation']})
+    assert ranked == {'report-3': Decimal('190.904')}
+    # A parent detected with more confidence than its child keeps its own
+    ranked = ranker.rank({'Car': Decimal('80.000'),
+                          'Vehicle': Decimal('60.000')},
+                         {'Car': ['Vehicle']})
+    assert ranked == {'report-3': Decimal('286.355')}
+    with mock.patch.dict(os.environ, {'RANKING_PARENT_DECAY': '0'}):
+        assert ranker.rank({'Car': Decimal('80.000')},
+                           {'Car': ['Vehicle']}) == {}
+
+
+def test_report_ranker_top_k():
+    ranker = app.ReportRanker(CATALOG)
+    labels = {'Fire Hydrant': Decimal('90.000'), 'Vehicle': Decimal('60.000'),
+              'Street': Decimal('50.000')}
+    assert list(ranker.rank(labels)) == [
+        'report-1', 'report-2', 'report-3', 'report-4']
+    assert sorted(ranker.rank(labels, top_k=2)) == ['report-1', 'report-3']
+    with mock.patch.dict(os.environ, {'RANKING_TOP_K': '1'}):
+        assert list(ranker.rank(labels)) == ['report-3']
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+def test_report_ranker_cached_by_catalog_version():
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
+    table = dynamodb.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    for report in CATALOG:
+        table.put_item(Item=report)
+    # Without a catalog version it's compiled every time
+    ranker = app.report_ranker()
+    assert ranker.report_ids == ['report-1', 'report-2', 'report-3',
+                                 'report-4']
+    assert app.report_ranker() is not ranker
+    table.put_item(Item=dict(app.CATALOG_VERSION_KEY, catalog_version=1))
+    ranker = app.report_ranker()
+    assert app.report_ranker() is ranker
+    # A new report comes with a new catalog version
+    table.put_item(Item={'pk': 'reports', 'sk': 'report-5',
+                         'labels': ['Graffiti']})
+    assert app.report_ranker() is ranker
+    table.put_item(Item=dict(app.CATALOG_VERSION_KEY, catalog_version=2))
+    assert 'report-5' in app.report_ranker().report_ids
+
+
+def test_report_ranker_learned_weights():
+    ranker = app.ReportRanker(CATALOG, learned_weights={
+        'report-3': {'Car': Decimal('2.000'), 'Vehicle': Decimal('1.000')}})
+    # Learned labels are added, learned weights for curated labels add to
+    # the curated weight
+    assert ranker.rank({'Car': Decimal('80.000')}) == {
+        'report-3': Decimal('381.807')}
+    assert ranker.rank({'Vehicle': Decimal('50.000')}) == {
+        'report-3': Decimal('357.944')}
+
+
+DETECT_LABELS_RESPONSE = {
+    'Labels': [
+        {'Name': 'Fire Hydrant', 'Confidence': 95.725,
+         'Instances': [{'BoundingBox': {'Width': 0.3, 'Height': 0.6,
+                                        'Left': 0.4, 'Top': 0.2},
+                        'Confidence': 95.725}],
+         'Parents': [{'Name': 'Hydrant'}]},
+        {'Name': 'Hydrant', 'Confidence': 95.725, 'Parents': []},
+        {'Name': 'Car', 'Confidence': 12.5, 'Parents': [{'Name': 'Vehicle'}]}
+    ],
+    'LabelModelVersion': '3.0',
+    'ResponseMetadata': {'HTTPStatusCode': 200}
+}
+
+
+def test_image_labels():
+    labels, parents = app.image_labels(DETECT_LABELS_RESPONSE)
+    # Low confidence labels are only archived
+    assert labels == {'Fire Hydrant': Decimal('95.725'),
+                      'Hydrant': Decimal('95.725')}
+    assert parents == {'Fire Hydrant': ['Hydrant'], 'Hydrant': []}
+
+
+@mock.patch.dict(os.environ, {'INFERENCE_ARCHIVE_STREAM': 'TEST_STREAM'})
+def test_archive_inference(s3_event):
+    with mock.patch.object(app, 'client') as client:
+        app.archive_inference('97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+                              s3_event['Records'][0], DETECT_LABELS_RESPONSE)
+    client.assert_called_once_with('firehose')
+    kwargs = client.return_value.put_record.call_args.kwargs
+    assert kwargs['DeliveryStreamName'] == 'TEST_STREAM'
+    data = kwargs['Record']['Data'].decode('utf-8')
+    assert data.endswith('\n') and data.count('\n') == 1
+    archived = json.loads(data)
+    assert archived['submission_id'] == '97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    assert archived['key'] == 'maint-img/97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    assert 'ResponseMetadata' not in archived['response']
+    assert archived['response']['Labels'][0]['Instances'][0]['BoundingBox'][
+               'Width'] == 0.3
+    assert archived['response']['Labels'][2]['Name'] == 'Car'
+
+
+def test_archive_inference_not_configured(s3_event):
+    with mock.patch.object(app, 'client') as client:
+        app.archive_inference('97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+                              s3_event['Records'][0], DETECT_LABELS_RESPONSE)
+    client.assert_not_called()
+
+
+def archive_file(submission_ids, labels):
+    lines = [json.dumps({'submission_id': x,
+                         'response': {'Labels': labels}}) for x in
+             submission_ids]
+    return gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+
+
+@mock_dynamodb
+@mock_s3
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE',
+                              'INFERENCE_ARCHIVE_BUCKET': 'test-bucket-archive'})
+def test_replay_handler():
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
+    table = dynamodb.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    for report in CATALOG:
+        table.put_item(Item=report)
+    submission_ids = [f"97cc0239-34fc-49d1-b87a-{n:012d}" for n in range(30)]
+    for submission_id in submission_ids:
+        table.put_item(Item={'pk': f"submission_{submission_id}",
+                             'sk': f"submission_{submission_id}",
+                             'relevant_reports': {}})
+    # One of them since archived, leaving a stub behind
+    archived_key = f"submission_{submission_ids[-1]}"
+    table.put_item(Item={'pk': archived_key, 'sk': archived_key,
+                         'archive_key': 'submissions/resolved_date=2024-01-02/x.parquet'})
+    s3 = boto3.client('s3', region_name='us-west-2')
+    s3.create_bucket(
+        Bucket='test-bucket-archive',
+        CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
+    )
+    vehicle = [{'Name': 'Car', 'Confidence': 90.0,
+                'Parents': [{'Name': 'Vehicle'}]}]
+    # Three files over two days, one of them for a submission since deleted,
+    # and one from the day after
+    s3.put_object(Bucket='test-bucket-archive',
+                  Key='inference/2024/01/01/stream-1.jsonl.gz',
+                  Body=archive_file(submission_ids[:10], vehicle))
+    s3.put_object(Bucket='test-bucket-archive',
+                  Key='inference/2024/01/02/stream-1.jsonl.gz',
+                  Body=archive_file(submission_ids[10:], vehicle))
+    s3.put_object(Bucket='test-bucket-archive',
+                  Key='inference/2024/01/02/stream-2.jsonl.gz',
+                  Body=archive_file(['deleted'], vehicle))
+    s3.put_object(Bucket='test-bucket-archive',
+                  Key='inference/2024/01/03/stream-1.jsonl.gz',
+                  Body=archive_file(['later'], vehicle))
+    event = {'from': '2024-01-01', 'to': '2024-01-02'}
+    assert app.replay_handler(dict(event, dry_run=True), None) == {
+        'files': 3, 'submissions': 31, 'updated': 0, 'skipped': 0}
+    item = table.get_item(Key={'pk': f"submission_{submission_ids[0]}",
+                               'sk': f"submission_{submission_ids[0]}"})
+    assert item['Item']['relevant_reports'] == {}
+    assert app.replay_handler(event, None) == {
+        'files': 3, 'submissions': 31, 'updated': 29, 'skipped': 2}
+    for submission_id in submission_ids[:-1]:
+        item = table.get_item(Key={'pk': f"submission_{submission_id}",
+                                   'sk': f"submission_{submission_id}"})
+        assert item['Item']['relevant_reports'] == {
+            'report-3': Decimal('214.766')}
+    assert 'relevant_reports' not in table.get_item(
+        Key={'pk': archived_key, 'sk': archived_key})['Item']
+    assert 'Item' not in table.get_item(
+        Key={'pk': 'submission_deleted', 'sk': 'submission_deleted'})
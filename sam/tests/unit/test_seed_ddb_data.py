@@ -1,4 +1,7 @@
+import io
+import json
 import os
+from decimal import Decimal
 from unittest import mock
 
 import boto3
@@ -117,6 +120,7 @@ def test_seed_data_with_existing_data(cloudformation_event):
         }
     )
     ret = app.seed_data(cloudformation_event, None)
+    # Reports missing from the table are added, the rest left alone
     response = client.get_item(
         TableName=os.environ['REPORT_TABLE'],
         Key={
@@ -124,4 +128,125 @@ def test_seed_data_with_existing_data(cloudformation_event):
             'sk': {'S': 'report-0'}
         },
     )
-    assert 'Item' not in response
+    assert response['Item']['name']['S'] == 'Other'
+    response = client.get_item(
+        TableName=os.environ['REPORT_TABLE'],
+        Key={
+            'pk': {'S': 'catalog'},
+            'sk': {'S': 'version'}
+        },
+    )
+    assert response['Item']['catalog_version']['N'] == '1'
+    assert response['Item']['report_count']['N'] == '10'
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+@mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
+def test_seed_data_writes_only_changes(cloudformation_event):
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    app.seed_data(cloudformation_event, None)
+    client.update_item(
+        TableName='TEST_REPORT_TABLE',
+        Key={'pk': {'S': 'reports'}, 'sk': {'S': 'report-1'}},
+        UpdateExpression='SET #name = :name',
+        ExpressionAttributeNames={'#name': 'name'},
+        ExpressionAttributeValues={':name': {'S': 'Renamed'}}
+    )
+    with mock.patch.object(app, 'write_chunk',
+                           wraps=app.write_chunk) as write_chunk:
+        app.seed_data(cloudformation_event, None)
+        # Only the changed report is written back
+        assert write_chunk.call_count == 1
+        assert [x['sk'] for x in write_chunk.call_args.args[2]] == [
+            'report-1']
+        app.seed_data(dict(cloudformation_event, RequestType='Update'), None)
+        assert write_chunk.call_count == 1
+    response = client.get_item(
+        TableName='TEST_REPORT_TABLE',
+        Key={'pk': {'S': 'reports'}, 'sk': {'S': 'report-1'}}
+    )
+    assert response['Item']['name']['S'] == 'Damaged Fire Hydrant'
+    response = client.get_item(
+        TableName='TEST_REPORT_TABLE',
+        Key={'pk': {'S': 'catalog'}, 'sk': {'S': 'version'}}
+    )
+    assert response['Item']['catalog_version']['N'] == '2'
+
+
+def test_fingerprint_normalizes_numbers():
+    # As ijson reads them from the file, and as DynamoDB returns them
+    from_file = {'pk': 'reports', 'sk': 'report-1',
+                 'label_weights': {'Hydrant': Decimal('1.0'),
+                                   'Fire Hydrant': Decimal('0.50')},
+                 'priority': 2, 'threshold': [Decimal('10.00')]}
+    from_table = {'pk': 'reports', 'sk': 'report-1',
+                  'label_weights': {'Hydrant': Decimal('1'),
+                                    'Fire Hydrant': Decimal('0.5')},
+                  'priority': Decimal('2'), 'threshold': [Decimal('10')]}
+    assert app.fingerprint(from_file) == app.fingerprint(from_table)
+    assert app.fingerprint(from_file) != app.fingerprint(
+        dict(from_table, priority=Decimal('2.5')))
+
+
+@mock_dynamodb
+def test_write_items_in_parallel_batches():
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table = boto3.resource('dynamodb').Table('TEST_REPORT_TABLE')
+    catalog = json.dumps([
+        {'pk': 'reports', 'sk': f"report-{n}", 'gsi1pk': f"report-{n}",
+         'gsi1sk': f"Report {n}", 'name': f"Report {n}",
+         'labels': [f"Label {n}-{i}" for i in range(20)]} for n in
+        range(1000)])
+    items = app.ijson.items(io.BytesIO(catalog.encode('utf-8')), 'item')
+    written, unchanged = app.write_items(
+        table, app.changed_items(items, {('reports', 'report-0'): app.fingerprint(
+            json.loads(catalog)[0])}))
+    assert (written, unchanged) == (999, 1)
+    assert len(app.existing_fingerprints(table)) == 999
+
+
+@mock.patch('time.sleep')
+def test_write_chunk_retries_unprocessed_items(mock_sleep):
+    item = {'pk': 'reports', 'sk': 'report-1', 'labels': ['Hydrant']}
+    request = {'PutRequest': {'Item': item}}
+    client = mock.MagicMock()
+    client.batch_write_item.side_effect = [
+        {'UnprocessedItems': {'TEST_REPORT_TABLE': [request]}},
+        {'UnprocessedItems': {}}
+    ]
+    app.write_chunk(client, 'TEST_REPORT_TABLE', [item])
+    assert client.batch_write_item.call_count == 2
+    assert client.batch_write_item.call_args.kwargs['RequestItems'] == {
+        'TEST_REPORT_TABLE': [request]}
+    client.batch_write_item.side_effect = None
+    client.batch_write_item.return_value = {
+        'UnprocessedItems': {'TEST_REPORT_TABLE': [request]}}
+    with pytest.raises(RuntimeError):
+        app.write_chunk(client, 'TEST_REPORT_TABLE', [item])
@@ -1,7 +1,12 @@
+import gzip
+import json
 import os
+import re
+from concurrent.futures import Future
 from unittest import mock
 
 import boto3
+import brotli
 import pytest
 from moto import mock_s3, mock_apigateway
 
@@ -22,6 +27,7 @@ def cloudformation_event():
             "ServiceToken": "REDACTED",
             "StaticWebsiteBucket": "test-bucket-static-website",
             "ApiBaseURL": "TEST_API_BASE_URL",
+            "WebSocketURL": "TEST_WEBSOCKET_URL",
             "UniqueSuffix": "TEST_UNIQUE_SUFFIX",
             "UploadedImagesBucket": "test-bucket-uploaded-images",
             "IdentityPoolId": "TEST_IDENTITY_POOL",
@@ -51,19 +57,28 @@ def test_seed_data(cloudformation_event):
         Bucket='test-bucket-uploaded-images',
         CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
     )
-    os.chdir('seed_s3_data')
     ret = app.seed_data(cloudformation_event, None)
 
-    with open('/tmp/website/website/js/config.js', 'r') as file:
-        config_data = file.read()
-        assert 'TEST_API_BASE_URL' in config_data
-        assert 'TEST_UNIQUE_SUFFIX' in config_data
-        assert 'TEST_IDENTITY_POOL' in config_data
-        assert 'abcdefghijklmnopqrstuvwxyz' in config_data
+    config_key = asset_key(s3, 'index.html', 'js/config')
+    response = s3.get_object(
+        Bucket='test-bucket-static-website',
+        Key=config_key
+    )
+    assert response['ContentType'] == 'text/javascript'
+    assert response['CacheControl'] == app.ASSET_CACHE_CONTROL
+    config_data = response['Body'].read().decode('utf-8')
+    assert 'TEST_API_BASE_URL' in config_data
+    assert 'TEST_UNIQUE_SUFFIX' in config_data
+    assert 'TEST_IDENTITY_POOL' in config_data
+    assert 'TEST_WEBSOCKET_URL' in config_data
+    assert 'abcdefghijklmnopqrstuvwxyz' in config_data
     response = s3.list_objects_v2(
         Bucket='test-bucket-static-website'
     )
-    assert response['KeyCount'] > 0
+    # 6 assets and 2 pages, with a brotli and a gzip variant of all but the
+    # image
+    assert response['KeyCount'] == 22
+    assert 'index.html' in [x['Key'] for x in response['Contents']]
 
 
 @mock_s3
@@ -93,12 +108,185 @@ def test_seed_data_with_existing_data(cloudformation_event):
         Body=b'test-data'
     )
     ret = app.seed_data(cloudformation_event, None)
+    # Other objects in the bucket are left alone
     response = s3.list_objects_v2(
         Bucket='test-bucket-static-website'
     )
+    assert response['KeyCount'] == 23
+
+
+@mock_s3
+@mock_apigateway
+def test_seed_data_skips_unchanged_files(cloudformation_event):
+    boto3.setup_default_session()
+    apigw = boto3.client('apigateway', region_name='us-west-2')
+    response = apigw.create_api_key(
+        value='abcdefghijklmnopqrstuvwxyz',
+        name='TEST_API_KEY_NAME'  # Not Used
+    )
+    cloudformation_event['ResourceProperties']['APIKeyId'] = response['id']
+    s3 = boto3.client('s3')
+    s3.create_bucket(
+        Bucket='test-bucket-static-website',
+        CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
+    )
+    app.seed_data(cloudformation_event, None)
+    upload_file = app.upload_file
+    uploaded = {}
+
+    def spy(s3, bucket, object_key, data, **headers):
+        uploaded[object_key] = upload_file(s3, bucket, object_key, data,
+                                           **headers)
+        return uploaded[object_key]
+
+    with mock.patch.object(app, 'upload_file', side_effect=spy):
+        app.seed_data(dict(cloudformation_event, RequestType='Update'), None)
+        assert len(uploaded) == 22
+        assert not any(uploaded.values())
+        # Only the config, under its new name, and the pages naming it change
+        # when the API moves
+        cloudformation_event['ResourceProperties'][
+            'ApiBaseURL'] = 'NEW_API_BASE_URL'
+        uploaded.clear()
+        app.seed_data(dict(cloudformation_event, RequestType='Update'), None)
+    config_key = asset_key(s3, 'index.html', 'js/config')
+    assert sorted(k for k, v in uploaded.items() if v) == sorted(
+        [config_key, config_key + '.br', config_key + '.gz',
+         'index.html', 'index.html.br', 'index.html.gz',
+         'reports.html', 'reports.html.br', 'reports.html.gz'])
+    response = s3.get_object(
+        Bucket='test-bucket-static-website',
+        Key=config_key
+    )
+    assert 'NEW_API_BASE_URL' in response['Body'].read().decode('utf-8')
+
+
+@mock_s3
+@mock_apigateway
+def test_seed_data_precompressed_fingerprinted_assets(cloudformation_event):
+    boto3.setup_default_session()
+    apigw = boto3.client('apigateway', region_name='us-west-2')
+    response = apigw.create_api_key(
+        value='abcdefghijklmnopqrstuvwxyz',
+        name='TEST_API_KEY_NAME'  # Not Used
+    )
+    cloudformation_event['ResourceProperties']['APIKeyId'] = response['id']
+    s3 = boto3.client('s3')
+    s3.create_bucket(
+        Bucket='test-bucket-static-website',
+        CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
+    )
+    app.seed_data(cloudformation_event, None)
+    page = s3.get_object(Bucket='test-bucket-static-website', Key='index.html')
+    assert page['CacheControl'] == app.PAGE_CACHE_CONTROL
+    # Every local reference in the pages is to a fingerprinted asset
+    map_key = asset_key(s3, 'reports.html', 'js/map')
+    assert re.fullmatch(r'js/map\.[0-9a-f]{10}\.js', map_key)
+    assert asset_key(s3, 'reports.html', 'js/moment.min')
+    assert asset_key(s3, 'index.html', 'css/main', '.css')
+    assert '/js/config.js' not in get_text(s3, 'reports.html')
+    # Including the marker image the map script loads
+    map_data = get_text(s3, map_key)
+    marker_key = re.search(r'js/custom_marker\.[0-9a-f]{10}\.png',
+                           map_data).group(0)
+    marker = s3.get_object(Bucket='test-bucket-static-website', Key=marker_key)
+    assert marker['ContentType'] == 'image/png'
+    # Minified, without the licence comment
+    assert 'SPDX-License-Identifier' not in map_data
+    for suffix, encoding, decompress in (('.br', 'br', brotli.decompress),
+                                         ('.gz', 'gzip', gzip.decompress)):
+        variant = s3.get_object(Bucket='test-bucket-static-website',
+                                Key=map_key + suffix)
+        assert variant['ContentEncoding'] == encoding
+        assert variant['ContentType'] == 'text/javascript'
+        assert variant['CacheControl'] == app.ASSET_CACHE_CONTROL
+        assert decompress(variant['Body'].read()).decode('utf-8') == map_data
+    # Images aren't compressed again
+    response = s3.list_objects_v2(Bucket='test-bucket-static-website',
+                                  Prefix='js/custom_marker')
     assert response['KeyCount'] == 1
 
 
+def test_build_site_dependency_order():
+    # Stylesheets and scripts referring to ones which sort after them, and
+    # the image the last of them refers to
+    files = {
+        'css/a.css': b'@import "/css/z.css";',
+        'css/z.css': b'body{background:url(/img/bg.png)}',
+        'img/bg.png': b'\x89PNG',
+        'js/a.js': b'import("/js/b.js");',
+        'js/b.js': b'fetch("/css/a.css");',
+        'index.html': b'<link href="/css/a.css"><script src="/js/a.js">'
+    }
+    assets, pages = app.build_site(files)
+    assets = {key: data for key, data, _ in assets}
+    names = {key: next(x for x in assets if re.fullmatch(
+        re.escape(os.path.splitext(key)[0]) + r'\.[0-9a-f]{10}' +
+        re.escape(os.path.splitext(key)[1]), x)) for key in files if
+             key != 'index.html'}
+    assert names['img/bg.png'].encode() in assets[names['css/z.css']]
+    assert names['css/z.css'].encode() in assets[names['css/a.css']]
+    assert names['css/a.css'].encode() in assets[names['js/b.js']]
+    assert names['js/b.js'].encode() in assets[names['js/a.js']]
+    page = pages[0][1]
+    assert names['css/a.css'].encode() in page
+    assert names['js/a.js'].encode() in page
+
+
+@mock_s3
+@mock_apigateway
+def test_seed_data_removes_superseded_assets(cloudformation_event):
+    boto3.setup_default_session()
+    apigw = boto3.client('apigateway', region_name='us-west-2')
+    response = apigw.create_api_key(
+        value='abcdefghijklmnopqrstuvwxyz',
+        name='TEST_API_KEY_NAME'  # Not Used
+    )
+    cloudformation_event['ResourceProperties']['APIKeyId'] = response['id']
+    s3 = boto3.client('s3')
+    s3.create_bucket(
+        Bucket='test-bucket-static-website',
+        CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
+    )
+    app.seed_data(cloudformation_event, None)
+    old_config_key = asset_key(s3, 'index.html', 'js/config')
+    # A new config supersedes the old one, which is kept for the grace period
+    cloudformation_event['ResourceProperties'][
+        'ApiBaseURL'] = 'NEW_API_BASE_URL'
+    with mock.patch.object(app.time, 'time', return_value=1000000):
+        app.seed_data(dict(cloudformation_event, RequestType='Update'), None)
+    assert asset_key(s3, 'index.html', 'js/config') != old_config_key
+    superseded = [old_config_key + x for x in ('', '.br', '.gz')]
+    assert json.loads(get_text(s3, app.SUPERSEDED_KEY)) == {
+        x: 1000000 for x in superseded}
+    with mock.patch.object(app.time, 'time', return_value=1000000 + 3600):
+        app.seed_data(dict(cloudformation_event, RequestType='Update'), None)
+    keys = [x['Key'] for x in s3.list_objects_v2(
+        Bucket='test-bucket-static-website')['Contents']]
+    assert all(x in keys for x in superseded)
+    # Then deleted, along with the record of them
+    with mock.patch.object(app.time, 'time',
+                           return_value=1000000 + 7 * 24 * 3600):
+        app.seed_data(dict(cloudformation_event, RequestType='Update'), None)
+    keys = [x['Key'] for x in s3.list_objects_v2(
+        Bucket='test-bucket-static-website')['Contents']]
+    assert not any(x in keys for x in superseded)
+    assert app.SUPERSEDED_KEY not in keys
+    assert len(keys) == 22
+
+
+def get_text(s3, key):
+    response = s3.get_object(Bucket='test-bucket-static-website', Key=key)
+    return response['Body'].read().decode('utf-8')
+
+
+def asset_key(s3, page, name, extension='.js'):
+    # The fingerprinted key a page refers to the asset by
+    match = re.search('/(' + re.escape(name) + r'\.[0-9a-f]+' +
+                      re.escape(extension) + ')"', get_text(s3, page))
+    return match.group(1)
+
+
 @mock_s3
 @mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
 @mock.patch.dict(os.environ, {'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'})
@@ -123,3 +311,101 @@ def test_delete_data_with_existing_data(cloudformation_event):
         Bucket='test-bucket-static-website'
     )
     assert response['KeyCount'] == 0
+
+
+class InlineExecutor:
+    # moto's S3 backend isn't safe to list while other threads delete from it
+    def __init__(self, max_workers):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def versioned_bucket_with_objects(s3, bucket, count):
+    s3.create_bucket(
+        Bucket=bucket,
+        CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
+    )
+    s3.put_bucket_versioning(
+        Bucket=bucket,
+        VersioningConfiguration={'Status': 'Enabled'}
+    )
+    for i in range(count):
+        s3.put_object(Bucket=bucket, Key=f"maint-img/{i}", Body=b'v1')
+        s3.put_object(Bucket=bucket, Key=f"maint-img/{i}", Body=b'v2')
+    # Deleting in a versioned bucket leaves a delete marker behind
+    s3.delete_object(Bucket=bucket, Key='maint-img/0')
+
+
+@mock_s3
+def test_delete_data_purges_versions(cloudformation_event):
+    boto3.setup_default_session()
+    s3 = boto3.client('s3')
+    s3.create_bucket(
+        Bucket='test-bucket-static-website',
+        CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
+    )
+    versioned_bucket_with_objects(s3, 'test-bucket-uploaded-images', 120)
+    with mock.patch.object(app, 'ThreadPoolExecutor', InlineExecutor), \
+            mock.patch.object(app, 'PURGE_PAGE_SIZE', 100):
+        app.delete_data(cloudformation_event, None)
+    response = s3.list_object_versions(Bucket='test-bucket-uploaded-images')
+    assert 'Versions' not in response
+    assert 'DeleteMarkers' not in response
+    assert cloudformation_event['PurgeCheckpoint']['deleted'] == 241
+
+
+@mock_s3
+def test_handler_continues_purge_asynchronously(cloudformation_event):
+    boto3.setup_default_session()
+    s3 = boto3.client('s3')
+    s3.create_bucket(
+        Bucket='test-bucket-static-website',
+        CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
+    )
+    versioned_bucket_with_objects(s3, 'test-bucket-uploaded-images', 120)
+    event = dict(cloudformation_event, RequestType='Delete')
+    context = mock.MagicMock()
+    context.invoked_function_arn = 'arn:aws:lambda:us-west-2:123456789012:function:seed'
+    # Out of time after the first page of 100
+    context.get_remaining_time_in_millis.return_value = 0
+    with mock.patch.object(app, 'helper') as helper, \
+            mock.patch.object(app, 'continue_async') as continue_async, \
+            mock.patch.object(app, 'ThreadPoolExecutor', InlineExecutor), \
+            mock.patch.object(app, 'PURGE_PAGE_SIZE', 100):
+        app.handler(event, context)
+        assert continue_async.call_count == 1
+        assert helper.call_count == 0
+        assert event['PurgeCheckpoint']['deleted'] == 100
+        # The next invocation finishes the purge, then responds
+        context.get_remaining_time_in_millis.return_value = 30000
+        app.handler(event, context)
+        assert continue_async.call_count == 1
+        helper.assert_called_once_with(event, context)
+    assert event['PurgeCheckpoint']['deleted'] == 241
+    response = s3.list_object_versions(Bucket='test-bucket-uploaded-images')
+    assert 'Versions' not in response
+
+
+def test_continue_async(cloudformation_event):
+    event = dict(cloudformation_event, RequestType='Delete',
+                 PurgeCheckpoint={'deleted': 1000, 'invocations': 0})
+    context = mock.MagicMock()
+    context.invoked_function_arn = 'arn:aws:lambda:us-west-2:123456789012:function:seed'
+    with mock.patch.object(app.boto3, 'client') as client:
+        app.continue_async(event, context)
+    client.assert_called_once_with('lambda')
+    kwargs = client.return_value.invoke.call_args.kwargs
+    assert kwargs['FunctionName'] == context.invoked_function_arn
+    assert kwargs['InvocationType'] == 'Event'
+    assert json.loads(kwargs['Payload'])['PurgeCheckpoint'] == {
+        'deleted': 1000, 'invocations': 1}
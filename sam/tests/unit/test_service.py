@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+from unittest import mock
+
+import boto3
+import pytest
+from moto import mock_dynamodb
+
+from sam.get_reports import app as get_reports
+from sam.service import app
+
+
+def request(method, path, query_string=b'', body=b''):
+    # Calls the ASGI app the way an ASGI server would
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app.app({'type': 'http', 'method': method, 'path': path,
+                         'query_string': query_string}, receive, send))
+    assert sent[0]['type'] == 'http.response.start'
+    assert sent[1]['type'] == 'http.response.body'
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+@pytest.fixture()
+def report_table():
+    with mock_dynamodb():
+        boto3.setup_default_session()
+        client = boto3.client('dynamodb', region_name='us-west-2')
+        client.create_table(
+            TableName='TEST_REPORT_TABLE',
+            KeySchema=[
+                {'AttributeName': 'pk', 'KeyType': 'HASH'},
+                {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    'IndexName': 'GSI1',
+                    'KeySchema': [
+                        {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                        {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                    ],
+                    'Projection': {
+                        'ProjectionType': 'ALL'
+                    }
+                }
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'pk', 'AttributeType': 'S'},
+                {'AttributeName': 'sk', 'AttributeType': 'S'},
+                {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+                {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        client.put_item(
+            TableName='TEST_REPORT_TABLE',
+            Item={
+                'pk': {'S': 'reports'},
+                'sk': {'S': 'report-1'},
+                'gsi1pk': {'S': 'report-1'},
+                'gsi1sk': {'S': 'Damaged Fire Hydrant'},
+                'labels': {
+                    'L': [
+                        {'S': 'Fire Hydrant'},
+                        {'S': 'Hydrant'}
+                    ]
+                },
+                'name': {'S': 'Damaged Fire Hydrant'}
+            }
+        )
+        client.put_item(
+            TableName='TEST_REPORT_TABLE',
+            Item={
+                'pk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+                'sk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+                'gsi1pk': {'S': 'pending'},
+                'gsi1sk': {'S': '2022-07-20T17:47:39.012Z'},
+                'ml_labels': {'M': {'Hydrant': {'N': '87.93804168701172'}}},
+                'relevant_reports': {'L': [{'S': 'report-1'}]}
+            }
+        )
+        with mock.patch.dict(os.environ, {
+            'REPORT_TABLE': 'TEST_REPORT_TABLE',
+            'ALLOW_ORIGIN_HEADER_VALUE': 'TEST_HEADER_VALUE'
+        }):
+            yield client
+
+
+def test_get_reports(report_table):
+    status, headers, body = request('GET', '/reports')
+    assert status == 200
+    assert headers[b'access-control-allow-origin'] == b'TEST_HEADER_VALUE'
+    assert headers[b'content-length'] == str(len(body)).encode()
+    assert json.loads(body)['report-1']['name'] == 'Damaged Fire Hydrant'
+
+
+def test_get_reports_matches_lambda_handler(report_table):
+    ret = get_reports.lambda_handler({'resource': '/reports'}, None)
+    status, headers, body = request('GET', '/reports')
+    assert status == ret['statusCode']
+    assert body.decode() == ret['body']
+
+
+@mock.patch.dict(os.environ, {'REPORTS_CACHE_SECONDS': '60'})
+def test_get_reports_cached(report_table):
+    request('GET', '/reports')
+    report_table.delete_item(
+        TableName='TEST_REPORT_TABLE',
+        Key={'pk': {'S': 'reports'}, 'sk': {'S': 'report-1'}})
+    status, headers, body = request('GET', '/reports')
+    assert status == 200
+    assert 'report-1' in json.loads(body)
+
+
+def test_submission_flow(report_table):
+    path = '/submission/97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    status, headers, body = request('GET', path)
+    assert status == 200
+    assert json.loads(body)['status'] == 'pending'
+    status, headers, body = request('PATCH', path, body=json.dumps({
+        'action': 'submit',
+        'selected_reports': ['report-1'],
+        'coords': {'latitude': 33.7188152, 'longitude': -112.1748911}
+    }).encode())
+    assert status == 200
+    assert json.loads(body)['selected_reports'] == ['report-1']
+    status, headers, body = request('GET', '/submissions',
+                                    query_string=b'status=submitted')
+    assert status == 200
+    assert len(json.loads(body)) == 1
+    status, headers, body = request('PATCH', path,
+                                    body=b'{"action": "resolve"}')
+    assert status == 204
+    assert body == b''
+    status, headers, body = request('GET', '/submissions',
+                                    query_string=b'status=resolved')
+    assert json.loads(body)[0]['gsi1pk'] == 'resolved'
+
+
+def test_invalid_requests(report_table):
+    status, headers, body = request('GET', '/submission/70b2a1e7')
+    assert status == 400
+    status, headers, body = request('PATCH',
+                                    '/submission/97cc0239-34fc-49d1-b87a-eb226ecc0e81',
+                                    body=b'')
+    assert status == 400
+    status, headers, body = request('GET', '/submissions',
+                                    query_string=b'status=unknown')
+    assert status == 400
+
+
+def test_unknown_route(report_table):
+    assert request('GET', '/unknown')[0] == 404
+    assert request('DELETE', '/reports')[0] == 405
+    status, headers, body = request('OPTIONS', '/reports')
+    assert status == 204
+    assert headers[b'access-control-allow-methods'] == \
+           b'DELETE,GET,HEAD,OPTIONS,PATCH,POST,PUT'
+
+
+def test_unhandled_error(report_table):
+    with mock.patch.object(app.core, 'get_reports',
+                           side_effect=RuntimeError('boom')):
+        status, headers, body = request('GET', '/reports')
+    assert status == 500
+
+
+def test_metrics(report_table, tmp_path):
+    metrics_file = tmp_path / 'metrics.jsonl'
+    with mock.patch.dict(os.environ, {'METRICS_FILE': str(metrics_file)}):
+        request('GET', '/reports')
+    line = json.loads(metrics_file.read_text())
+    assert line['Service'] == 'GetReports'
+    assert line['StatusCode'] == 200
+    assert line['ItemCount'] == 1
+    assert 'Duration' in line
+
+
+def test_lifespan():
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    with mock.patch.dict(os.environ, {'SERVICE_MAX_WORKERS': '2'}):
+        os.environ.pop('REPORTS_CACHE_SECONDS', None)
+        asyncio.run(app.app({'type': 'lifespan'}, receive, send))
+        assert os.environ['REPORTS_CACHE_SECONDS'] == '60'
+    assert [x['type'] for x in sent] == ['lifespan.startup.complete',
+                                         'lifespan.shutdown.complete']
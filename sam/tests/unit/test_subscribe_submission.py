@@ -0,0 +1,121 @@
+import json
+import os
+from unittest import mock
+
+import boto3
+import pytest
+from moto import mock_dynamodb
+
+from sam.subscribe_submission import app
+
+
+@pytest.fixture()
+def websocket_event():
+    ''' Generates API GW WebSocket Event'''
+
+    return {
+        "requestContext": {
+            "routeKey": "subscribe",
+            "eventType": "MESSAGE",
+            "connectionId": "Wk4xkcVCvHcCFjA=",
+            "stage": "v1"
+        },
+        "body": "{\"action\":\"subscribe\",\"submission_id\":\"97cc0239-34fc-49d1-b87a-eb226ecc0e81\"}"
+    }
+
+
+@pytest.fixture()
+def websocket_event_bad_id():
+    ''' Generates API GW WebSocket Event'''
+
+    return {
+        "requestContext": {
+            "routeKey": "subscribe",
+            "eventType": "MESSAGE",
+            "connectionId": "Wk4xkcVCvHcCFjA=",
+            "stage": "v1"
+        },
+        "body": "{\"action\":\"subscribe\",\"submission_id\":\"97cc0239\"}"
+    }
+
+
+@pytest.fixture()
+def websocket_event_bad_body():
+    ''' Generates API GW WebSocket Event'''
+
+    return {
+        "requestContext": {
+            "routeKey": "subscribe",
+            "eventType": "MESSAGE",
+            "connectionId": "Wk4xkcVCvHcCFjA=",
+            "stage": "v1"
+        },
+        "body": "{\"malformed\"}"
+    }
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+def test_lambda_handler(websocket_event):
+    boto3.setup_default_session()
+    client = boto3.client('dynamodb', region_name='us-west-2')
+    client.create_table(
+        TableName='TEST_REPORT_TABLE',
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'GSI1',
+                'KeySchema': [
+                    {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                    {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                }
+            }
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+            {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    ret = app.lambda_handler(websocket_event, None)
+    assert ret['statusCode'] == 200
+    data = json.loads(ret['body'])
+    assert data['type'] == 'subscribed'
+    assert data['submission_id'] == '97cc0239-34fc-49d1-b87a-eb226ecc0e81'
+    response = client.get_item(
+        TableName=os.environ['REPORT_TABLE'],
+        Key={
+            'pk': {'S': 'submission_97cc0239-34fc-49d1-b87a-eb226ecc0e81'},
+            'sk': {'S': 'connection_Wk4xkcVCvHcCFjA='}
+        },
+    )
+    assert response['Item']['connection_id']['S'] == 'Wk4xkcVCvHcCFjA='
+    assert 'expires_at' in response['Item']
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+def test_lambda_handler_bad_submission_id(websocket_event_bad_id):
+    ret = app.lambda_handler(websocket_event_bad_id, None)
+    assert ret['statusCode'] == 400
+    data = json.loads(ret['body'])
+    assert data['type'] == 'error'
+    assert data[
+               'reason'] == 'Invalid submission_id. Submission ID must be UUIDv4 format.'
+
+
+@mock_dynamodb
+@mock.patch.dict(os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'})
+def test_lambda_handler_bad_body(websocket_event_bad_body):
+    ret = app.lambda_handler(websocket_event_bad_body, None)
+    assert ret['statusCode'] == 400
+    data = json.loads(ret['body'])
+    assert data['reason'] == 'Invalid subscribe format. Must have an JSON body.'
@@ -0,0 +1,137 @@
+import os
+from decimal import Decimal
+from unittest import mock
+
+import boto3
+import pytest
+from boto3.dynamodb.conditions import Key
+from moto import mock_dynamodb
+
+from sam.process_upload import app as process_upload
+from sam.train_report_weights import app
+
+
+@pytest.fixture()
+def report_table():
+    with mock_dynamodb(), mock.patch.dict(
+            os.environ, {'REPORT_TABLE': 'TEST_REPORT_TABLE'}):
+        dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
+        table = dynamodb.create_table(
+            TableName='TEST_REPORT_TABLE',
+            KeySchema=[
+                {'AttributeName': 'pk', 'KeyType': 'HASH'},
+                {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    'IndexName': 'GSI1',
+                    'KeySchema': [
+                        {'AttributeName': 'gsi1pk', 'KeyType': 'HASH'},
+                        {'AttributeName': 'gsi1sk', 'KeyType': 'RANGE'},
+                    ],
+                    'Projection': {
+                        'ProjectionType': 'ALL'
+                    }
+                }
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'pk', 'AttributeType': 'S'},
+                {'AttributeName': 'sk', 'AttributeType': 'S'},
+                {'AttributeName': 'gsi1pk', 'AttributeType': 'S'},
+                {'AttributeName': 'gsi1sk', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        for report_id, labels in (('report-1', ['Fire Hydrant', 'Hydrant']),
+                                  ('report-2', ['Traffic Light']),
+                                  ('report-3', ['Vehicle'])):
+            table.put_item(Item={'pk': 'reports', 'sk': report_id,
+                                 'labels': labels})
+        yield table
+
+
+def put_submissions(table, count):
+    # Citizens pick report-3 for cars, which the catalog doesn't know about,
+    # and report-1 for hydrants
+    with table.batch_writer() as batch:
+        for n in range(count):
+            submission_id = f"97cc0239-34fc-49d1-b87a-{n:012d}"
+            if n % 2:
+                labels = {'Car': Decimal('91.000'), 'Road': Decimal('80.000')}
+                selected = ['report-3']
+            else:
+                labels = {'Fire Hydrant': Decimal('95.725'),
+                          'Road': Decimal('80.000')}
+                selected = ['report-1']
+            batch.put_item(Item={
+                'pk': f"submission_{submission_id}",
+                'sk': f"submission_{submission_id}",
+                'gsi1pk': 'resolved' if n % 3 else 'submitted',
+                'gsi1sk': f"2022-07-20T17:47:{n % 60:02d}.012Z",
+                'ml_labels': labels,
+                'selected_reports': selected
+            })
+        # Still pending, nothing selected yet
+        batch.put_item(Item={
+            'pk': 'submission_pending', 'sk': 'submission_pending',
+            'gsi1pk': 'pending', 'gsi1sk': '2022-07-20T17:47:00.012Z',
+            'ml_labels': {'Car': Decimal('91.000')}
+        })
+
+
+def test_lambda_handler_publishes_weights(report_table):
+    put_submissions(report_table, 60)
+    app.lambda_handler({}, None)
+    version = report_table.get_item(Key=app.CATALOG_VERSION_KEY)['Item']
+    assert version['catalog_version'] == 1
+    assert version['weights_submission_count'] == 60
+    weights = {x['sk']: x['label_weights'] for x in report_table.query(
+        KeyConditionExpression=Key('pk').eq(version['weights_pk']))['Items']}
+    assert set(weights) == {'report-1', 'report-3'}
+    assert weights['report-3']['Car'] > 1
+    assert 'Car' not in weights['report-1']
+    # Road is on both, so it tells nothing apart
+    assert 'Road' not in weights['report-3']
+    # process_upload now suggests report-3 for cars
+    ranker = process_upload.report_ranker()
+    assert ranker.version == 1
+    assert list(ranker.rank({'Car': Decimal('90.000')})) == ['report-3']
+
+
+def test_lambda_handler_replaces_previous_weights(report_table):
+    def weights_count(weights_pk):
+        return report_table.query(
+            KeyConditionExpression=Key('pk').eq(weights_pk))['Count']
+
+    put_submissions(report_table, 60)
+    app.lambda_handler({}, None)
+    first = report_table.get_item(Key=app.CATALOG_VERSION_KEY)['Item']
+    app.lambda_handler({}, None)
+    version = report_table.get_item(Key=app.CATALOG_VERSION_KEY)['Item']
+    assert version['catalog_version'] == 2
+    assert version['weights_pk'] != first['weights_pk']
+    assert version['previous_weights_pk'] == first['weights_pk']
+    # Still there for a ProcessUpload which read the first version
+    assert weights_count(first['weights_pk']) == 2
+    app.lambda_handler({}, None)
+    version = report_table.get_item(Key=app.CATALOG_VERSION_KEY)['Item']
+    assert weights_count(first['weights_pk']) == 0
+    assert weights_count(version['previous_weights_pk']) == 2
+
+
+def test_lambda_handler_too_few_submissions(report_table):
+    put_submissions(report_table, 10)
+    app.lambda_handler({}, None)
+    assert 'Item' not in report_table.get_item(Key=app.CATALOG_VERSION_KEY)
+
+
+def test_training_set():
+    features, targets, vocabulary = app.training_set(
+        [({'Car': Decimal('90.000')}, ['report-3', 'report-3']),
+         ({'Hydrant': Decimal('50.000')}, ['report-1', 'report-2']),
+         # Reports no longer in the catalog are ignored
+         ({'Tree': Decimal('70.000')}, ['report-9'])],
+        ['report-1', 'report-2', 'report-3'])
+    assert vocabulary == ['Car', 'Hydrant']
+    assert features.toarray().tolist() == [[0.9, 0], [0, 0.5]]
+    assert targets.toarray().tolist() == [[0, 0, 1], [1, 1, 0]]
@@ -0,0 +1,213 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from os import environ
+
+import numpy as np
+import simplejson as json
+from boto3.dynamodb.conditions import Key
+from loguru import logger
+from scipy import optimize, sparse
+from scipy.special import expit
+
+from dl_suggestion_common import (log_event, metrics, status_keys, table,
+                                  with_metrics)
+
+# Learns label -> report weights from what citizens actually selected for
+# their submissions, so process_upload suggests the reports people pick. One
+# logistic regression per report is fitted over the Rekognition label
+# confidences of every submitted (and resolved) submission, and the positive
+# coefficients are published as a new catalog version, on a schedule.
+
+# Bumped by SeedDDBData whenever the reports change, and here whenever new
+# weights are published
+CATALOG_VERSION_KEY = {'pk': 'catalog', 'sk': 'version'}
+WEIGHTS_PK_PREFIX = 'report_weights_'
+# Statuses of submissions which have selected_reports
+TRAINING_STATUSES = ('submitted', 'resolved')
+# Submissions whose gradient is computed at once, which bounds the memory
+# the dense submission x report products take
+TRAINING_BATCH_SIZE = 1024
+
+
+@with_metrics('TrainReportWeights')
+def lambda_handler(event, context):
+    log_event(event)
+    report_ids = catalog_report_ids()
+    with metrics().timer('LoadSubmissions'):
+        features, targets, vocabulary = training_set(submissions(), report_ids)
+    metrics().put_metric('SubmissionCount', features.shape[0], 'Count')
+    if features.shape[0] < int(environ.get('TRAINING_MIN_SUBMISSIONS', 50)):
+        logger.info(
+            f"Only {features.shape[0]} Submissions to Learn From, Not Training")
+        return
+    with metrics().timer('Fit'):
+        coefficients = fit(features, targets,
+                           float(environ.get('TRAINING_L2', 0.01)))
+    weights = report_weights(coefficients, vocabulary, report_ids,
+                             float(environ.get('TRAINING_MIN_WEIGHT', 0.1)))
+    metrics().put_metric('LearnedWeightCount',
+                         sum(len(x) for x in weights.values()), 'Count')
+    publish(weights, features.shape[0])
+
+
+def catalog_report_ids():
+    report_ids = []
+    kwargs = {'KeyConditionExpression': Key('pk').eq('reports'),
+              'ProjectionExpression': 'sk'}
+    while True:
+        response = table().query(**kwargs)
+        report_ids += [x['sk'] for x in response['Items']]
+        if 'LastEvaluatedKey' not in response:
+            return report_ids
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def submissions():
+    # Yields (ml_labels, selected_reports) page by page, so the submissions
+    # themselves are never all held at once
+    for key in [x for status in TRAINING_STATUSES for x in
+                status_keys(status)]:
+        kwargs = {
+            'IndexName': 'GSI1',
+            'KeyConditionExpression': Key('gsi1pk').eq(key),
+            'ProjectionExpression': 'ml_labels, selected_reports'
+        }
+        while True:
+            response = table().query(**kwargs)
+            for item in response['Items']:
+                if item.get('ml_labels') and item.get('selected_reports'):
+                    yield item['ml_labels'], item['selected_reports']
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def training_set(examples, report_ids):
+    # A sparse submission x label matrix of confidences (0-1), a sparse
+    # submission x report matrix of selections and the label of each column
+    report_index = {x: i for i, x in enumerate(report_ids)}
+    label_index = {}
+    rows, columns, values = [], [], []
+    target_rows, target_columns = [], []
+    row = 0
+    for labels, selected_reports in examples:
+        selected = [report_index[x] for x in set(selected_reports) if
+                    x in report_index]
+        if not selected:
+            continue
+        for label, confidence in labels.items():
+            rows.append(row)
+            columns.append(label_index.setdefault(label, len(label_index)))
+            values.append(float(confidence) / 100)
+        target_rows += [row] * len(selected)
+        target_columns += selected
+        row += 1
+    features = sparse.csr_matrix((values, (rows, columns)),
+                                 shape=(row, len(label_index)))
+    targets = sparse.csr_matrix(
+        (np.ones(len(target_rows)), (target_rows, target_columns)),
+        shape=(row, len(report_ids)))
+    return features, targets, list(label_index)
+
+
+def fit(features, targets, l2):
+    # The label x report coefficients of a one-vs-rest logistic regression
+    # with L2 regularization, fitted with L-BFGS. Reports nobody selected
+    # have nothing to learn from and keep zero coefficients.
+    all_report_count = targets.shape[1]
+    learned = np.flatnonzero(targets.getnnz(axis=0))
+    targets = targets[:, learned]
+    label_count = features.shape[1]
+    report_count = len(learned)
+
+    def objective(params):
+        weights = params[:-report_count].reshape(label_count, report_count)
+        bias = params[-report_count:]
+        loss = 0.0
+        weights_gradient = np.zeros_like(weights)
+        bias_gradient = np.zeros_like(bias)
+        for start in range(0, features.shape[0], TRAINING_BATCH_SIZE):
+            x = features[start:start + TRAINING_BATCH_SIZE]
+            y = targets[start:start + TRAINING_BATCH_SIZE].toarray()
+            z = x @ weights + bias
+            loss += np.sum(np.logaddexp(0, z) - y * z)
+            error = expit(z) - y
+            weights_gradient += x.T @ error
+            bias_gradient += error.sum(axis=0)
+        n = features.shape[0]
+        loss = loss / n + l2 / 2 * np.sum(weights ** 2)
+        gradient = np.concatenate([
+            (weights_gradient / n + l2 * weights).ravel(), bias_gradient / n])
+        return loss, gradient
+
+    result = optimize.minimize(
+        objective, np.zeros((label_count + 1) * report_count), jac=True,
+        method='L-BFGS-B',
+        options={'maxiter': int(environ.get('TRAINING_MAX_ITERATIONS', 200))})
+    logger.debug(f"Fit after {result.nit} Iterations: {result.message}")
+    coefficients = np.zeros((label_count, all_report_count))
+    coefficients[:, learned] = result.x[:-report_count].reshape(
+        label_count, report_count)
+    return coefficients
+
+
+def report_weights(coefficients, vocabulary, report_ids, min_weight):
+    # report id: {label: weight} for the coefficients of at least min_weight
+    weights = {}
+    for column in range(coefficients.shape[1]):
+        rows = np.flatnonzero(coefficients[:, column] >= min_weight)
+        if len(rows):
+            weights[report_ids[column]] = {
+                vocabulary[row]: Decimal(float(coefficients[row, column])).quantize(
+                    Decimal("1.000")) for row in rows}
+    return weights
+
+
+def publish(weights, submission_count):
+    # The weights are written to a partition of their own before the catalog
+    # version points process_upload at it, so nothing ever ranks with half of
+    # them. The partition it replaces is kept as the previous one, as a
+    # ProcessUpload which read the version just before may still be compiling
+    # its ranker from it. The one before that, from a run (a day) ago, is
+    # deleted.
+    weights_pk = WEIGHTS_PK_PREFIX + str(uuid.uuid4())
+    with table().batch_writer() as batch:
+        for report_id, label_weights in weights.items():
+            batch.put_item(Item={'pk': weights_pk, 'sk': report_id,
+                                 'label_weights': label_weights})
+    response = table().update_item(
+        Key=CATALOG_VERSION_KEY,
+        UpdateExpression='ADD catalog_version :one SET previous_weights_pk = if_not_exists(weights_pk, :weights_pk), weights_pk = :weights_pk, weights_submission_count = :submission_count, timestamp_trained = :timestamp_trained',
+        ExpressionAttributeValues={
+            ':one': 1,
+            ':weights_pk': weights_pk,
+            ':submission_count': submission_count,
+            ':timestamp_trained': datetime.utcnow().isoformat()[:-3] + 'Z'
+        },
+        ReturnValues='ALL_OLD'
+    )
+    previous = response.get('Attributes', {})
+    logger.info(
+        f"Published Weights for {len(weights)} Reports as Catalog Version {previous.get('catalog_version', 0) + 1}")
+    # The first run kept its own partition as the previous one
+    stale_pk = previous.get('previous_weights_pk')
+    if stale_pk and stale_pk != previous.get('weights_pk'):
+        delete_weights(stale_pk)
+    return weights_pk
+
+
+def delete_weights(weights_pk):
+    kwargs = {'KeyConditionExpression': Key('pk').eq(weights_pk),
+              'ProjectionExpression': 'pk, sk'}
+    with table().batch_writer() as batch:
+        while True:
+            response = table().query(**kwargs)
+            for item in response['Items']:
+                batch.delete_item(Key={'pk': item['pk'], 'sk': item['sk']})
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
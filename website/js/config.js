@@ -6,5 +6,6 @@ let awsConfigOptions = {
     identity_pool_id: "REPLACE_ME_IDENTITY_POOL_ID",
     unique_suffix: "REPLACE_ME_UNIQUE_SUFFIX",
     api_base_url: "REPLACE_ME_API_BASE_URL", // Omit trailing slash
+    websocket_url: "REPLACE_ME_WEBSOCKET_URL", // Omit trailing slash
     api_key: "REPLACE_ME_API_KEY"
 }
@@ -2,16 +2,11 @@
  * Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
  * SPDX-License-Identifier: MIT-0
  */
-AWS.config.update({
-    region: awsConfigOptions.identity_pool_id.split(':')[0],
-    credentials: new AWS.CognitoIdentityCredentials({
-        IdentityPoolId: awsConfigOptions.identity_pool_id
-    })
-});
-
 let myInput = document.getElementById('myFileInput');
 let myFileUploadLabel = document.getElementById('myFileUploadLabel');
 let submissionUUID = ''
+// What Rekognition reads from S3 at most, the API may allow less
+const MAX_UPLOAD_BYTES = 15 * 1024 * 1024
 function showPic() {
     if (myInput.files && myInput.files[0]) {
         let reader = new FileReader();
@@ -25,41 +20,102 @@ function showPic() {
     }
 }
 function sendPic() {
+    let file = myInput.files[0];
+    if (!file) {
+        return;
+    }
+    // Checked before asking for an upload, so nothing is left half started
+    if (file.size == 0) {
+        alert("The photo is empty, please choose another one");
+        return;
+    }
+    if (file.size > MAX_UPLOAD_BYTES) {
+        alert("The photo is too large, please choose a smaller one");
+        return;
+    }
     $("#upload-placeholder").unbind('click');
     $("#upload-preview-container").unbind('click');
-    let file = myInput.files[0];
-    submissionUUID = uuidv4()
-    let s3 = new AWS.S3({
-        apiVersion: "2006-03-01",
-    });
-    let upload = new AWS.S3.ManagedUpload({
-        service: s3,
-        params: {
-            Body: file,
-            Bucket: 'dl-suggest-blog-uploaded-images-' + awsConfigOptions.unique_suffix,
-            Key: `maint-img/${submissionUUID}`,
-        },
-    });
     $('#upload-progress-bar').css("display", "flex");
     $('#upload-selector').slideUp()
-    upload.on('httpUploadProgress', (event) => {
+    // The API picks the submission id and signs an upload which S3 only
+    // accepts for a photo of the type and size it allows.
+    $.ajax({
+        type: 'POST',
+        url: `${awsConfigOptions.api_base_url}/uploads`,
+        headers: {
+            "X-API-Key": awsConfigOptions.api_key
+        },
+        data: JSON.stringify({'content_type': file.type}),
+        success: function(upload) {
+            if (file.size > upload['max_bytes']) {
+                alert("The photo is too large, please choose a smaller one");
+                resetUpload();
+                return;
+            }
+            submissionUUID = upload['submission_id']
+            // Subscribe before uploading so the processing result can't be
+            // pushed before we are listening for it.
+            subscribeToSubmission(submissionUUID).then(() => uploadPic(file, upload));
+        },
+        error: function(result) {
+            console.log(result)
+            alert("Only JPEG and PNG photos can be uploaded, please try again");
+            resetUpload();
+        }
+    });
+}
+function resetUpload() {
+    // Back to choosing a photo, after one which didn't go through
+    $('#upload-progress-bar').css("display", "none");
+    $('#upload-progress-bar .progress-bar').css('width', '0%').attr('aria-valuenow', 0).text('')
+        .removeClass('progress-bar-striped').removeClass('progress-bar-animated');
+    $('#upload-selector').slideDown();
+    bindUploadSelector();
+}
+function bindUploadSelector() {
+    $("#upload-placeholder").click(function(){ $('#myFileInput').trigger('click'); });
+    $("#upload-preview-container").click(function(){ $('#myFileInput').trigger('click'); });
+}
+function uploadPic(file, upload) {
+    let form = new FormData();
+    for (const [name, value] of Object.entries(upload['fields'])) {
+        form.append(name, value);
+    }
+    // The file has to be the last field of the form
+    form.append('file', file);
+    let request = new XMLHttpRequest();
+    request.upload.addEventListener('progress', (event) => {
         let pct = Math.floor(event.loaded * 100 / event.total)
         $('#upload-progress-bar .progress-bar').css('width', pct+'%').attr('aria-valuenow', pct);
         if (pct > 30) {
             $('#upload-progress-bar .progress-bar').text('Uploading');
         }
     });
-    upload.send(function (err, data) {
-        if (err) {
-            console.log("Error", err.code, err.message);
+    request.onload = function () {
+        if (request.status !== 204) {
+            console.log("Error", request.status, request.responseText);
             alert("There was an error uploading the file, please try again");
+            resetUpload();
         } else {
             $('#upload-progress-bar .progress-bar').text('Processing');
             $('#upload-progress-bar .progress-bar').addClass('progress-bar-striped').addClass('progress-bar-animated');
-            window.pollLimit = 100
-            getSubmissionLongPoll(submissionUUID)
+            window.uploadComplete = true
+            if (window.submissionSubscribed) {
+                // The result will be pushed over the WebSocket, only poll if
+                // it never shows up.
+                window.pushFallbackTimer = setTimeout(startLongPoll, 15000);
+            } else {
+                startLongPoll()
+            }
         }
-    });
+    };
+    request.onerror = function () {
+        console.log("Error", request.status);
+        alert("There was an error uploading the file, please try again");
+        resetUpload();
+    };
+    request.open('POST', upload['url'], true);
+    request.send(form);
 }
 myInput.addEventListener('change', showPic, false);
 myFileUploadLabel.addEventListener('click', sendPic, false);
@@ -103,10 +159,71 @@ function displayProcessedImage(submission_data) {
     $("#reports").show();
 }
 
+function subscribeToSubmission(subUUID) {
+    // Resolves once the subscription is acknowledged, or once we give up on
+    // it. Either way the upload goes ahead, falling back to polling.
+    return new Promise((resolve) => {
+        window.submissionSubscribed = false
+        window.submissionFinished = false
+        window.uploadComplete = false
+        if (!('WebSocket' in window) || !awsConfigOptions.websocket_url) {
+            resolve();
+            return;
+        }
+        let socket = new WebSocket(awsConfigOptions.websocket_url);
+        let ackTimer = setTimeout(resolve, 3000);
+        socket.onopen = function () {
+            socket.send(JSON.stringify({
+                'action': 'subscribe',
+                'submission_id': subUUID
+            }));
+        };
+        socket.onmessage = function (e) {
+            let message = JSON.parse(e.data);
+            if (message['type'] == 'subscribed') {
+                window.submissionSubscribed = true
+                clearTimeout(ackTimer);
+                resolve();
+            } else if (message['type'] == 'submission') {
+                clearTimeout(window.pushFallbackTimer);
+                socket.close();
+                if (!window.submissionFinished) {
+                    window.submissionFinished = true
+                    displayProcessedImage(message['submission']);
+                }
+            } else if (message['type'] == 'discarded') {
+                clearTimeout(window.pushFallbackTimer);
+                socket.close();
+                window.submissionFinished = true
+                console.log("Upload Discarded", message['reason']);
+                alert("The uploaded file could not be processed (" + message['reason'] + "), please try again");
+                resetUpload();
+            }
+        };
+        socket.onclose = function () {
+            clearTimeout(ackTimer);
+            resolve();
+            // Lost the socket after the upload without a result, poll instead.
+            if (window.uploadComplete && window.submissionSubscribed && !window.submissionFinished && window.pollLimit === undefined) {
+                clearTimeout(window.pushFallbackTimer);
+                startLongPoll();
+            }
+        };
+    });
+}
+
+function startLongPoll() {
+    window.pollLimit = 100
+    getSubmissionLongPoll(submissionUUID)
+}
+
 async function getSubmissionLongPoll(subUUID) {
     const submission_data = await getSubmission(subUUID);
 
-    if (submission_data) {
+    if (window.submissionFinished) {
+        return
+    } else if (submission_data) {
+        window.submissionFinished = true
         displayProcessedImage(submission_data);
     } else if (window.pollLimit == 0) {
         console.log("Submission Polling Timeout")
@@ -134,12 +251,6 @@ async function getSubmission(subUUID) {
     }
 }
 
-function uuidv4() {
-    return ([1e7]+-1e3+-4e3+-8e3+-1e11).replace(/[018]/g, c =>
-        (c ^ crypto.getRandomValues(new Uint8Array(1))[0] & 15 >> c / 4).toString(16)
-    );
-}
-
 $(document).ready(function() {
     let request = new XMLHttpRequest();
     request.open("GET", `${awsConfigOptions.api_base_url}/reports`, true);
@@ -220,5 +331,4 @@ $("#reports-submit").click(function(e) {
     });
 });
 
-$("#upload-placeholder").click(function(){ $('#myFileInput').trigger('click'); });
-$("#upload-preview-container").click(function(){ $('#myFileInput').trigger('click'); });
\ No newline at end of file
+bindUploadSelector();
\ No newline at end of file